@@ -1,8 +1,11 @@
 import streamlit as st
 import utils.conf as config
-from recommend_rag import get_recommendation, get_vectorstore as get_vectorstore_logic
+from recommend_rag import Recommender, get_library_graph, get_rag_chain, store_key, store_registry
 import streamlit.components.v1 as components
-import utils.prep as prep
+import threading
+from contextlib import ExitStack
+from utils import tracing
+from utils.store_version import read_store_version
 
 
 cfg = config.load_config("configs/config.yaml")
@@ -10,12 +13,113 @@ chat_model = cfg.get("chat_model")
 embed_model = cfg.get("embed_model")
 persist_dir = cfg.get("persist_dir")
 goodreads_csv_path = cfg.get("goodreads_csv_path") 
+embed_cache_dir = cfg.get("embed_cache_dir", "embedding_cache")
+embed_cache_size = int(cfg.get("embed_cache_size", 100000))
+index_backend = cfg.get("index_backend", "chroma")
+
+libraries = {"My library": persist_dir, **(cfg.get("libraries") or {})}
+max_open_stores = int(cfg.get("max_open_stores", 4))
+max_open_stores_mb = float(cfg.get("max_open_stores_mb", 0))
+graph_max_nodes = int(cfg.get("graph_max_nodes", 300))
+catalog_index_dir = cfg.get("catalog_index_dir", "catalog_index")
+
+@st.cache_resource
+def warm_libraries():
+    # Once per server process: open the first few libraries in the background so
+    # the first question against each of them does not pay for loading the index.
+    store_registry.resize(max_open_stores, int(max_open_stores_mb * 2**20))
+    for library_dir in list(libraries.values())[:max_open_stores]:
+        store_registry.warm(Recommender.from_config(cfg, library_dir).key)
+    # LangChain is only imported once it is needed; have the chain ready before the first question.
+    threading.Thread(target=get_rag_chain, args=(chat_model,), daemon=True).start()
 
 @st.cache_resource
-def load_cached_vectorstore(persist_dir: str, embed_model: str):
+def get_trace_buffer():
+    # The last requests' traces, kept per server process for the diagnostics panel.
+    tracing.configure_tracing(cfg)
+    return tracing.add_exporter(tracing.RingBufferExporter(50))
+
+def render_diagnostics(slot, n=10):
+    traces = get_trace_buffer().recent(n)
+    with slot:
+        if not traces:
+            st.caption("No requests traced yet.")
+            return
+        rows = []
+        for trace in reversed(traces):
+            llm = next((s for s in trace.spans if s["name"] == "llm_generate"), {})
+            rows.append({
+                "request": trace.name,
+                "total ms": round(trace.duration_ms, 1),
+                "cached": trace.attributes.get("cached"),
+                **{name: round(ms, 1) for name, ms in trace.stage_ms().items()},
+                "prompt tokens": llm.get("prompt_tokens"),
+                "output tokens": llm.get("output_tokens"),
+            })
+        st.dataframe(rows, hide_index=True)
+
+@st.cache_data(max_entries=16, show_spinner="Drawing your reading graph...")
+def graph_html(library_dir, store_version, shelves, top_authors, min_author_books, max_nodes, _vectorstore):
+    # Re-drawn only when the library changes or a filter is moved.
+    from graph_builder import render_html
+    graph = get_library_graph(_vectorstore, library_dir, store_version)
+    books, hidden = graph.select(shelves, top_authors, min_author_books, max_nodes)
+    return render_html(graph.to_networkx(books, hidden)), len(books), int(hidden.sum())
+
+def render_graph_tab(vectorstore, library_dir):
+    if not vectorstore:
+        st.info("Load a library to see its reading graph.")
+        return
+    if not st.toggle("Show my reading graph", value=False, key="graph_toggle"):
+        st.caption("You, your books and their authors. Big libraries are trimmed to the node budget below.")
+        return
+    col1, col2, col3, col4 = st.columns(4)
+    shelves = col1.multiselect("Shelves", ["read", "to-read", "dnf", "did-not-finish"], default=["read", "dnf"])
+    top_authors = col2.number_input("Top authors (0 = all)", min_value=0, max_value=1000, value=0, step=5)
+    min_author_books = col3.slider("Min. books per author", min_value=1, max_value=10, value=1)
+    max_nodes = col4.slider("Node budget", min_value=50, max_value=1000, value=graph_max_nodes, step=50)
+
+    html, n_shown, n_hidden = graph_html(
+        library_dir, read_store_version(library_dir), tuple(shelves), int(top_authors), min_author_books,
+        max_nodes, vectorstore
+    )
+    st.caption(f"Showing {n_shown} books" + (f" · {n_hidden} more summarized per shelf" if n_hidden else ""))
+    components.html(html, height=720)
+
+def render_discover_tab(vectorstore, library_dir, rating_boost, dnf_penalty):
+    from discover import discover, get_catalog_index
+    if get_catalog_index(catalog_index_dir) is None:
+        st.info("Run 'python discover.py --build' to search every blurb you have ever fetched.")
+        return
+    if not vectorstore:
+        st.info("Load a library to find books like your favourites.")
+        return
+    if not st.toggle("Find books like my favourites", value=False, key="discover_toggle"):
+        st.caption("Books from every blurb you have fetched that you haven't read yet, matched to your "
+                   "4-5 star books and steered away from your DNFs by the reranking weights.")
+        return
+    col1, col2 = st.columns(2)
+    top = col1.slider("Suggestions", min_value=5, max_value=50, value=20, step=5, key="discover_top")
+    n_tastes = col2.slider("Tastes", min_value=1, max_value=8, value=4, key="discover_tastes",
+                           help="Your loved books are grouped into this many tastes; each is searched separately.")
+    results = discover(cfg, library_dir, top, rating_boost=rating_boost, dnf_penalty=dnf_penalty,
+                       n_tastes=n_tastes, index_dir=catalog_index_dir)
+    if not results:
+        st.info("Rate a few books 4 or 5 stars to get suggestions.")
+        return
+    st.dataframe(
+        [{"Title": r["title"], "Author": r["author"], "Match": r["score"], "Because you loved": r["because"]}
+         for r in results],
+        hide_index=True
+    )
+
+def load_vectorstore(library_dir: str, leases: ExitStack):
+    # Leased for the rest of this script run: another session opening its library
+    # may evict this one meanwhile, and an evicted store is only closed once unleased.
     try:
-        vectorstore = get_vectorstore_logic(persist_dir, embed_model)
-        return vectorstore
+        return leases.enter_context(store_registry.lease(
+            store_key(library_dir, embed_model, embed_cache_dir, embed_cache_size, index_backend)
+        ))
     except FileNotFoundError as e:
         st.error(f"Error: {e}. Please run 'ingest.py' first.")
         return None
@@ -26,13 +130,23 @@ def load_cached_vectorstore(persist_dir: str, embed_model: str):
 st.set_page_config(page_title="Book Preference LLM", page_icon="📚", layout="wide")
 st.title("Book Recommendation App")
 
-vectorstore = load_cached_vectorstore(persist_dir, embed_model)
+warm_libraries()
+get_trace_buffer()
 
-rag_tab, = st.tabs(["**📚 RAG Recommendation**"])
+rag_tab, graph_tab, discover_tab = st.tabs(
+    ["**📚 RAG Recommendation**", "**🕸️ Reading Graph**", "**✨ Discover**"]
+)
 
-with rag_tab:
+with rag_tab, ExitStack() as leases:
     with st.sidebar:
         st.header("Configuration")
+        if len(libraries) > 1:
+            library_name = st.selectbox("Library", list(libraries), key="library_select")
+        else:
+            library_name = next(iter(libraries))
+        library_dir = libraries[library_name]
+        vectorstore = load_vectorstore(library_dir, leases)
+
         k = st.slider(
             "Top-K similar books (for LLM context)", 
             min_value=3, 
@@ -57,6 +171,32 @@ with rag_tab:
             value=0.4, 
             step=0.05
         )
+
+        st.markdown("---")
+        explain = st.checkbox(
+            "Explain with the LLM",
+            value=True,
+            help="Unticked, you only get the instant 'will like' probability from your ratings."
+        )
+
+        if vectorstore:
+            cache_stats = vectorstore.embeddings.stats()
+            st.caption(
+                f"Embedding cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits · "
+                f"{cache_stats['misses']} misses"
+            )
+            registry_stats = store_registry.stats()
+            st.caption(f"Open libraries: {registry_stats['open']}/{registry_stats['max_open']} "
+                       f"(~{registry_stats['bytes'] / 2**20:.0f} MB)")
+
+        show_diagnostics = st.checkbox("Show diagnostics", value=False, help="Per-stage timings of the last requests.")
+        diagnostics_slot = st.container()
+
+    # Drawn before the analysis below, which may stop the script early.
+    with graph_tab:
+        render_graph_tab(vectorstore, library_dir)
+    with discover_tab:
+        render_discover_tab(vectorstore, library_dir, rating_boost, dnf_penalty)
     
     st.subheader("Blurb Analysis")
     blurb = st.text_area("Enter the blurb of the new book", height=200)
@@ -66,13 +206,21 @@ with rag_tab:
             st.error("Vector store is not loaded. Cannot proceed.")
             st.stop()
 
+        recommender = Recommender.from_config(cfg, library_dir)
+        try:
+            like_probability = recommender.like_probability(blurb)
+        except Exception as e:
+            st.error(f"An unexpected error occurred: {e}")
+            st.stop()
+        if like_probability is None:
+            st.info("Rate a few books (or shelve some as DNF) to get a quick 'will like' probability.")
+        else:
+            st.metric("Will like", f"{like_probability:.0%}")
+
         with st.spinner("Querying your reading history and applying reranking..."):
             try:
-                rag_out = get_recommendation(
+                rag_out = recommender.recommend(
                     blurb=blurb, 
-                    persist_dir=persist_dir, 
-                    chat_model=chat_model, 
-                    embed_model=embed_model, 
                     k=k,
                     rating_boost=rating_boost,
                     dnf_penalty=dnf_penalty
@@ -82,7 +230,10 @@ with rag_tab:
                 st.stop()
 
         st.markdown("### 📚 Personalized Analysis")
-        st.write(rag_out["explanation"])
+        if rag_out.get("cached"):
+            st.caption("⚡ Served from the response cache")
+        # Reserve the spot above the contexts; the explanation streams into it once they are shown.
+        analysis_slot = st.container()
 
         if rag_out['contexts']:
             with st.expander(f"🔎 Top {len(rag_out['contexts'])} reranked books from your history (Context)"):
@@ -100,7 +251,7 @@ with rag_tab:
                         st.caption(f"**Shelf:** {meta.get('shelf','N/A')} · **Rating:** {meta.get('rating',0)}★")
                     
                     with col2:
-                        adjustment = meta.get('adjustment', 0.0)
+                        adjustment = d.adjustment
                         if adjustment < 0:
                             score_color = "green"
                         elif adjustment > 0:
@@ -109,7 +260,7 @@ with rag_tab:
                             score_color = "grey"
                             
                         st.markdown(
-                            f"**Orig. Score:** {meta.get('original_score', 0.0):.3f} "
+                            f"**Orig. Score:** {d.original_score:.3f} "
                             f"| <span style='color:{score_color}'>**Adj:** {adjustment:+.2f}</span>",
                             unsafe_allow_html=True
                         )
@@ -119,5 +270,20 @@ with rag_tab:
                     
                     if meta.get('my_review'):
                         st.markdown(f"**My Review:** {meta.get('my_review').replace(chr(10), '  \n> ')}")
-                    
 
+        if not explain:
+            with analysis_slot:
+                st.caption("Tick 'Explain with the LLM' in the sidebar for the full analysis.")
+            rag_out["trace"].finish()
+            if show_diagnostics:
+                render_diagnostics(diagnostics_slot)
+            st.stop()
+
+        with analysis_slot:
+            try:
+                st.write_stream(rag_out["stream"])
+            except Exception as e:
+                st.error(f"An unexpected error occurred while generating the analysis: {e}")
+
+    if show_diagnostics:
+        render_diagnostics(diagnostics_slot)
@@ -0,0 +1,202 @@
+"""Score a whole shelf of candidate books in one go.
+
+By default every book on your 'to-read' shelf is scored; pass --input to score
+an external CSV with title, author and blurb columns instead. Results are
+appended to a JSONL file as they finish, so an interrupted run resumes where it
+stopped, and a ranked CSV is written at the end.
+
+    python batch_predict.py --output to_read_predictions.jsonl --workers 2
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import utils.conf as config
+import utils.prep as prep
+from recommend_rag import (
+    get_vectorstore, get_library_table, build_context_string, get_rag_chain, parse_verdict
+)
+from utils.context_budget import ContextBudget
+from utils.embed_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from utils.embed_pipeline import AdaptiveEmbedder
+from utils.rerank import rank_candidates_batch
+from utils.store_version import read_store_version
+from utils.vector_index import search_by_vectors
+
+QUERY_BLOCK = 256
+
+
+def load_candidates(args, cfg):
+    """Return a list of {book_id, title, author, blurb} dicts to score."""
+    if args.input:
+        # Everything here is text; ids in particular must not turn into floats around a blank one.
+        df = pd.read_csv(args.input, dtype=str)
+        df.columns = [col.lower().replace(' ', '_').replace('-', '_') for col in df.columns]
+        if 'blurb' not in df.columns:
+            raise ValueError(f"'{args.input}' needs a 'blurb' column.")
+        df = df.fillna('')
+        book_ids = df['book_id'].astype(str) if 'book_id' in df.columns else pd.Series(
+            [f"row-{i}" for i in range(len(df))], index=df.index
+        )
+        return [
+            {"book_id": book_id, "title": row.get('title', 'N/A'), "author": row.get('author', 'N/A'),
+             "blurb": str(row['blurb']).strip()}
+            for book_id, (_, row) in zip(book_ids, df.iterrows())
+        ]
+
+    return [
+        {"book_id": doc.metadata["book_id"], "title": doc.metadata["title"],
+         "author": doc.metadata["author"], "blurb": doc.page_content}
+        for chunk in prep.iter_prepped_chunks(
+            cfg.get("goodreads_csv_path", "utils/goodreads_with_blurbs.csv"),
+            parquet_cache=cfg.get("prep_cache_path") or None
+        )
+        for doc in prep.iter_book_documents(chunk[chunk['exclusive_shelf'] == 'to-read'])
+    ]
+
+
+def load_done(output_path):
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["book_id"])
+            except (json.JSONDecodeError, KeyError):
+                continue  # torn last line from an interrupted run
+    return done
+
+
+def retrieve_contexts(vectorstore, table, vectors, candidates, k, rating_boost, dnf_penalty, candidate_pool):
+    """Retrieval and reranking for all candidates as block matrix operations."""
+    n_results = min(candidate_pool + 1, len(table))
+    contexts = []
+    for start in range(0, len(candidates), QUERY_BLOCK):
+        block = candidates[start:start + QUERY_BLOCK]
+        ids, distances = search_by_vectors(vectorstore, vectors[start:start + QUERY_BLOCK], n_results)
+        rows = np.array([table.rows(row_ids) for row_ids in ids])
+        # A to-read book is in the store itself; it must not be its own evidence.
+        self_rows = table.rows([c["book_id"] for c in block])
+        rows[rows == self_rows[:, None]] = -1
+        contexts.extend(rank_candidates_batch(table, rows, distances, k, rating_boost, dnf_penalty))
+    return contexts
+
+
+def predict_one(candidate, contexts, chat_model, context_budget):
+    if not contexts:
+        return "No relevant books found in your reading history."
+    return get_rag_chain(chat_model).invoke({
+        "query": candidate["blurb"], "context": build_context_string(contexts, context_budget)
+    })
+
+
+def write_ranked_csv(jsonl_path, csv_path):
+    records = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    df = pd.DataFrame(records)
+    if df.empty:
+        return 0
+    verdict_order = {"like": 0, "unclear": 1, "dislike": 2}
+    df = df.assign(_verdict_rank=df['verdict'].map(verdict_order))
+    df = df.sort_values(['_verdict_rank', 'neighbor_score']).drop(columns=['_verdict_rank'])
+    df.to_csv(csv_path, index=False, encoding='utf-8')
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a shelf of candidate books in bulk.")
+    parser.add_argument("--input", help="CSV with title, author, blurb (and optionally book_id) columns. "
+                                        "Defaults to the 'to-read' shelf of your Goodreads export.")
+    parser.add_argument("--output", default="batch_predictions.jsonl")
+    parser.add_argument("--csv-output", help="Ranked CSV written at the end (defaults to the JSONL name).")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent LLM generations.")
+    parser.add_argument("--k", type=int, help="Context books per prediction (defaults to config k).")
+    parser.add_argument("--rating-boost", type=float, default=0.3)
+    parser.add_argument("--dnf-penalty", type=float, default=0.4)
+    args = parser.parse_args()
+
+    cfg = config.load_config("configs/config.yaml")
+    k = args.k or int(cfg.get("k", 5))
+    chat_model = cfg.get("chat_model")
+    persist_dir = cfg.get("persist_dir")
+    context_budget = ContextBudget.from_config(cfg)
+
+    candidates = load_candidates(args, cfg)
+    done = load_done(args.output)
+    todo = [c for c in candidates if c["book_id"] not in done]
+    print(f"{len(candidates)} candidate books, {len(candidates) - len(todo)} already scored, {len(todo)} to go.")
+
+    if todo:
+        vectorstore = get_vectorstore(
+            persist_dir,
+            cfg.get("embed_model"),
+            cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+            int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+            cfg.get("index_backend", "chroma")
+        )
+        table = get_library_table(vectorstore, read_store_version(persist_dir))
+
+        embedder = AdaptiveEmbedder(vectorstore.embeddings)
+        vectors = np.asarray(embedder.embed([c["blurb"] for c in todo]), dtype=np.float32)
+        print(embedder.report())
+
+        start = time.perf_counter()
+        contexts = retrieve_contexts(
+            vectorstore, table, vectors, todo, k, args.rating_boost, args.dnf_penalty,
+            int(cfg.get("candidate_pool", 100))
+        )
+        print(f"Retrieved and reranked contexts in {time.perf_counter() - start:.2f}s.")
+
+        start = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        try:
+            with open(args.output, "a", encoding="utf-8") as out:
+                futures = {
+                    pool.submit(predict_one, candidate, ctx, chat_model, context_budget): (candidate, ctx)
+                    for candidate, ctx in zip(todo, contexts)
+                }
+                for n, future in enumerate(as_completed(futures), start=1):
+                    candidate, ctx = futures[future]
+                    try:
+                        explanation = future.result()
+                    except Exception as e:
+                        print(f"  ! {candidate['title']}: {e} (will be retried on the next run)")
+                        continue
+                    record = {
+                        "book_id": candidate["book_id"],
+                        "title": candidate["title"],
+                        "author": candidate["author"],
+                        "verdict": parse_verdict(explanation),
+                        "neighbor_score": float(np.mean([c.rerank_score for c in ctx])) if ctx else None,
+                        "context_titles": [c.metadata.get("title", "N/A") for c in ctx],
+                        "explanation": explanation,
+                    }
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    print(f"  [{n}/{len(todo)}] {candidate['title']}: {record['verdict']}")
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(f"\nInterrupted. Finished predictions are in '{args.output}'; re-run to resume.")
+            return
+        pool.shutdown()
+        elapsed = time.perf_counter() - start
+        print(f"Generated {len(todo)} verdicts in {elapsed:.1f}s ({len(todo) / elapsed:.2f} books/s).")
+
+    csv_path = args.csv_output or os.path.splitext(args.output)[0] + ".csv"
+    written = write_ranked_csv(args.output, csv_path) if os.path.exists(args.output) else 0
+    print(f"Ranked {written} books into '{csv_path}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Speed and recall of the IVF catalog index (utils/ann_index.py) against exact search.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ann --books 300000 --dim 768 --queries 200
+
+The catalog is made of clustered unit vectors (books of a genre sit close
+together, like real blurb embeddings do). Queries are taste centroids (the
+mean of a few books of one genre) and single books, nudged off the catalog,
+searched `--batch` at a time. Reports, as JSON, build time and size, exact
+search per query, and latency and recall@k of the IVF search for each n_probe.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.ann_index import IVFIndex, recall_at_k
+from utils.vector_index import normalize_rows
+
+BLOCK = 50000
+
+
+def synthetic_catalog(n_books, dim, n_genres, spread, seed=0):
+    rng = np.random.default_rng(seed)
+    genres = normalize_rows(rng.standard_normal((n_genres, dim)))
+    labels = rng.integers(0, n_genres, n_books)
+    vectors = np.empty((n_books, dim), dtype=np.float32)
+    for start in range(0, n_books, BLOCK):
+        block = labels[start:start + BLOCK]
+        noise = rng.standard_normal((len(block), dim)).astype(np.float32) * spread / np.sqrt(dim)
+        vectors[start:start + len(block)] = normalize_rows(genres[block] + noise)
+    return vectors, labels
+
+
+def synthetic_queries(vectors, labels, n_queries, books_per_taste=5, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in range(n_queries):
+        if i % 2 == 0:
+            genre = labels[rng.integers(len(labels))]
+            members = rng.choice(np.flatnonzero(labels == genre), books_per_taste)
+            queries.append(vectors[members].mean(axis=0))
+        else:
+            queries.append(vectors[rng.integers(len(vectors))])
+    noise = rng.standard_normal((n_queries, vectors.shape[1])) * 0.3 / np.sqrt(vectors.shape[1])
+    return normalize_rows(np.asarray(queries) + noise)
+
+
+def time_per_query(fn, queries, batch, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(queries), batch):
+            fn(queries[i:i + batch])
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=300000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--genres", type=int, default=2000, help="Clusters in the synthetic catalog.")
+    parser.add_argument("--spread", type=float, default=1.0, help="How far books stray from their genre.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=4,
+                        help="Queries searched together, like the tastes of one discover.py call.")
+    parser.add_argument("--n-lists", type=int, help="IVF clusters (default: about sqrt(books)).")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    vectors, labels = synthetic_catalog(args.books, args.dim, args.genres, args.spread)
+    queries = synthetic_queries(vectors, labels, args.queries)
+    ids = [str(i) for i in range(args.books)]
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        index = IVFIndex.build(index_dir, vectors, ids, n_lists=args.n_lists)
+        build_s = time.perf_counter() - start
+        size_mb = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)) / 2**20
+        del vectors
+
+        start = time.perf_counter()
+        index = IVFIndex.load(index_dir)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        exact_ms = time_per_query(lambda q: index.exact_search(q, args.k), queries, args.batch, repeats=1)
+        rows = []
+        for n_probe in args.n_probe:
+            ms = time_per_query(lambda q: index.search(q, args.k, n_probe), queries, args.batch)
+            rows.append({
+                "n_probe": n_probe,
+                f"recall@{args.k}": round(recall_at_k(index, queries, args.k, n_probe), 4),
+                "ms_per_query": round(ms, 3),
+                "speedup": round(exact_ms / ms, 1),
+            })
+        report = {
+            "books": args.books, "dim": args.dim, "clusters": len(index.centroids), "queries": args.queries,
+            "build_s": round(build_s, 2), "load_ms": round(load_ms, 2), "index_mb": round(size_mb, 1),
+            "exact_ms_per_query": round(exact_ms, 3), "ivf": rows,
+        }
+        del index
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
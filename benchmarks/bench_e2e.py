@@ -0,0 +1,285 @@
+"""End-to-end benchmark of every pipeline stage against local Ollama stand-ins.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_e2e --books 5000 --queries 50 --output bench.json
+    python -m benchmarks.bench_e2e --books 5000 --queries 50 --baseline bench.json
+
+Stages: prep (CSV -> documents), graph (knowledge graph), rerank (hybrid
+rerank + context selection), ingest (ingest.py into a fresh store), recommend
+(get_recommendation with the LLM, then the taste-model verdict for the
+same, already embedded, blurbs). Each stage runs in its own process, so the
+reported peak RSS belongs to that stage alone. With --baseline, any metric that
+got worse by more than --tolerance is listed and the exit code is 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["prep", "graph", "rerank", "ingest", "recommend"]
+
+
+def latency_stats(seconds, prefix=""):
+    ms = np.asarray(seconds) * 1000
+    return {f"{prefix}p50_ms": float(np.percentile(ms, 50)), f"{prefix}p95_ms": float(np.percentile(ms, 95))}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB elsewhere
+
+
+# --- Stages (each runs inside a child process, cwd = workdir) ----------------
+
+def stage_prep(args):
+    import utils.prep as prep
+    start = time.perf_counter()
+    df = prep.load_and_prep_data("export.csv")
+    loaded = time.perf_counter()
+    docs = prep.create_book_documents(df)
+    done = time.perf_counter()
+    return {"rows": len(docs), "load_s": loaded - start, "documents_s": done - loaded,
+            "rows_per_s": len(docs) / (done - start)}
+
+
+def stage_graph(args):
+    import utils.prep as prep
+    from graph_builder import DEFAULT_NODE_BUDGET, LibraryGraph, build_knowledge_graph
+    df = prep.load_and_prep_data("export.csv")
+    start = time.perf_counter()
+    graph = build_knowledge_graph(df)
+    elapsed = time.perf_counter() - start
+
+    # What the app draws: the cached table trimmed to the node budget.
+    library_graph = LibraryGraph.from_dataframe(df)
+    start = time.perf_counter()
+    view = library_graph.to_networkx(*library_graph.select(max_nodes=DEFAULT_NODE_BUDGET))
+    view_s = time.perf_counter() - start
+    return {"rows": len(df), "nodes": graph.number_of_nodes(), "edges": graph.number_of_edges(),
+            "build_s": elapsed, "rows_per_s": len(df) / elapsed,
+            "view_nodes": view.number_of_nodes(), "view_ms": view_s * 1000}
+
+
+def stage_rerank(args):
+    from utils.rerank import LibraryTable, hybrid_rerank, rank_candidates_batch
+    rng = np.random.default_rng(0)
+    shelves = rng.choice(["read", "to-read", "dnf"], args.books, p=[0.6, 0.3, 0.1])
+    metadatas = [{"rating": int(rng.integers(0, 6)) if s == "read" else 0, "shelf": str(s)} for s in shelves]
+    table = LibraryTable([str(i) for i in range(args.books)], metadatas)
+    pool = min(args.candidate_pool, args.books)
+    n_queries = max(args.queries, 200)
+    rows = np.stack([rng.choice(args.books, pool, replace=False) for _ in range(n_queries)])
+    scores = np.sort(rng.uniform(0.2, 1.6, (n_queries, pool)), axis=1)
+
+    per_query = []
+    for q in range(n_queries):
+        start = time.perf_counter()
+        hybrid_rerank(scores[q], table.liked[rows[q]], table.dnf[rows[q]], 0.3, 0.4)
+        per_query.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    rank_candidates_batch(table, rows, scores, args.k, 0.3, 0.4)
+    batch_s = time.perf_counter() - start
+    return {"queries": n_queries, "candidate_pool": pool, **latency_stats(per_query, "hybrid_rerank_"),
+            "rank_batch_queries_per_s": n_queries / batch_s}
+
+
+def stage_ingest(args):
+    import ingest
+    sys.argv = ["ingest.py"]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        ingest.main()
+    elapsed = time.perf_counter() - start
+    import pandas as pd
+    n_docs = len(pd.read_csv("export.csv", usecols=["Exclusive Shelf"]).query(
+        "`Exclusive Shelf` in ['read', 'dnf', 'did-not-finish', 'to-read']"))
+    return {"documents": n_docs, "ingest_s": elapsed, "docs_per_s": n_docs / elapsed}
+
+
+def stage_recommend(args):
+    from benchmarks.synthetic import FAVOURITE, HATED, query_blurbs
+    from recommend_rag import get_recommendation, parse_verdict, predict_like_probability
+    import utils.conf as config
+    cfg = config.load_config("configs/config.yaml")
+    common = dict(persist_dir=cfg["persist_dir"], embed_model=cfg["embed_model"],
+                  embed_cache_dir=cfg["embed_cache_dir"], index_backend=cfg["index_backend"])
+    queries = query_blurbs(args.queries + 1)
+
+    start = time.perf_counter()
+    get_recommendation(queries[0][0], chat_model=cfg["chat_model"], k=args.k, use_cache=False, **common)
+    cold_s = time.perf_counter() - start
+
+    latencies, correct, judged = [], 0, 0
+    for blurb, genre in queries[1:]:
+        start = time.perf_counter()
+        out = get_recommendation(blurb, chat_model=cfg["chat_model"], k=args.k, use_cache=False, **common)
+        latencies.append(time.perf_counter() - start)
+        if genre in FAVOURITE | HATED:
+            judged += 1
+            correct += parse_verdict(out["explanation"]) == ("like" if genre in FAVOURITE else "dislike")
+
+    verdict_latencies = []
+    for blurb, _ in queries[1:]:
+        start = time.perf_counter()
+        predict_like_probability(blurb, **common)
+        verdict_latencies.append(time.perf_counter() - start)
+
+    return {"queries": len(latencies), "cold_first_query_ms": cold_s * 1000, **latency_stats(latencies),
+            "queries_per_s": len(latencies) / sum(latencies),
+            "verdict_agreement": correct / judged if judged else None,
+            **latency_stats(verdict_latencies, "verdict_only_")}
+
+
+def run_stage(args):
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(args.workdir)
+    result = globals()[f"stage_{args.run_stage}"](args)
+    result["peak_rss_mb"] = peak_rss_mb()
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+# --- Orchestration ------------------------------------------------------------
+
+def prepare_workdir(workdir, args):
+    from benchmarks.synthetic import synthetic_export
+    synthetic_export(args.books, seed=args.seed).to_csv(os.path.join(workdir, "export.csv"), index=False)
+    os.makedirs(os.path.join(workdir, "configs"), exist_ok=True)
+    with open(os.path.join(workdir, "configs", "config.yaml"), "w", encoding="utf-8") as f:
+        f.write(
+            'persist_dir: "store"\n'
+            'chat_model: "stub-chat"\n'
+            'embed_model: "stub-embed"\n'
+            'goodreads_csv_path: "export.csv"\n'
+            f"k: {args.k}\n"
+            f"candidate_pool: {args.candidate_pool}\n"
+            f'index_backend: "{args.index_backend}"\n'
+            'embed_cache_dir: "embedding_cache"\n'
+        )
+
+
+def run_child(stage, args, workdir, env):
+    result_path = os.path.join(workdir, f"{stage}.result.json")
+    cmd = [sys.executable, "-m", "benchmarks.bench_e2e", "--run-stage", stage, "--workdir", workdir,
+           "--result", result_path, "--books", str(args.books), "--queries", str(args.queries),
+           "--k", str(args.k), "--candidate-pool", str(args.candidate_pool)]
+    with open(os.path.join(workdir, f"{stage}.log"), "w") as log:
+        proc = subprocess.run(cmd, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        with open(os.path.join(workdir, f"{stage}.log"), "r") as log:
+            sys.stderr.write(log.read()[-4000:])
+        raise RuntimeError(f"stage '{stage}' failed (exit code {proc.returncode})")
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def regressions(current, baseline, tolerance):
+    """Metrics that got worse by more than `tolerance` (throughput down or time/memory up)."""
+    found = []
+    for stage, metrics in current["stages"].items():
+        for name, value in metrics.items():
+            old = baseline.get("stages", {}).get(stage, {}).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            if name.endswith("_per_s"):
+                worse = value < old * (1 - tolerance)
+            elif name.endswith(("_ms", "_s", "_mb")):
+                worse = value > old * (1 + tolerance)
+            else:
+                continue
+            if worse:
+                found.append({"stage": stage, "metric": name, "baseline": old, "current": value,
+                              "change": value / old - 1})
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=2000, help="Rows in the synthetic export.")
+    parser.add_argument("--queries", type=int, default=30, help="Recommendation queries to time.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--index-backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidate-pool", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=2.0, help="Stub latency per embed request.")
+    parser.add_argument("--llm-first-token-ms", type=float, default=50.0)
+    parser.add_argument("--llm-token-ms", type=float, default=1.0)
+    parser.add_argument("--workdir", help="Keep the synthetic export, store and logs here.")
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging.")
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(args)
+        return
+
+    sys.path.insert(0, REPO_ROOT)
+    from utils.stub_ollama import start_stub_ollama
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        os.makedirs(workdir, exist_ok=True)
+        print(f"Writing a synthetic export with {args.books} books to {workdir}...", file=sys.stderr)
+        prepare_workdir(workdir, args)
+
+        server, url = start_stub_ollama(
+            latency=args.embed_latency_ms / 1000,
+            first_token_latency=args.llm_first_token_ms / 1000,
+            token_latency=args.llm_token_ms / 1000,
+        )
+        env = dict(os.environ, OLLAMA_HOST=url, PYTHONWARNINGS="ignore")
+
+        stages = [s for s in STAGES if s in args.stages]
+        if "recommend" in stages and "ingest" not in stages and not os.path.exists(os.path.join(workdir, "store")):
+            stages.insert(stages.index("recommend"), "ingest")
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "settings": {"books": args.books, "queries": args.queries, "index_backend": args.index_backend,
+                         "k": args.k, "candidate_pool": args.candidate_pool,
+                         "embed_latency_ms": args.embed_latency_ms,
+                         "llm_first_token_ms": args.llm_first_token_ms, "llm_token_ms": args.llm_token_ms},
+            "stages": {},
+        }
+        for stage in stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            embeds_before, generations_before = server.embed_requests, server.generate_requests
+            result = run_child(stage, args, workdir, env)
+            if server.embed_requests - embeds_before:
+                result["embed_requests"] = server.embed_requests - embeds_before
+            if server.generate_requests - generations_before:
+                result["llm_requests"] = server.generate_requests - generations_before
+            report["stages"][stage] = result
+        server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = regressions(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} metric(s) regressed by more than {args.tolerance:.0%}.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare load time and query latency of the Chroma and NumPy index backends.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_index --books 10000 --dim 768 --queries 200
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+from langchain_community.vectorstores import Chroma
+
+from utils.vector_index import NumpyVectorStore, normalize_rows, search_by_vectors
+
+
+def synthetic_library(n_books, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(rng.standard_normal((n_books, dim)))
+    ids = [str(i) for i in range(n_books)]
+    metadatas = [
+        {"title": f"Book {i}", "author": f"Author {i % 97}", "rating": int(rng.integers(0, 6)),
+         "shelf": str(rng.choice(["read", "dnf", "to-read"]))}
+        for i in range(n_books)
+    ]
+    documents = [f"Blurb of book {i}" for i in range(n_books)]
+    return ids, vectors, metadatas, documents
+
+
+def build_chroma(path, ids, vectors, metadatas, documents):
+    store = Chroma(persist_directory=path)
+    batch = store._client.get_max_batch_size()
+    for i in range(0, len(ids), batch):
+        store._collection.upsert(ids=ids[i:i + batch], embeddings=vectors[i:i + batch],
+                                 metadatas=metadatas[i:i + batch], documents=documents[i:i + batch])
+
+
+def build_numpy(path, ids, vectors, metadatas, documents):
+    store = NumpyVectorStore.empty(path)
+    store.upsert(ids, vectors, metadatas, documents)
+    store.save()
+
+
+def open_chroma(path):
+    # Chroma shares clients per path inside a process; drop them to measure a cold open.
+    SharedSystemClient.clear_system_cache()
+    return Chroma(persist_directory=path)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def bench(name, open_store, path, queries, n_results):
+    start = time.perf_counter()
+    store = open_store(path)
+    # The first query pays for lazily loaded index segments, so it counts as part of loading.
+    search_by_vectors(store, queries[:1], n_results)
+    load_s = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search_by_vectors(store, [query], n_results)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    search_by_vectors(store, queries, n_results)
+    batch_s = time.perf_counter() - start
+
+    return {
+        "backend": name,
+        "load_and_first_query_ms": load_s * 1000,
+        "query_p50_ms": percentile_ms(latencies, 50),
+        "query_p95_ms": percentile_ms(latencies, 95),
+        "batched_queries_per_s": len(queries) / batch_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-results", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    ids, vectors, metadatas, documents = synthetic_library(args.books, args.dim)
+    queries = normalize_rows(np.random.default_rng(1).standard_normal((args.queries, args.dim)))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building both indexes for {args.books} books ({args.dim} dims)...")
+        build_chroma(f"{tmp}/chroma", ids, vectors, metadatas, documents)
+        build_numpy(tmp, ids, vectors, metadatas, documents)
+        results.append(bench("chroma", open_chroma, f"{tmp}/chroma", queries, args.n_results))
+        results.append(bench("numpy", NumpyVectorStore.load, tmp, queries, args.n_results))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'backend':<8} {'load+1st (ms)':>14} {'p50 (ms)':>9} {'p95 (ms)':>9} {'batched q/s':>12}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['load_and_first_query_ms']:>14.1f} {r['query_p50_ms']:>9.2f} "
+              f"{r['query_p95_ms']:>9.2f} {r['batched_queries_per_s']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Compare the column-wise document/graph prep with the original row-by-row versions.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_prep --rows 1000 10000 100000
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from langchain.docstore.document import Document
+
+import utils.prep as prep
+from graph_builder import build_knowledge_graph
+
+SHELVES = ['read', 'read', 'read', 'to-read', 'dnf', 'did-not-finish']
+BLURBS = ["A sweeping saga of dragons, betrayal and one very stubborn librarian.", "",
+          "No blurb found", "API Request Error: 429", "Book not found on Google Books."]
+
+
+def synthetic_export(n_rows, seed=0):
+    """A prepped Goodreads frame (the output of load_and_prep_data) with n_rows books."""
+    rng = np.random.default_rng(seed)
+    shelves = rng.choice(SHELVES, n_rows)
+    ratings = np.where(np.isin(shelves, ['read']), rng.integers(0, 6, n_rows), 0)
+    return pd.DataFrame({
+        'book_id': np.arange(n_rows),
+        'title': [f"Book {i}" for i in range(n_rows)],
+        'author': [f"Author {i}" for i in rng.integers(0, max(1, n_rows // 8), n_rows)],
+        'my_rating': ratings,
+        'number_of_pages': rng.integers(80, 900, n_rows),
+        'exclusive_shelf': shelves,
+        'my_review': rng.choice(['', 'Loved it.<br/>Would read again.', 'Meh.'], n_rows),
+        'blurb': [f"{BLURBS[i % len(BLURBS)]} #{i}" if i % len(BLURBS) == 0 else BLURBS[i % len(BLURBS)]
+                  for i in range(n_rows)],
+    })
+
+
+# --- The row-by-row versions these replaced ------------------------------
+
+def legacy_create_book_documents(df):
+    docs = []
+    for _, row in df.iterrows():
+        blurb_text = str(row.get('blurb', '')).strip()
+        review_text = str(row.get('my_review', '')).strip()
+        rating = row.get('my_rating', 0)
+        shelf = row.get('exclusive_shelf', 'unknown')
+        pages = row.get('number_of_pages', 'unknown')
+        title = row.get('title', 'N/A')
+        author = row.get('author', 'N/A')
+
+        page_content = blurb_text
+        if (not page_content or
+                'no blurb found' in page_content.lower() or
+                'book not found' in page_content.lower() or
+                'api request error' in page_content.lower()):
+            page_content = f"Title: {title}\nAuthor: {author}"
+            blurb_text = ""
+
+        meta = {
+            "title": title,
+            "author": author,
+            "rating": int(rating),
+            "pages": int(pages) if str(pages).isdigit() else 0,
+            "shelf": shelf,
+            "book_id": str(row.get('book_id', '')),
+            "clean_blurb": blurb_text,
+            "my_review": review_text.replace('<br/>', '\n') if review_text and review_text != 'nan' else "",
+            "user_verdict": ""
+        }
+        user_verdict = ""
+        if shelf in ['dnf', 'did-not-finish']:
+            user_verdict = "[USER OPINION: STRONGLY NEGATIVE (Did Not Finish)]"
+        elif rating >= 4:
+            user_verdict = f"[USER OPINION: EXTRAORDINARY ({rating}/5 stars)]"
+        elif rating == 3:
+            user_verdict = f"[USER OPINION: GOOD ({rating}/5 stars)]"
+        elif rating > 0:
+            user_verdict = f"[USER OPINION: NEGATIVE ({rating}/5 stars)]"
+        meta['user_verdict'] = user_verdict
+        docs.append(Document(page_content=page_content, metadata=meta))
+    return docs
+
+
+def legacy_build_knowledge_graph(df):
+    G = nx.Graph()
+    user_node = "You"
+    G.add_node(user_node, type="user", color="#FFD700")
+    for _, row in df.iterrows():
+        book_title = row.get('title', 'N/A')
+        author_name = row.get('author', 'N/A')
+        rating = row.get('my_rating', 0)
+        shelf = row.get('exclusive_shelf', 'unknown')
+        book_color = "#1f78b4"
+        if shelf in ['dnf', 'did-not-finish']:
+            book_color = "#e31a1c"
+        elif rating >= 4:
+            book_color = "#33a02c"
+        G.add_node(book_title, type="book", color=book_color, title=f"Rating: {rating}★\nShelf: {shelf}")
+        G.add_node(author_name, type="author", color="#6a3d9a")
+        G.add_edge(author_name, book_title, relation="WROTE")
+        edge_label = f"{rating}★"
+        if shelf in ['dnf', 'did-not-finish']:
+            edge_label = "DNF"
+        G.add_edge(user_node, book_title, relation="READ", rating=rating, shelf=shelf, label=edge_label)
+    return G
+
+
+# --- Harness -------------------------------------------------------------
+
+def timed(fn, df):
+    # Keep the progress bar out of the measurement and the output.
+    with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = fn(df)
+        return result, time.perf_counter() - start
+
+
+def same_documents(a, b):
+    # review_summary was added after the row-by-row version; everything else must match.
+    return len(a) == len(b) and all(
+        x.page_content == y.page_content
+        and x.metadata == {k: v for k, v in y.metadata.items() if k != "review_summary"}
+        for x, y in zip(a, b)
+    )
+
+
+def same_graph(legacy, new):
+    """Same nodes, colours and edges once the new graph's id keys are replaced by their labels.
+
+    Only holds for exports with unique titles, which the legacy graph needs anyway.
+    """
+    label = dict(new.nodes(data="label"))
+
+    def view(G, name):
+        nodes = {name(n): d["color"] for n, d in G.nodes(data=True)}
+        edges = sorted(repr((sorted((name(u), name(v))), d)) for u, v, d in G.edges(data=True))
+        return nodes, edges
+
+    return view(legacy, str) == view(new, label.get)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results = []
+    for n_rows in args.rows:
+        df = synthetic_export(n_rows)
+        old_docs, old_docs_s = timed(legacy_create_book_documents, df)
+        new_docs, new_docs_s = timed(prep.create_book_documents, df)
+        old_graph, old_graph_s = timed(legacy_build_knowledge_graph, df)
+        new_graph, new_graph_s = timed(build_knowledge_graph, df)
+        results.append({
+            "rows": n_rows,
+            "documents_legacy_s": old_docs_s,
+            "documents_vectorized_s": new_docs_s,
+            "documents_identical": same_documents(old_docs, new_docs),
+            "graph_legacy_s": old_graph_s,
+            "graph_vectorized_s": new_graph_s,
+            "graph_identical": same_graph(old_graph, new_graph),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'rows':>8} {'docs old (s)':>13} {'docs new (s)':>13} {'speedup':>8} "
+          f"{'graph old (s)':>14} {'graph new (s)':>14} {'speedup':>8}  identical")
+    for r in results:
+        print(f"{r['rows']:>8} {r['documents_legacy_s']:>13.3f} {r['documents_vectorized_s']:>13.3f} "
+              f"{r['documents_legacy_s'] / r['documents_vectorized_s']:>7.1f}x "
+              f"{r['graph_legacy_s']:>14.3f} {r['graph_vectorized_s']:>14.3f} "
+              f"{r['graph_legacy_s'] / r['graph_vectorized_s']:>7.1f}x  "
+              f"{'yes' if r['documents_identical'] and r['graph_identical'] else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
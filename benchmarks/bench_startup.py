@@ -0,0 +1,171 @@
+"""Startup and per-request overhead of the recommender against local Ollama stand-ins.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --books 2000 --queries 30
+
+Reports, as JSON:
+  import      time to import recommend_rag as it is now (LangChain and the Ollama
+              client are loaded on first use) and with them imported up front,
+              the way the module used to; each import runs in a fresh process
+  cold        in a fresh process: import, Recommender.warm() and the first answer
+  requests    per-request latency of the reused chain and pooled LLM client next
+              to building prompt, client and chain for every request
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks.bench_e2e import REPO_ROOT, latency_stats, prepare_workdir, run_child
+
+IMPORTS = {
+    "lazy": "import recommend_rag",
+    "eager": "import recommend_rag, langchain_ollama, langchain_community.vectorstores, "
+             "langchain_core.prompts, langchain_core.embeddings",
+}
+
+
+def time_import(statement, repeats):
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    seconds = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=REPO_ROOT, check=True,
+                             capture_output=True, text=True).stdout
+        seconds.append(float(out.strip().splitlines()[-1]))
+    return float(np.median(seconds)) * 1000
+
+
+def legacy_chain(chat_model, context_string):
+    """The chain as it used to be built for every request: new prompt, new client, new runnables."""
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+    from langchain_ollama import OllamaLLM
+    from recommend_rag import RAG_TEMPLATE
+    return (
+        {"context": RunnableLambda(lambda x: context_string), "query": RunnablePassthrough()}
+        | PromptTemplate.from_template(RAG_TEMPLATE)
+        | OllamaLLM(model=chat_model)
+        | StrOutputParser()
+    )
+
+
+def run_requests(args):
+    start = time.perf_counter()
+    import recommend_rag
+    import utils.conf as config
+    import_s = time.perf_counter() - start
+    cfg = config.load_config("configs/config.yaml")
+
+    start = time.perf_counter()
+    recommender = recommend_rag.Recommender.from_config(cfg).warm()
+    warm_s = time.perf_counter() - start
+
+    from benchmarks.synthetic import query_blurbs
+    queries = [blurb for blurb, _ in query_blurbs(args.queries + 1)]
+    start = time.perf_counter()
+    "".join(recommender.recommend(queries[0], args.k, use_cache=False)["stream"])
+    first_s = time.perf_counter() - start
+
+    setup_times, legacy_times, reused_times = [], [], []
+
+    def legacy(blurb):
+        with recommend_rag.store_registry.lease(recommender.key) as vectorstore:
+            store_version = recommend_rag.read_store_version(recommender.persist_dir)
+            table = recommend_rag.get_library_table(vectorstore, store_version)
+            contexts = recommend_rag.select_contexts(vectorstore, table, blurb, args.k, 0.3, 0.4,
+                                                     recommender.candidate_pool)
+        context_string = recommend_rag.build_context_string(contexts, recommender.context_budget)
+        setup = time.perf_counter()
+        chain = legacy_chain(recommender.chat_model, context_string)
+        setup_times.append(time.perf_counter() - setup)
+        return "".join(chain.stream(blurb))
+
+    def reused(blurb):
+        return "".join(recommender.recommend(blurb, args.k, use_cache=False)["stream"])
+
+    for blurb in queries[1:]:
+        # Alternate so that both see the same warm caches and the same stub load.
+        for fn, times in ((legacy, legacy_times), (reused, reused_times)):
+            start = time.perf_counter()
+            fn(blurb)
+            times.append(time.perf_counter() - start)
+
+    setup = time.perf_counter()
+    for _ in range(len(queries)):
+        recommender.chain
+    reused_setup_s = (time.perf_counter() - setup) / len(queries)
+
+    return {
+        "cold": {"import_ms": import_s * 1000, "warm_ms": warm_s * 1000, "first_answer_ms": first_s * 1000,
+                 "to_first_answer_ms": (import_s + warm_s + first_s) * 1000},
+        "requests": {"queries": len(reused_times),
+                     "legacy_chain_setup_ms": float(np.mean(setup_times)) * 1000,
+                     "reused_chain_setup_ms": reused_setup_s * 1000,
+                     **latency_stats(legacy_times, "legacy_"), **latency_stats(reused_times, "reused_")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=2000, help="Rows in the synthetic export.")
+    parser.add_argument("--queries", type=int, default=30, help="Requests to time per variant.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh processes per import measurement.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--llm-first-token-ms", type=float, default=20.0)
+    parser.add_argument("--llm-token-ms", type=float, default=0.5)
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    parser.add_argument("--run-requests", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_requests:
+        sys.path.insert(0, REPO_ROOT)
+        os.chdir(args.workdir)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(run_requests(args), f)
+        return
+
+    from utils.stub_ollama import start_stub_ollama
+
+    report = {"import": {f"{name}_ms": time_import(statement, args.repeats) for name, statement in IMPORTS.items()}}
+    report["import"]["saved_ms"] = report["import"]["eager_ms"] - report["import"]["lazy_ms"]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stage_args = SimpleNamespace(books=args.books, queries=args.queries, k=args.k, candidate_pool=100,
+                                     index_backend="chroma", seed=0)
+        prepare_workdir(workdir, stage_args)
+        server, url = start_stub_ollama(
+            first_token_latency=args.llm_first_token_ms / 1000,
+            token_latency=args.llm_token_ms / 1000,
+        )
+        env = dict(os.environ, OLLAMA_HOST=url, PYTHONWARNINGS="ignore")
+        print("Ingesting the synthetic export...", file=sys.stderr)
+        run_child("ingest", stage_args, workdir, env)
+
+        print("Timing cold start and requests...", file=sys.stderr)
+        result_path = os.path.join(workdir, "requests.result.json")
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--run-requests", "--workdir", workdir,
+                        "--result", result_path, "--queries", str(args.queries), "--k", str(args.k)],
+                       cwd=REPO_ROOT, env=env, check=True)
+        server.shutdown()
+        with open(result_path, "r", encoding="utf-8") as f:
+            report.update(json.load(f))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Synthetic Goodreads exports for the benchmarks.
+
+Books belong to genres with their own vocabulary and the fake reader has
+favourite and hated genres, so ratings follow the blurbs the way they do in a
+real library and retrieval/verdict quality can be sanity-checked too.
+"""
+import numpy as np
+import pandas as pd
+
+GENRES = {
+    "fantasy": "dragon magic sword prophecy kingdom sorceress quest realm ancient curse",
+    "scifi": "starship galaxy android colony quantum alien orbit empire signal reactor",
+    "mystery": "detective murder clue alibi inspector suspect victim secret manor poison",
+    "romance": "heart wedding summer letters bakery rival kiss small town second chance",
+    "horror": "ghost haunted cellar whisper blood ritual shadow asylum scream darkness",
+    "literary": "memory grief family river silence childhood island mother novel years",
+}
+COMMON = "a the of and in to her his their story new old world life one who must find".split()
+FAVOURITE, HATED = {"fantasy", "scifi"}, {"horror", "romance"}
+SHELVES = ["read", "read", "read", "read", "to-read", "to-read", "currently-reading", "dnf"]
+
+
+def synthetic_blurb(rng, genre, n_words=40):
+    vocab = GENRES[genre].split()
+    words = list(rng.choice(vocab, n_words // 2)) + list(rng.choice(COMMON, n_words - n_words // 2))
+    rng.shuffle(words)
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_export(n_books, seed=0, missing_blurb_rate=0.05):
+    """A DataFrame shaped like goodreads_with_blurbs.csv (raw export columns plus Blurb)."""
+    rng = np.random.default_rng(seed)
+    genres = rng.choice(list(GENRES), n_books)
+    shelves = rng.choice(SHELVES, n_books)
+    ratings = np.zeros(n_books, dtype=int)
+    for i, (genre, shelf) in enumerate(zip(genres, shelves)):
+        if shelf != "read":
+            continue
+        if genre in FAVOURITE:
+            ratings[i] = rng.choice([3, 4, 5, 5])
+        elif genre in HATED:
+            ratings[i] = rng.choice([1, 2, 2, 3])
+        else:
+            ratings[i] = rng.choice([0, 2, 3, 4])
+    hated_dnf = np.isin(genres, list(HATED)) & (shelves == "read") & (rng.random(n_books) < 0.2)
+    shelves = np.where(hated_dnf, "dnf", shelves)
+    ratings = np.where(shelves == "dnf", 0, ratings)
+
+    blurbs = [synthetic_blurb(rng, genre) for genre in genres]
+    missing = rng.random(n_books) < missing_blurb_rate
+    blurbs = ["No blurb found" if m else b for m, b in zip(missing, blurbs)]
+    authors = [f"Author {i}" for i in rng.integers(0, max(1, n_books // 6), n_books)]
+    isbn13 = 9780000000000 + np.arange(n_books)
+
+    return pd.DataFrame({
+        "Book Id": np.arange(1, n_books + 1),
+        "Title": [f"The {genre.title()} Book {i}" for i, genre in enumerate(genres)],
+        "Author": authors,
+        "Author l-f": authors,
+        "Additional Authors": "",
+        "ISBN": [f'="{n % 10**10:010d}"' for n in isbn13],
+        "ISBN13": [f'="{n}"' for n in isbn13],
+        "My Rating": ratings,
+        "Average Rating": np.round(rng.uniform(3.0, 4.8, n_books), 2),
+        "Publisher": "Synthetic Press",
+        "Binding": "Paperback",
+        "Number of Pages": rng.integers(120, 900, n_books),
+        "Year Published": rng.integers(1950, 2025, n_books),
+        "Date Added": "2024/01/01",
+        "Bookshelves": shelves,
+        "Exclusive Shelf": shelves,
+        "My Review": np.where(rng.random(n_books) < 0.15, "Could not put it down.<br/>Loved the ending.", ""),
+        "Read Count": (shelves == "read").astype(int),
+        "Blurb": blurbs,
+    })
+
+
+def query_blurbs(n_queries, seed=1):
+    """(blurb, genre) pairs for books that are not in any export."""
+    rng = np.random.default_rng(seed)
+    genres = rng.choice(list(GENRES), n_queries)
+    return [(synthetic_blurb(rng, genre), genre) for genre in genres]
@@ -0,0 +1,276 @@
+"""Find books you have not read yet in every blurb get_blurbs.py has ever fetched.
+
+The blurb cache grows with every export you run through get_blurbs.py (yours,
+a friend's, a big public list), so it can hold hundreds of thousands of books.
+--build embeds them all once into an IVF index (see utils/ann_index.py); after
+that, your tastes (clusters of the books you rated 4-5 stars, pushed away from
+your DNFs) are looked up in it in a few milliseconds.
+
+    python discover.py --build          # once, and again after fetching more blurbs
+    python discover.py --top 20         # books like the ones you loved
+    python discover.py --recall         # how close the fast search is to an exact one
+"""
+import argparse
+import json
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+
+import utils.conf as config
+from recommend_rag import get_embeddings, store_key, store_registry
+from utils.ann_index import IVFIndex, META_FILE, recall_at_k
+from utils.blurb_cache import BlurbCache, cache_keys
+from utils.embed_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES, text_key
+from utils.embed_pipeline import AdaptiveEmbedder
+from utils.rerank import is_dnf_shelf
+from utils.store_version import read_store_version
+from utils.taste_model import taste_queries
+
+DEFAULT_INDEX_DIR = "catalog_index"
+DEFAULT_N_PROBE = 16
+BUILD_CHUNK = 4096
+BUILD_FILE = "vectors.build.f32"
+
+
+def blurb_id(blurb):
+    # Short content hash: the same blurb fetched for two editions is one catalog entry.
+    return text_key(blurb)[:16]
+
+
+def catalog_metadata(blurb, keys):
+    meta = {"blurb_id": blurb_id(blurb), "key": keys[0]}
+    for key in keys:
+        kind, _, value = key.partition(":")
+        if kind == "title" and "title" not in meta:
+            meta["title"], _, meta["author"] = value.partition("|")
+        elif kind == "isbn13":
+            meta.setdefault("isbn13", value)
+    return meta
+
+
+def build_catalog_index(cfg, cache_path, index_dir, n_lists=None, max_batch_size=128, concurrency=2):
+    """Embed every found blurb in the cache and write the IVF index to `index_dir`."""
+    # The per-query cache would only be flushed by a catalog this size; talk to Ollama directly.
+    embeddings = get_embeddings(
+        cfg.get("embed_model"),
+        cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+        int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+    ).base
+    embedder = AdaptiveEmbedder(embeddings, max_batch_size=max_batch_size, max_concurrency=concurrency)
+    os.makedirs(index_dir, exist_ok=True)
+    build_path = os.path.join(index_dir, BUILD_FILE)
+    metadatas, texts, dim = [], [], None
+
+    cache = BlurbCache(cache_path)
+    # One pass over the cache: each block of blurbs is embedded and appended to the
+    # build file together with its metadata, so the two always line up even if
+    # get_blurbs writes to the cache meanwhile, and the blurbs never all sit in memory.
+    try:
+        print(f"Embedding the catalog blurbs from '{cache_path}'...")
+        with open(build_path, "wb") as out:
+            def flush():
+                nonlocal dim
+                block = np.asarray(embedder.embed(texts), dtype=np.float32)
+                block.tofile(out)
+                dim = block.shape[1]
+                texts.clear()
+                print(f"  ... embedded {len(metadatas)}")
+
+            for blurb, keys in cache.iter_found():
+                metadatas.append(catalog_metadata(blurb, keys))
+                texts.append(blurb)
+                if len(texts) == BUILD_CHUNK:
+                    flush()
+            if texts:
+                flush()
+    finally:
+        cache.close()
+    if not metadatas:
+        os.remove(build_path)
+        print(f"No blurbs in '{cache_path}'. Run utils/get_blurbs.py first.")
+        return None
+    print(embedder.report())
+    vectors = np.memmap(build_path, dtype=np.float32, mode="r", shape=(len(metadatas), dim))
+
+    print("Clustering the catalog...")
+    start = time.perf_counter()
+    index = IVFIndex.build(index_dir, vectors, [m["blurb_id"] for m in metadatas], metadatas, n_lists=n_lists)
+    del vectors
+    os.remove(build_path)
+    print(f"Built an index of {len(index)} books in {len(index.centroids)} clusters "
+          f"in {time.perf_counter() - start:.1f}s at '{index_dir}'.")
+    return index
+
+
+@lru_cache(maxsize=2)
+def _load_catalog_index(index_dir, version):
+    return IVFIndex.load(index_dir)
+
+
+def get_catalog_index(index_dir):
+    """The index in `index_dir`, loaded once and again only after a rebuild; None if there is none."""
+    if not IVFIndex.exists(index_dir):
+        return None
+    return _load_catalog_index(index_dir, os.path.getmtime(os.path.join(index_dir, META_FILE)))
+
+
+@lru_cache(maxsize=4)
+def get_library_vectors(vectorstore, store_version):
+    """(vectors, metadatas, owned) of the library; `owned` is what to leave out of the results."""
+    stored = vectorstore.get(include=["embeddings", "metadatas"])
+    metadatas = stored["metadatas"]
+    owned = {blurb_id(m['clean_blurb']) for m in metadatas if m.get('clean_blurb')}
+    owned |= {key for m in metadatas for key in cache_keys(None, None, m.get('title'), m.get('author'))}
+    return np.asarray(stored["embeddings"], dtype=np.float32), metadatas, frozenset(owned)
+
+
+@lru_cache(maxsize=8)
+def get_library_tastes(vectorstore, store_version, rating_boost, dnf_penalty, n_tastes):
+    """The library's taste queries, a loved book standing for each, and the books it already has."""
+    vectors, metadatas, owned = get_library_vectors(vectorstore, store_version)
+    liked = np.array([int(m.get('rating', 0) or 0) >= 4 for m in metadatas], dtype=bool)
+    dnf = np.array([is_dnf_shelf(m.get('shelf')) for m in metadatas], dtype=bool)
+    queries, members = taste_queries(vectors, liked, dnf, rating_boost, dnf_penalty, n_tastes)
+    examples = [metadatas[rows[0]].get('title', 'N/A') for rows in members]
+    return queries, examples, owned
+
+
+def library_key(cfg, persist_dir):
+    return store_key(
+        persist_dir,
+        cfg.get("embed_model"),
+        cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+        int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+        cfg.get("index_backend", "chroma"),
+    )
+
+
+def discover(cfg, persist_dir=None, top=20, n_probe=None, rating_boost=0.3, dnf_penalty=0.4, n_tastes=4,
+             index_dir=None):
+    """Up to `top` catalog books closest to the library's tastes, best first.
+
+    Each result is {title, author, isbn13, key, score, because}, `because` naming the
+    loved book that stands for the taste it matched. Returns [] without an index or
+    without any liked books.
+    """
+    index = get_catalog_index(index_dir or cfg.get("catalog_index_dir", DEFAULT_INDEX_DIR))
+    if index is None:
+        return []
+    persist_dir = persist_dir or cfg.get("persist_dir")
+    # The lease keeps the store open while it is read, even if another library evicts it meanwhile.
+    with store_registry.lease(library_key(cfg, persist_dir)) as vectorstore:
+        queries, examples, owned = get_library_tastes(
+            vectorstore, read_store_version(persist_dir), rating_boost, dnf_penalty, n_tastes
+        )
+    if len(queries) == 0:
+        return []
+    n_probe = n_probe or int(cfg.get("catalog_n_probe", DEFAULT_N_PROBE))
+
+    # The closest hits are often books the library already has; widen the search until enough are left.
+    k = top + 10
+    while True:
+        best = {}
+        for taste, (rows, sims) in enumerate(zip(*index.search(queries, k, n_probe))):
+            for row, sim in zip(rows.tolist(), sims.tolist()):
+                meta = index.metadatas[row]
+                if meta["blurb_id"] in owned or meta["key"] in owned:
+                    continue
+                if row not in best or sim > best[row][0]:
+                    best[row] = (sim, taste)
+        if len(best) >= top or k >= len(index):
+            break
+        k *= 4
+    ranked = sorted(best.items(), key=lambda item: -item[1][0])[:top]
+    return [{
+        "title": index.metadatas[row].get("title", "").title() or index.metadatas[row]["key"],
+        "author": index.metadatas[row].get("author", "").title(),
+        "isbn13": index.metadatas[row].get("isbn13"),
+        "key": index.metadatas[row]["key"],
+        "score": round(sim, 4),
+        "because": examples[taste],
+    } for row, (sim, taste) in ranked]
+
+
+def report_recall(cfg, args, index):
+    """Recall@k of the IVF search against exact search, for several n_probe, on real queries."""
+    with store_registry.lease(library_key(cfg, cfg.get("persist_dir"))) as vectorstore:
+        queries, _, _ = get_library_tastes(vectorstore, read_store_version(cfg.get("persist_dir")),
+                                           args.rating_boost, args.dnf_penalty, args.tastes)
+    # Single books make harder queries than taste centroids; mix both in.
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(index), min(args.recall_queries, len(index)), replace=False)
+    queries = np.vstack([queries, np.asarray(index.vectors[np.sort(sample)], dtype=np.float32)])
+
+    def ms_per_query(search):
+        # Searched as many at a time as one discover() call does.
+        start = time.perf_counter()
+        for i in range(0, len(queries), args.tastes):
+            search(queries[i:i + args.tastes])
+        return (time.perf_counter() - start) * 1000 / len(queries)
+
+    exact_ms = ms_per_query(lambda block: index.exact_search(block, args.top))
+    rows = []
+    for n_probe in sorted({1, 2, 4, 8, 16, 32, 64, args.n_probe or DEFAULT_N_PROBE}):
+        if n_probe > len(index.centroids):
+            continue
+        ms = ms_per_query(lambda block: index.search(block, args.top, n_probe))
+        rows.append({"n_probe": n_probe, f"recall@{args.top}": round(recall_at_k(index, queries, args.top, n_probe), 4),
+                     "ms_per_query": round(ms, 3)})
+    return {"books": len(index), "clusters": len(index.centroids), "queries": len(queries),
+            "exact_ms_per_query": round(exact_ms, 3), "ivf": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--build", action="store_true", help="(Re)build the catalog index from the blurb cache.")
+    parser.add_argument("--recall", action="store_true", help="Measure recall against exact search and exit.")
+    parser.add_argument("--top", type=int, default=20, help="How many books to suggest (and k for --recall).")
+    parser.add_argument("--n-probe", type=int, help="Clusters scanned per query (default: catalog_n_probe).")
+    parser.add_argument("--n-lists", type=int, help="Clusters to build (default: about sqrt of the catalog size).")
+    parser.add_argument("--tastes", type=int, default=4, help="Separate tastes to look for.")
+    parser.add_argument("--rating-boost", type=float, default=0.3)
+    parser.add_argument("--dnf-penalty", type=float, default=0.4)
+    parser.add_argument("--recall-queries", type=int, default=200, help="Catalog books added as --recall queries.")
+    parser.add_argument("--max-batch-size", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    cfg = config.load_config("configs/config.yaml")
+    index_dir = cfg.get("catalog_index_dir", DEFAULT_INDEX_DIR)
+
+    if args.build:
+        cache_path = cfg.get("blurb_cache_path", "utils/blurb_cache.sqlite")
+        if build_catalog_index(cfg, cache_path, index_dir, args.n_lists, args.max_batch_size,
+                               args.concurrency) is None:
+            return
+
+    index = get_catalog_index(index_dir)
+    if index is None:
+        print(f"No catalog index at '{index_dir}'. Run 'python discover.py --build' first.")
+        return
+
+    if args.recall:
+        print(json.dumps(report_recall(cfg, args, index), indent=2))
+        return
+
+    start = time.perf_counter()
+    results = discover(cfg, top=args.top, n_probe=args.n_probe, rating_boost=args.rating_boost,
+                       dnf_penalty=args.dnf_penalty, n_tastes=args.tastes, index_dir=index_dir)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+    if not results:
+        print("Nothing to suggest yet: rate a few books 4 or 5 stars and re-run ingest.py.")
+        return
+    print(f"{len(results)} books from a catalog of {len(index)} ({elapsed_ms:.0f} ms):\n")
+    for i, book in enumerate(results, 1):
+        print(f"{i:3d}. {book['title']} – {book['author'] or '?'}  ({book['score']:.3f}, "
+              f"because you loved {book['because']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Holdout evaluation of the two scoring paths.
+
+Hides a random share of your rated books, trains the quick taste model on the
+rest and asks both the taste model and the full RAG + LLM pipeline whether you
+liked the hidden books. Reports accuracy and per-book latency for each path.
+
+    python evaluate.py --holdout 0.2 --llm-samples 25
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import utils.conf as config
+from recommend_rag import (
+    get_vectorstore, get_library_table, build_context_string, get_rag_chain, parse_verdict
+)
+from utils.context_budget import ContextBudget
+from utils.embed_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from utils.rerank import rank_candidates
+from utils.store_version import read_store_version
+from utils.taste_model import TasteModel, like_labels
+from utils.vector_index import search_by_vectors
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "mean_ms": float(ms.mean())}
+
+
+def calibration_table(probs, labels, bins=5):
+    edges = np.linspace(0, 1, bins + 1)
+    rows = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (probs >= lo) & ((probs < hi) | (hi == 1.0))
+        if mask.any():
+            rows.append({"bin": f"{lo:.1f}-{hi:.1f}", "n": int(mask.sum()),
+                         "predicted": float(probs[mask].mean()), "observed": float(labels[mask].mean())})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of rated books to hide.")
+    parser.add_argument("--llm-samples", type=int, default=20,
+                        help="Hidden books also judged by the LLM path (0 skips it; it is slow).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    cfg = config.load_config("configs/config.yaml")
+    persist_dir = cfg.get("persist_dir")
+    vectorstore = get_vectorstore(
+        persist_dir,
+        cfg.get("embed_model"),
+        cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+        int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+        cfg.get("index_backend", "chroma")
+    )
+    table = get_library_table(vectorstore, read_store_version(persist_dir))
+
+    stored = vectorstore.get(include=["embeddings", "metadatas", "documents"])
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    labels = like_labels(stored["metadatas"])
+    labeled = np.flatnonzero(labels >= 0)
+    if len(labeled) < 10:
+        print("Not enough rated books for an evaluation (need at least 10).")
+        return
+
+    rng = np.random.default_rng(args.seed)
+    shuffled = rng.permutation(labeled)
+    n_test = max(1, int(len(shuffled) * args.holdout))
+    test, train = shuffled[:n_test], shuffled[n_test:]
+    y_test = labels[test].astype(np.float64)
+
+    # --- Fast path: taste model --------------------------------------------
+    model = TasteModel().fit(vectors[train], labels[train])
+    # Ingest put every stored blurb into the embedding cache; go around it to time what a new blurb costs.
+    embedder = getattr(vectorstore.embeddings, "base", vectorstore.embeddings)
+    embed_seconds, model_seconds, probs = [], [], []
+    for i in test:
+        start = time.perf_counter()
+        query_vector = embedder.embed_query(stored["documents"][i])
+        embed_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        probs.append(model.predict_proba(query_vector)[0])
+        model_seconds.append(time.perf_counter() - start)
+    probs = np.asarray(probs)
+    clipped = np.clip(probs, 1e-6, 1 - 1e-6)
+    report = {
+        "rated_books": int(len(labeled)),
+        "train": int(len(train)),
+        "test": int(n_test),
+        "majority_baseline_accuracy": float(max(y_test.mean(), 1 - y_test.mean())),
+        "taste_model": {
+            "accuracy": float(((probs >= 0.5) == (y_test == 1)).mean()),
+            "brier": float(((probs - y_test) ** 2).mean()),
+            "log_loss": float(-(y_test * np.log(clipped) + (1 - y_test) * np.log(1 - clipped)).mean()),
+            "latency_model_only": latency_summary(model_seconds),
+            "latency_embedding": latency_summary(embed_seconds),
+            "calibration": calibration_table(probs, y_test),
+        },
+    }
+
+    # --- Slow path: retrieval + LLM ----------------------------------------
+    if args.llm_samples > 0:
+        hidden_rows = table.rows([stored["ids"][i] for i in test])
+        candidate_pool = int(cfg.get("candidate_pool", 100))
+        n_results = min(candidate_pool + len(test), len(table))
+        k = int(cfg.get("k", 5))
+        context_budget = ContextBudget.from_config(cfg)
+        correct, decided, llm_seconds = 0, 0, []
+        for i in test[:args.llm_samples]:
+            start = time.perf_counter()
+            ids, distances = search_by_vectors(vectorstore, [vectors[i]], n_results)
+            rows = table.rows(ids[0])
+            # Hidden books must not serve as evidence for each other.
+            rows[np.isin(rows, hidden_rows)] = -1
+            contexts = rank_candidates(table, rows, distances[0], k, 0.3, 0.4)
+            explanation = get_rag_chain(cfg.get("chat_model")).invoke({
+                "query": stored["documents"][i], "context": build_context_string(contexts, context_budget)
+            })
+            llm_seconds.append(time.perf_counter() - start)
+            verdict = parse_verdict(explanation)
+            decided += verdict != "unclear"
+            correct += (verdict == "like") == (labels[i] == 1) and verdict != "unclear"
+        n_llm = len(llm_seconds)
+        report["llm"] = {
+            "samples": n_llm,
+            "accuracy": correct / n_llm,
+            "undecided": n_llm - decided,
+            "latency": latency_summary(llm_seconds),
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Rated books: {report['rated_books']} (train {report['train']}, hidden {report['test']})")
+    print(f"Majority-class baseline accuracy: {report['majority_baseline_accuracy']:.1%}")
+    fast = report["taste_model"]
+    print(f"\nTaste model:  accuracy {fast['accuracy']:.1%}, Brier {fast['brier']:.3f}, log loss {fast['log_loss']:.3f}")
+    print(f"  latency: model {fast['latency_model_only']['p50_ms']:.3f} ms p50, "
+          f"query embedding {fast['latency_embedding']['p50_ms']:.2f} ms p50")
+    print("  calibration (predicted vs observed like-rate):")
+    for row in fast["calibration"]:
+        print(f"    {row['bin']}: n={row['n']:<4} predicted {row['predicted']:.2f}  observed {row['observed']:.2f}")
+    if "llm" in report:
+        llm = report["llm"]
+        print(f"\nRAG + LLM:    accuracy {llm['accuracy']:.1%} on {llm['samples']} books "
+              f"({llm['undecided']} without a clear verdict)")
+        print(f"  latency: {llm['latency']['p50_ms']:.0f} ms p50, {llm['latency']['p95_ms']:.0f} ms p95")
+
+
+if __name__ == "__main__":
+    main()
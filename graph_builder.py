@@ -1,34 +1,174 @@
+import os
+
+import numpy as np
 import pandas as pd
 import networkx as nx
 
+from utils.goodreads_csv import book_keys
+
+DNF_SHELVES = ['dnf', 'did-not-finish']
+GRAPH_FILE = "knowledge_graph.pkl"
+DEFAULT_NODE_BUDGET = 300
+
+USER_NODE = "You"
+USER_COLOR, AUTHOR_COLOR, MORE_COLOR = "#FFD700", "#6a3d9a", "#b2b2b2"
+LIKED_COLOR, DNF_COLOR, BOOK_COLOR = "#33a02c", "#e31a1c", "#1f78b4"
+
+
+def _book_frame(keys, titles, authors, ratings, shelves):
+    books = pd.DataFrame({
+        "title": pd.Series(titles, dtype=object).fillna('N/A').astype(str).to_numpy(),
+        "author": pd.Series(authors, dtype=object).fillna('N/A').astype(str).to_numpy(),
+        "rating": pd.to_numeric(pd.Series(ratings), errors='coerce').fillna(0).astype(np.int16).to_numpy(),
+        "shelf": pd.Series(shelves, dtype=object).fillna('unknown').astype(str).to_numpy(),
+    }, index=pd.Index(keys, name="book_id", dtype=object))
+    # A book that appears twice keeps its last row, like the vector store does.
+    return books[~books.index.duplicated(keep='last')]
+
+
+class LibraryGraph:
+    """The reading graph kept as one row per book, keyed like the vector store.
+
+    The table is what gets cached, updated and filtered; a NetworkX graph is only
+    built, in bulk, for the part that is actually shown.
+    """
+
+    def __init__(self, books, store_version=None):
+        self.books = books
+        self.store_version = store_version
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """From a prepped export (the output of load_and_prep_data)."""
+        def column(name, default):
+            return df[name] if name in df.columns else pd.Series(default, index=df.index)
+        titles, authors = column('title', 'N/A'), column('author', 'N/A')
+        keys = book_keys(column('book_id', '').astype(str).fillna('nan'), titles, authors)
+        return cls(_book_frame(keys, titles, authors, column('my_rating', 0), column('exclusive_shelf', 'unknown')))
+
+    @classmethod
+    def from_metadatas(cls, ids, metadatas, store_version=None):
+        """From the ids and metadatas the vector store holds."""
+        return cls(_book_frame(
+            list(ids),
+            [m.get('title', 'N/A') for m in metadatas],
+            [m.get('author', 'N/A') for m in metadatas],
+            [m.get('rating', 0) for m in metadatas],
+            [m.get('shelf', 'unknown') for m in metadatas],
+        ), store_version)
+
+    # --- Keeping it in sync with the store ------------------------------------
+
+    def upsert(self, ids, metadatas):
+        if not ids:
+            return
+        changed = LibraryGraph.from_metadatas(ids, metadatas).books
+        self.books = pd.concat([self.books.drop(changed.index, errors='ignore'), changed])
+
+    def delete(self, ids):
+        self.books = self.books.drop(list(ids), errors='ignore')
+
+    def save(self, persist_dir, store_version):
+        self.store_version = store_version
+        books = self.books.copy()
+        books.attrs["store_version"] = store_version
+        path = os.path.join(persist_dir, GRAPH_FILE)
+        books.to_pickle(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, persist_dir):
+        path = os.path.join(persist_dir, GRAPH_FILE)
+        if not os.path.exists(path):
+            return None
+        books = pd.read_pickle(path)
+        return cls(books, books.attrs.get("store_version"))
+
+    # --- Filtering ------------------------------------------------------------
+
+    def author_counts(self, books=None):
+        books = self.books if books is None else books
+        return books['author'].value_counts()
+
+    def select(self, shelves=None, top_authors=None, min_author_books=1, max_nodes=DEFAULT_NODE_BUDGET):
+        """The books to draw, plus how many were left out for the node budget, per shelf.
+
+        `shelves` keeps only those shelves, `top_authors` only the authors with the
+        most books among them, and `min_author_books` only authors with at least that
+        many. If the rest still needs more than `max_nodes` nodes (you, the books and
+        their authors), the authors with the most books are kept first.
+        """
+        books = self.books
+        if shelves:
+            books = books[books['shelf'].isin(list(shelves))]
+        counts = self.author_counts(books)
+        if top_authors:
+            counts = counts.iloc[:top_authors]
+        counts = counts[counts >= min_author_books]
+        books = books[books['author'].isin(counts.index)]
+
+        n_nodes = 1 + len(books) + len(counts)
+        if n_nodes <= max_nodes:
+            return books, pd.Series(dtype=np.int64)
+
+        ordered = books.assign(_author_books=books['author'].map(counts)).sort_values(
+            ['_author_books', 'author', 'rating'], ascending=[False, True, False], kind='stable'
+        )
+        # One "+N more" node per shelf stands in for what does not fit.
+        room = max_nodes - 1 - ordered['shelf'].nunique()
+        nodes_used = np.cumsum(1 + (~ordered['author'].duplicated()).to_numpy())
+        shown = ordered.iloc[:int(np.searchsorted(nodes_used, room, side='right'))]
+        hidden = ordered.drop(shown.index)['shelf'].value_counts()
+        return shown.drop(columns='_author_books'), hidden
+
+    # --- NetworkX -------------------------------------------------------------
+
+    def to_networkx(self, books=None, hidden=None):
+        books = self.books if books is None else books
+        G = nx.Graph()
+        G.add_node(USER_NODE, type="user", color=USER_COLOR, label=USER_NODE)
+
+        ratings, shelves = books['rating'], books['shelf']
+        is_dnf = shelves.isin(DNF_SHELVES).to_numpy()
+        book_colors = np.select([is_dnf, (ratings >= 4).to_numpy()], [DNF_COLOR, LIKED_COLOR], default=BOOK_COLOR)
+        edge_labels = np.where(is_dnf, "DNF", ratings.astype(str) + "★")
+        book_nodes = ("book:" + books.index.astype(str)).tolist()
+        tooltips = (books['title'] + "\nRating: " + ratings.astype(str) + "★\nShelf: " + shelves).tolist()
+
+        authors = books['author'].unique().tolist()
+        G.add_nodes_from(
+            (f"author:{author}", {"type": "author", "color": AUTHOR_COLOR, "label": author}) for author in authors
+        )
+        G.add_nodes_from(
+            (node, {"type": "book", "color": color, "label": title, "title": tooltip, "book_id": book_id})
+            for node, color, title, tooltip, book_id in zip(
+                book_nodes, book_colors.tolist(), books['title'].tolist(), tooltips, books.index.tolist())
+        )
+        G.add_edges_from(
+            (f"author:{author}", node, {"relation": "WROTE"})
+            for author, node in zip(books['author'].tolist(), book_nodes)
+        )
+        G.add_edges_from(
+            (USER_NODE, node, {"relation": "READ", "rating": rating, "shelf": shelf, "label": label})
+            for node, rating, shelf, label in zip(
+                book_nodes, ratings.tolist(), shelves.tolist(), edge_labels.tolist())
+        )
+        for shelf, n in (hidden if hidden is not None else {}).items():
+            G.add_node(f"more:{shelf}", type="more", color=MORE_COLOR, label=f"+{n} more ({shelf})")
+            G.add_edge(USER_NODE, f"more:{shelf}", relation="READ", shelf=shelf)
+        return G
+
+
 def build_knowledge_graph(df: pd.DataFrame):
-    G = nx.Graph()
-    user_node = "You"
-    G.add_node(user_node, type="user", color="#FFD700") 
-
-    for _, row in df.iterrows():
-        book_title = row.get('title', 'N/A')
-        author_name = row.get('author', 'N/A')
-        rating = row.get('my_rating', 0)
-        shelf = row.get('exclusive_shelf', 'unknown')
-
-        book_color = "#1f78b4" 
-        if shelf in ['dnf', 'did-not-finish']:
-            book_color = "#e31a1c" 
-        elif rating >= 4:
-            book_color = "#33a02c" 
-
-    
-        G.add_node(book_title, type="book", color=book_color, title=f"Rating: {rating}★\nShelf: {shelf}")
-        G.add_node(author_name, type="author", color="#6a3d9a")
-
-       
-        G.add_edge(author_name, book_title, relation="WROTE")
-        
-        edge_label = f"{rating}★"
-        if shelf in ['dnf', 'did-not-finish']:
-            edge_label = "DNF"
-            
-        G.add_edge(user_node, book_title, relation="READ", rating=rating, shelf=shelf, label=edge_label)
-        
-    return G
\ No newline at end of file
+    return LibraryGraph.from_dataframe(df).to_networkx()
+
+
+def render_html(G, height="700px"):
+    """The graph as a standalone pyvis page, for st.components.v1.html."""
+    from pyvis.network import Network
+    net = Network(height=height, width="100%", cdn_resources="remote")
+    net.from_nx(G)
+    # Lay the graph out before showing it instead of animating every node in the browser.
+    net.set_options('{"physics": {"solver": "barnesHut", "stabilization": {"iterations": 150}}, '
+                    '"interaction": {"hideEdgesOnDrag": true}}')
+    return net.generate_html()
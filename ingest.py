@@ -1,68 +1,240 @@
 import utils.prep as ingest
+import utils.conf as config
+from utils.embed_pipeline import AdaptiveEmbedder
+from utils.embed_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from utils.store_version import (bump_store_version, mark_store_clean, mark_store_dirty, read_store_version,
+                                 store_is_dirty)
+from utils.vector_index import NumpyVectorStore
+from utils.taste_model import train_from_store
+from utils.taste_profile import TasteProfile
+from utils.context_budget import DEFAULT_REVIEW_TOKENS
+from utils.goodreads_csv import book_key
+from graph_builder import LibraryGraph
 from langchain_ollama import OllamaEmbeddings
 # [FIX 1] Import Chroma from langchain_community to fix the deprecation warning
 from langchain_community.vectorstores import Chroma
+import argparse
+import numpy as np
+import hashlib
 import os
 
-def main():
-    GOODREADS_CSV_PATH = "utils/goodreads_with_blurbs.csv"
-    PERSIST_DIRECTORY = "my_book_vectorstore"
-    EMBEDDING_MODEL = "nomic-embed-text"
+METADATA_UPDATE_BATCH = 500
+# Documents are embedded and written to Chroma in chunks of this size, so an
+# interrupted run keeps everything up to the last chunk (resume with --incremental).
+INSERT_CHUNK = 512
 
-    df = ingest.load_and_prep_data(GOODREADS_CSV_PATH)
-    if df is None or df.empty:
-        print("No data to process. Exiting.")
+
+def doc_id(doc):
+    return book_key(doc.metadata.get("book_id", ""), doc.metadata.get("title", ""), doc.metadata.get("author", ""))
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def keyed_documents(documents):
+    keyed = {}
+    for doc in documents:
+        doc.metadata["content_hash"] = content_hash(doc.page_content)
+        key = doc_id(doc)
+        if key in keyed:
+            print(f"Warning: duplicate book id '{key}' ({doc.metadata.get('title')}); keeping the last row.")
+        keyed[key] = doc
+    return keyed
+
+
+def plan_sync(keyed_docs, existing):
+    """Diff the fresh documents against what the store holds.
+
+    `existing` maps id -> stored metadata. Returns (to_embed, to_update, to_delete):
+    ids whose page_content is new or changed, ids where only metadata changed,
+    and ids that are no longer in the export.
+    """
+    to_embed, to_update = [], []
+    for key, doc in keyed_docs.items():
+        stored = existing.get(key)
+        if stored is None or stored.get("content_hash") != doc.metadata["content_hash"]:
+            to_embed.append(key)
+        elif stored != doc.metadata:
+            to_update.append(key)
+    to_delete = [key for key in existing if key not in keyed_docs]
+    return to_embed, to_update, to_delete
+
+
+def load_existing(vectorstore):
+    stored = vectorstore.get(include=["metadatas"])
+    return dict(zip(stored["ids"], stored["metadatas"]))
+
+
+def open_store(backend, persist_dir, embeddings, reset):
+    if backend == "numpy":
+        if reset or not NumpyVectorStore.exists(persist_dir):
+            return NumpyVectorStore.empty(persist_dir, embeddings)
+        store = NumpyVectorStore.load(persist_dir, embeddings)
+        # Detach from the memory map: the files get rewritten in save().
+        store.matrix = np.array(store.matrix)
+        return store
+
+    vectorstore = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+    if reset:
+        # A full rebuild starts from an empty collection instead of piling onto the old one.
+        # The collection itself is kept: a running app or server still holds it open.
+        stale_ids = vectorstore.get(include=[])["ids"]
+        max_batch = vectorstore._client.get_max_batch_size()
+        for i in range(0, len(stale_ids), max_batch):
+            vectorstore._collection.delete(ids=stale_ids[i:i + max_batch])
+    return vectorstore
+
+
+def update_metadata(vectorstore, ids, metadatas):
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.update_metadata(ids, metadatas)
+    else:
+        vectorstore._collection.update(ids=ids, metadatas=metadatas)
+
+
+def upsert_embedded(vectorstore, ids, docs, vectors):
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.upsert(ids, vectors, [doc.metadata for doc in docs], [doc.page_content for doc in docs])
         return
+    max_batch = vectorstore._client.get_max_batch_size()
+    for i in range(0, len(ids), max_batch):
+        vectorstore._collection.upsert(
+            ids=ids[i:i + max_batch],
+            embeddings=vectors[i:i + max_batch],
+            metadatas=[doc.metadata for doc in docs[i:i + max_batch]],
+            documents=[doc.page_content for doc in docs[i:i + max_batch]],
+        )
 
-    documents = ingest.create_book_documents(df)
-    if not documents:
-        print("No documents were created. Exiting.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the book vector store.")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only embed new/changed blurbs, update changed metadata in place and drop deleted books."
+    )
+    parser.add_argument("--max-batch-size", type=int, default=128,
+                        help="Upper bound for the adaptive embedding batch size.")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="Number of embedding requests sent to Ollama at once.")
+    args = parser.parse_args()
+
+    cfg = config.load_config("configs/config.yaml")
+    GOODREADS_CSV_PATH = cfg.get("goodreads_csv_path", "utils/goodreads_with_blurbs.csv")
+    PERSIST_DIRECTORY = cfg.get("persist_dir", "my_book_vectorstore")
+    EMBEDDING_MODEL = cfg.get("embed_model", "nomic-embed-text")
+    INDEX_BACKEND = cfg.get("index_backend", "chroma")
+
+    print("Creating documents (blurb-only) for vector store...")
+    # The export is read, cleaned and turned into documents one chunk at a time.
+    keyed_docs = keyed_documents(ingest.iter_book_documents_from_csv(
+        GOODREADS_CSV_PATH, parquet_cache=cfg.get("prep_cache_path") or None,
+        review_summary_tokens=int(cfg.get("context_review_tokens", DEFAULT_REVIEW_TOKENS))
+    ))
+    if not keyed_docs:
+        print("No data to process. Exiting.")
         return
 
     print(f"Initializing embedding model: {EMBEDDING_MODEL}...")
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+    embeddings = CachedEmbeddings(
+        OllamaEmbeddings(model=EMBEDDING_MODEL),
+        EMBEDDING_MODEL,
+        cache_dir=cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+        max_entries=int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+    )
 
-    print(f"Creating vector store in directory: {PERSIST_DIRECTORY}...")
+    print(f"Opening {INDEX_BACKEND} vector store in directory: {PERSIST_DIRECTORY}...")
     os.makedirs(PERSIST_DIRECTORY, exist_ok=True)
-    
-
-    # --- [FIX 2] Batch the Ingestion Process ---
-    # The '500 EOF' error means the Ollama server is crashing because
-    # we're sending all 124 documents at once.
-    # We will add them in small batches instead.
-    
-    batch_size = 1  # A safe, small batch size for local models
-    total_docs = len(documents)
-    
-    if total_docs == 0:
-        print("No documents to add. Exiting.")
-        return
-        
-    # Calculate the total number of batches
-    total_batches = (total_docs + batch_size - 1) // batch_size
-    print(f"Adding {total_docs} documents in {total_batches} batches of {batch_size}...")
-
-    # Add the first batch using .from_documents() to create the store
-    first_batch = documents[0:batch_size]
-    print(f"  ... adding batch 1/{total_batches}")
-    vectorstore = Chroma.from_documents(
-        documents=first_batch,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIRECTORY
+    # A run that died halfway left the store ahead of the graph and taste profile saved with it.
+    interrupted = store_is_dirty(PERSIST_DIRECTORY)
+    if interrupted:
+        print("The last ingest did not finish: the knowledge graph and taste profile will be rebuilt.")
+    previous_version = read_store_version(PERSIST_DIRECTORY)
+    if not args.incremental:
+        # Opening with a reset already empties the store.
+        mark_store_dirty(PERSIST_DIRECTORY)
+    vectorstore = open_store(INDEX_BACKEND, PERSIST_DIRECTORY, embeddings, reset=not args.incremental)
+
+    if args.incremental:
+        existing = load_existing(vectorstore)
+        print(f"Incremental mode: {len(existing)} books already in the store.")
+    else:
+        existing = {}
+
+    to_embed, to_update, to_delete = plan_sync(keyed_docs, existing)
+    print(f"{len(to_embed)} to embed, {len(to_update)} metadata-only updates, {len(to_delete)} to delete.")
+    if args.incremental and (to_embed or to_update or to_delete):
+        # Readers drop their cached tables and answers before the first book changes, not after the last.
+        mark_store_dirty(PERSIST_DIRECTORY)
+
+    if to_delete:
+        vectorstore.delete(ids=to_delete)
+
+    for i in range(0, len(to_update), METADATA_UPDATE_BATCH):
+        batch = to_update[i:i + METADATA_UPDATE_BATCH]
+        update_metadata(vectorstore, batch, [keyed_docs[key].metadata for key in batch])
+
+    # Ollama used to crash with '500 EOF' on large requests, so this used to add
+    # one document per request. The adaptive embedder finds the largest batch
+    # size the server copes with instead, and Chroma gets the precomputed vectors.
+    embedder = AdaptiveEmbedder(
+        embeddings,
+        max_batch_size=args.max_batch_size,
+        max_concurrency=args.concurrency,
     )
-    
-    # Add all remaining documents in batches using .add_documents()
-    if total_batches > 1:
-        for i in range(batch_size, total_docs, batch_size):
-            batch = documents[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            print(f"  ... adding batch {batch_num}/{total_batches}")
-            vectorstore.add_documents(documents=batch)
-    
-    # --- [End of Fix] ---
-    
+    total_docs = len(to_embed)
+    embedded = []
+    for i in range(0, total_docs, INSERT_CHUNK):
+        chunk_ids = to_embed[i:i + INSERT_CHUNK]
+        chunk_docs = [keyed_docs[key] for key in chunk_ids]
+        vectors = embedder.embed([doc.page_content for doc in chunk_docs])
+        # Ids are the book ids, so an existing id is overwritten
+        upsert_embedded(vectorstore, chunk_ids, chunk_docs, vectors)
+        embedded.extend(vectors)
+        print(f"  ... stored {min(i + INSERT_CHUNK, total_docs)}/{total_docs} documents")
+
+    if total_docs:
+        print(embedder.report())
+        print(f"Embedding cache: {embeddings.stats()}")
+
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.save()
+
+    if to_embed or to_update or to_delete or interrupted:
+        store_version = bump_store_version(PERSIST_DIRECTORY)
+        taste_model = train_from_store(vectorstore, store_version)
+        if taste_model is not None:
+            taste_model.save(PERSIST_DIRECTORY)
+            print(f"Trained the quick 'will you like it' model on {taste_model.n_train} rated books.")
+
+        graph = LibraryGraph.load(PERSIST_DIRECTORY) if args.incremental and not interrupted else None
+        if graph is None or graph.store_version != previous_version:
+            graph = LibraryGraph.from_metadatas(list(keyed_docs), [doc.metadata for doc in keyed_docs.values()])
+        else:
+            # Only the books that changed are touched; the rest of the cached graph stays as it is.
+            graph.delete(to_delete)
+            changed = to_embed + to_update
+            graph.upsert(changed, [keyed_docs[key].metadata for key in changed])
+        graph.save(PERSIST_DIRECTORY, store_version)
+        print(f"Updated the knowledge graph ({len(graph.books)} books).")
+
+        profile = TasteProfile.load(PERSIST_DIRECTORY) if args.incremental and not interrupted else None
+        if not args.incremental:
+            profile = TasteProfile.from_rows(to_embed, embedded, [keyed_docs[key].metadata for key in to_embed])
+        elif profile is None or profile.store_version != previous_version:
+            profile = TasteProfile.from_store(vectorstore)
+        else:
+            # The new vectors join their nearest prototype; clustering is only redone once the library has drifted.
+            profile.delete(to_delete)
+            profile.upsert(to_embed, embedded, [keyed_docs[key].metadata for key in to_embed])
+            profile.update_metadata(to_update, [keyed_docs[key].metadata for key in to_update])
+            profile.retrain_if_drifted()
+        profile.save(PERSIST_DIRECTORY, store_version)
+        print(f"Updated the taste profile ({len(profile)} books, {len(profile.prototypes)} prototypes).")
+        mark_store_clean(PERSIST_DIRECTORY)
+
     print("\n--- Success! ---")
-    print(f"Vector store has been created and saved at '{PERSIST_DIRECTORY}'")
+    print(f"Vector store has been {'updated' if args.incremental else 'created'} and saved at '{PERSIST_DIRECTORY}'")
     print(f"You can now use this vector store to query your reading history.")
 
 
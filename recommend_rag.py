@@ -1,128 +1,187 @@
 import os
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
-from langchain.vectorstores import Chroma
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_core.output_parsers import StrOutputParser
-from langchain.docstore.document import Document
+import numpy as np
 from functools import lru_cache
+from utils.rerank import PIN_WINDOW, LibraryTable, RankedBook, rank_candidates
+from utils.embed_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from utils.response_cache import ResponseCache, response_key
+from utils.store_version import read_store_version
+from utils.vector_index import NumpyVectorStore, search_by_vectors
+from utils.taste_model import TasteModel, train_from_store
+from utils.taste_profile import TasteProfile
+from utils.store_registry import StoreRegistry
+from utils.context_budget import ContextBudget, build_budgeted_context
+from utils import tracing
 
-def hybrid_rerank(retrieved_docs_with_scores: list, rating_boost: float, dnf_penalty: float) -> list[Document]:
-    reranked_results = []
-    
-    for doc, score in retrieved_docs_with_scores:
-        meta = doc.metadata
-        adjustment = 0.0
-        
-        if meta.get('rating', 0) >= 4:
-            adjustment -= rating_boost
-        
-        shelf = meta.get('shelf', '').lower()
-        if 'dnf' in shelf or 'did-not-finish' in shelf:
-            adjustment += dnf_penalty
-            
-        new_score = score + adjustment
-        
-        doc.metadata['rerank_score'] = float(f"{new_score:.4f}")
-        doc.metadata['original_score'] = float(f"{score:.4f}")
-        doc.metadata['adjustment'] = float(f"{adjustment:+.2f}")
-        
-        reranked_results.append((doc, new_score))
-
-    reranked_results.sort(key=lambda x: x[1], reverse=False)
-    
-    return [doc for doc, _ in reranked_results]
+@lru_cache(maxsize=None)
+def get_embeddings(embed_model: str, embed_cache_dir: str = DEFAULT_CACHE_DIR,
+                   embed_cache_size: int = DEFAULT_MAX_ENTRIES):
+    # One embedder (and one disk cache) per model, shared by every open library.
+    # LangChain and the Ollama client are imported on first use: they take about a
+    # second to import, which the app should not pay before it can draw its page.
+    from langchain_ollama import OllamaEmbeddings
+    return CachedEmbeddings(
+        OllamaEmbeddings(model=embed_model),
+        embed_model,
+        cache_dir=embed_cache_dir,
+        max_entries=embed_cache_size
+    )
 
-@lru_cache(maxsize=1) 
-def get_vectorstore(persist_dir: str, embed_model: str):
+def open_vectorstore(
+    persist_dir: str,
+    embed_model: str,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    index_backend: str = "chroma"
+):
     if not os.path.exists(persist_dir):
         raise FileNotFoundError(f"Vector store not found at '{persist_dir}'. Run ingest.py first.")
         
-    embeddings = OllamaEmbeddings(model=embed_model)
+    embeddings = get_embeddings(embed_model, embed_cache_dir, embed_cache_size)
+    if index_backend == "numpy":
+        if not NumpyVectorStore.exists(persist_dir):
+            raise FileNotFoundError(f"NumPy index not found in '{persist_dir}'. Run ingest.py with index_backend: numpy.")
+        return NumpyVectorStore.load(persist_dir, embeddings)
+    from langchain_community.vectorstores import Chroma
     vectorstore = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
     return vectorstore
 
-def get_recommendation(
-    blurb: str, 
-    persist_dir: str, 
-    chat_model: str, 
-    embed_model: str, 
-    k: int,
-    rating_boost: float = 0.3,
-    dnf_penalty: float = 0.4
+def _forget_closed_store(key, store):
+    # Derived per-store caches would otherwise keep an evicted store alive.
+    get_library_table.cache_clear()
+    get_taste_model.cache_clear()
+    get_taste_profile.cache_clear()
+    get_library_graph.cache_clear()
+
+store_registry = StoreRegistry(lambda key: open_vectorstore(*key), on_close=_forget_closed_store)
+
+def store_key(
+    persist_dir: str,
+    embed_model: str,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    index_backend: str = "chroma"
 ):
-    vectorstore = get_vectorstore(persist_dir, embed_model)
-    initial_candidates_with_scores = vectorstore.similarity_search_with_score(query=blurb, k=20)
-    if not initial_candidates_with_scores:
-        return {"explanation": "Keine relevanten Bücher in der Lesehistorie gefunden.", "contexts": []}
-
-    pinned_dnf_doc = None
-    remaining_candidates = list(initial_candidates_with_scores) 
-
-    for i, (doc, score) in enumerate(initial_candidates_with_scores[:5]):
-        shelf = doc.metadata.get("shelf", "").lower()
-        if 'dnf' in shelf or 'did-not-finish' in shelf:
-            pinned_dnf_doc = doc
-            pinned_dnf_doc.metadata['is_pinned_match'] = True
-            remaining_candidates.pop(i) 
-            break 
-
-    final_context_docs = []
-    if pinned_dnf_doc:
-        reranked_others = hybrid_rerank(
-            remaining_candidates, 
-            rating_boost=rating_boost, 
-            dnf_penalty=dnf_penalty
-        )
-        final_context_docs = [pinned_dnf_doc] + reranked_others[:k-1]
-    else:
-        reranked_docs = hybrid_rerank(
-            initial_candidates_with_scores, 
-            rating_boost=rating_boost, 
-            dnf_penalty=dnf_penalty
-        )
-        final_context_docs = reranked_docs[:k]
+    return (persist_dir, embed_model, embed_cache_dir, int(embed_cache_size), index_backend)
 
-    if not final_context_docs:
-        return {"explanation": "Keine relevanten Bücher in der Lesehistorie gefunden.", "contexts": []}
+def get_vectorstore(
+    persist_dir: str,
+    embed_model: str,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    index_backend: str = "chroma"
+):
+    """The open store for this library, opened on first use (see StoreRegistry).
 
-    context_strings = []
-    for doc in final_context_docs:
-        meta = doc.metadata
-        parts = []
-        
-        if meta.get('user_verdict'):
-            parts.append(meta['user_verdict'])
-            
-        parts.append(f"Title: {meta.get('title', 'N/A')}")
-        parts.append(f"Author: {meta.get('author', 'N/A')}")
-        
-        if meta.get('clean_blurb'):
-            parts.append(f"Official Blurb: {meta.get('clean_blurb')}")
-        
-        if meta.get('rating', 0) > 0:
-            parts.append(f"My Rating: I rated this book {meta.get('rating')} out of 5 stars.")
-        else:
-            parts.append("My Rating: I have not rated this book.")
+    Fine for one-library scripts. Anything that serves several libraries should
+    hold store_registry.lease(store_key(...)) instead: an unleased store can be
+    evicted and closed while it is still being read.
+    """
+    return store_registry.get(store_key(persist_dir, embed_model, embed_cache_dir, embed_cache_size, index_backend))
+
+@lru_cache(maxsize=8)
+def get_response_cache(persist_dir: str):
+    return ResponseCache(os.path.join(persist_dir, "response_cache.sqlite"))
+
+NO_RESULTS_MESSAGE = "Keine relevanten Bücher in der Lesehistorie gefunden."
+
+@lru_cache(maxsize=4)
+def get_library_table(vectorstore, store_version: str) -> LibraryTable:
+    # Rebuilt whenever ingest bumps the store version.
+    return LibraryTable.from_vectorstore(vectorstore)
+
+def select_contexts(
+    vectorstore,
+    table: LibraryTable,
+    blurb: str,
+    k: int,
+    rating_boost: float,
+    dnf_penalty: float,
+    candidate_pool: int = 100,
+    profile: TasteProfile = None,
+    profile_n_probe: int = 0
+) -> list[RankedBook]:
+    if min(candidate_pool, len(table)) == 0:
+        return []
+    with tracing.span("embed_query", chars=len(blurb)):
+        query_vector = vectorstore.embeddings.embed_query(blurb)
+    return select_contexts_for_vector(
+        vectorstore, table, query_vector, k, rating_boost, dnf_penalty, candidate_pool, profile, profile_n_probe
+    )
 
-        shelf = meta.get('shelf', 'unknown')
-        if shelf in ['dnf', 'did-not-finish']:
-            parts.append(f"Shelf Status: I did not finish this book (DNF).")
-        elif shelf == 'to-read':
-             parts.append(f"Shelf Status: This book is on my 'to-read' list.")
+def select_contexts_for_vector(
+    vectorstore,
+    table: LibraryTable,
+    query_vector,
+    k: int,
+    rating_boost: float,
+    dnf_penalty: float,
+    candidate_pool: int = 100,
+    profile: TasteProfile = None,
+    profile_n_probe: int = 0
+) -> list[RankedBook]:
+    """select_contexts for an already embedded blurb.
+
+    With the library's taste profile the candidates come from its prototypes
+    when they can rule out most of the library; otherwise, and without a
+    profile, from the vector store (see TasteProfile.search).
+    """
+    n_results = min(candidate_pool, len(table))
+    if n_results == 0:
+        return []
+    with tracing.span("vector_search", n_results=n_results) as attrs:
+        found = profile.search(query_vector, n_results, profile_n_probe) if profile is not None else None
+        if found is not None:
+            ids, distances, attrs["scanned"] = found
+            ids, distances = [ids], [distances]
         else:
-            parts.append(f"Shelf Status: I have read this book.")
-
-        if meta.get('my_review'):
-            parts.append(f"My Personal Review: {meta.get('my_review')}")
-        elif shelf != 'to-read':
-            parts.append("My Personal Review: I did not write a review.")
-            
-        context_strings.append("\n".join(parts))
-    
-    context_string = "\n---\n".join(context_strings)
-    
-    template = """
+            ids, distances = search_by_vectors(vectorstore, [query_vector], n_results)
+    with tracing.span("rerank", k=k):
+        rows = table.rows(ids[0])
+        pin_window = PIN_WINDOW
+        if found is not None:
+            # The profile's distances are between unit vectors: no DNF book closer than the last pin slot
+            # means there is nothing to pin.
+            window = np.asarray(distances[0])[np.asarray(rows) >= 0][:PIN_WINDOW]
+            if len(window) == PIN_WINDOW and not profile.dnf_pin_possible(query_vector, window[-1]):
+                pin_window = 0
+        return rank_candidates(table, rows, distances[0], k, rating_boost, dnf_penalty, pin_window)
+
+@lru_cache(maxsize=4)
+def get_taste_model(vectorstore, persist_dir: str, store_version: str):
+    model = TasteModel.load(persist_dir)
+    if model is None or model.store_version != store_version:
+        # Stores ingested before the model existed (or edited since) get one trained on demand.
+        model = train_from_store(vectorstore, store_version)
+        if model is not None:
+            model.save(persist_dir)
+    return model
+
+@lru_cache(maxsize=4)
+def get_taste_profile(vectorstore, persist_dir: str, store_version: str):
+    profile = TasteProfile.load(persist_dir)
+    if profile is None or profile.store_version != store_version:
+        # Stores ingested before the profile existed (or edited since) get it built from their embeddings.
+        profile = TasteProfile.from_store(vectorstore, store_version)
+        profile.save(persist_dir, store_version)
+    return profile
+
+@lru_cache(maxsize=4)
+def get_library_graph(vectorstore, persist_dir: str, store_version: str):
+    # networkx is only needed once someone opens the graph.
+    from graph_builder import LibraryGraph
+    graph = LibraryGraph.load(persist_dir)
+    if graph is None or graph.store_version != store_version:
+        # Stores ingested before the graph was cached (or edited since) get it rebuilt from their metadata.
+        table = get_library_table(vectorstore, store_version)
+        graph = LibraryGraph.from_metadatas(table.ids, table.metadatas)
+        graph.save(persist_dir, store_version)
+    return graph
+
+def build_context_string(final_context_docs: list, context_budget: ContextBudget = ContextBudget()) -> str:
+    context_string, _ = build_budgeted_context(final_context_docs, context_budget)
+    return context_string
+
+RAG_TEMPLATE = """
     You are a brutally honest personalized book analysis assistant. Your task is to predict if a user will like a new book based on their reading history.
     Your analysis must be direct and based ONLY on the evidence provided in the context.
 
@@ -142,21 +201,263 @@ def get_recommendation(
 
     Based on your critical analysis of the context, provide a concise, personalized prediction.
     """
-    prompt = PromptTemplate.from_template(template)
-    
-    llm = OllamaLLM(model=chat_model)
-    
-    rag_chain = (
-        {"context": RunnableLambda(lambda x: context_string), 
-         "query": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
+
+@lru_cache(maxsize=None)
+def get_llm(chat_model: str):
+    # One client per model: its HTTP connection pool is kept alive across requests.
+    from langchain_ollama import OllamaLLM
+    return OllamaLLM(model=chat_model)
+
+@lru_cache(maxsize=None)
+def get_rag_chain(chat_model: str):
+    """The prompt -> LLM -> text chain, built once; invoke it with {"query": blurb, "context": context_string}."""
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+    return PromptTemplate.from_template(RAG_TEMPLATE) | get_llm(chat_model) | StrOutputParser()
+
+def parse_verdict(explanation: str) -> str:
+    """Map the LLM's closing verdict to "like", "dislike" or "unclear"."""
+    text = explanation.lower()
+    if "will not like" in text or "won't like" in text:
+        return "dislike"
+    if "will like" in text:
+        return "like"
+    return "unclear"
+
+class Recommender:
+    """One library's recommendation pipeline, set up once and reused for every request.
+
+    Holds the shared embedder, the pooled LLM client and the pre-built chain; only
+    the context changes per request. The store is leased from the registry per
+    request rather than held, so the registry can still close it when too many
+    libraries are open.
+    """
+
+    def __init__(
+        self,
+        persist_dir: str,
+        chat_model: str,
+        embed_model: str,
+        embed_cache_dir: str = DEFAULT_CACHE_DIR,
+        embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+        index_backend: str = "chroma",
+        candidate_pool: int = 100,
+        context_budget: ContextBudget = ContextBudget(),
+        profile_n_probe: int = 0
+    ):
+        self.persist_dir = persist_dir
+        self.chat_model = chat_model
+        self.embed_model = embed_model
+        self.candidate_pool = candidate_pool
+        self.context_budget = context_budget
+        self.profile_n_probe = profile_n_probe
+        self.key = store_key(persist_dir, embed_model, embed_cache_dir, embed_cache_size, index_backend)
+
+    @classmethod
+    def from_config(cls, cfg: dict, persist_dir: str = None):
+        return get_recommender(
+            persist_dir or cfg.get("persist_dir"),
+            cfg.get("chat_model"),
+            cfg.get("embed_model"),
+            cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+            int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+            cfg.get("index_backend", "chroma"),
+            int(cfg.get("candidate_pool", 100)),
+            ContextBudget.from_config(cfg),
+            int(cfg.get("taste_profile_n_probe", 0))
+        )
+
+    @property
+    def embeddings(self):
+        return get_embeddings(*self.key[1:4])
+
+    @property
+    def chain(self):
+        return get_rag_chain(self.chat_model)
+
+    def warm(self):
+        """Do the one-off work now (imports, LLM client, chain, opening the store) instead of on the first request."""
+        self.chain
+        with store_registry.lease(self.key) as vectorstore:
+            get_taste_profile(vectorstore, self.persist_dir, read_store_version(self.persist_dir))
+        return self
+
+    def like_probability(self, blurb: str):
+        """Fast verdict without the LLM: P(the user likes this book), or None without rated books."""
+        trace = tracing.Trace("like_probability", persist_dir=self.persist_dir)
+        with tracing.activate(trace), store_registry.lease(self.key) as vectorstore:
+            if isinstance(vectorstore, NumpyVectorStore):
+                vectorstore.reload_if_changed()
+            with tracing.span("load_model"):
+                model = get_taste_model(vectorstore, self.persist_dir, read_store_version(self.persist_dir))
+            if model is None:
+                trace.finish()
+                return None
+            with tracing.span("embed_query", chars=len(blurb)):
+                query_vector = vectorstore.embeddings.embed_query(blurb)
+            with tracing.span("predict"):
+                probability = float(model.predict_proba(query_vector)[0])
+        trace.finish(probability=probability)
+        return probability
+
+    def recommend(
+        self,
+        blurb: str,
+        k: int,
+        rating_boost: float = 0.3,
+        dnf_penalty: float = 0.4,
+        use_cache: bool = True,
+        candidate_pool: int = None
+    ):
+        """Retrieve and rerank right away; generate the explanation lazily.
+
+        Returns {"contexts", "cached", "stream", "trace"}, where "stream" yields the
+        explanation chunk by chunk as the LLM produces it. The trace is exported once
+        the stream is exhausted; callers that never read the stream should call
+        trace.finish() themselves.
+        """
+        persist_dir = self.persist_dir
+        candidate_pool = self.candidate_pool if candidate_pool is None else candidate_pool
+        trace = tracing.Trace("recommendation", persist_dir=persist_dir, k=k, blurb_tokens=tracing.estimate_tokens(blurb))
+        # The lease keeps the store open even if another session's library evicts it meanwhile.
+        with tracing.activate(trace), store_registry.lease(self.key) as vectorstore:
+            if isinstance(vectorstore, NumpyVectorStore):
+                vectorstore.reload_if_changed()
+
+            # Re-ingesting bumps the store version, which retires every cached answer.
+            store_version = read_store_version(persist_dir)
+            cache_key = response_key(
+                blurb, k, rating_boost, dnf_penalty, self.chat_model, self.embed_model, store_version, candidate_pool,
+                self.context_budget, self.profile_n_probe
+            )
+            response_cache = get_response_cache(persist_dir) if use_cache else None
+            if response_cache is not None:
+                with tracing.span("cache_lookup") as attrs:
+                    cached = response_cache.get(cache_key)
+                    attrs["hit"] = cached is not None
+                if cached is not None:
+                    trace.finish(cached=True)
+                    return {
+                        "contexts": [RankedBook(**c) for c in cached["contexts"]],
+                        "cached": True,
+                        "stream": iter([cached["explanation"]]),
+                        "trace": trace
+                    }
+
+            with tracing.span("library_table"):
+                table = get_library_table(vectorstore, store_version)
+            with tracing.span("taste_profile"):
+                profile = get_taste_profile(vectorstore, persist_dir, store_version)
+            final_context_docs = select_contexts(
+                vectorstore, table, blurb, k, rating_boost, dnf_penalty, candidate_pool, profile, self.profile_n_probe
+            )
+        if not final_context_docs:
+            trace.finish(cached=False)
+            return {"contexts": [], "cached": False, "stream": iter([NO_RESULTS_MESSAGE]), "trace": trace}
+
+        with trace.span("build_context") as attrs:
+            context_string, attrs["books_used"] = build_budgeted_context(final_context_docs, self.context_budget)
+            attrs["context_tokens"] = tracing.estimate_tokens(context_string)
+        with trace.span("build_chain"):
+            rag_chain = self.chain
+
+        def generate():
+            chunks = []
+            try:
+                for chunk in rag_chain.stream(
+                        {"query": blurb, "context": context_string},
+                        config={"callbacks": [tracing.llm_span_callback(trace)]}):
+                    chunks.append(chunk)
+                    yield chunk
+                # Only a fully generated answer is worth caching.
+                if response_cache is not None:
+                    response_cache.put(cache_key, store_version, {
+                        "explanation": "".join(chunks),
+                        "contexts": [d._asdict() for d in final_context_docs]
+                    })
+            finally:
+                trace.finish(cached=False)
+
+        return {"contexts": final_context_docs, "cached": False, "stream": generate(), "trace": trace}
+
+@lru_cache(maxsize=None)
+def get_recommender(
+    persist_dir: str,
+    chat_model: str,
+    embed_model: str,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    index_backend: str = "chroma",
+    candidate_pool: int = 100,
+    context_budget: ContextBudget = ContextBudget(),
+    profile_n_probe: int = 0
+) -> Recommender:
+    return Recommender(
+        persist_dir, chat_model, embed_model, embed_cache_dir, int(embed_cache_size), index_backend,
+        int(candidate_pool), context_budget, int(profile_n_probe)
+    )
+
+def predict_like_probability(
+    blurb: str,
+    persist_dir: str,
+    embed_model: str,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    index_backend: str = "chroma"
+):
+    recommender = get_recommender(persist_dir, None, embed_model, embed_cache_dir, embed_cache_size, index_backend)
+    return recommender.like_probability(blurb)
+
+def stream_recommendation(
+    blurb: str, 
+    persist_dir: str, 
+    chat_model: str, 
+    embed_model: str, 
+    k: int,
+    rating_boost: float = 0.3,
+    dnf_penalty: float = 0.4,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    use_cache: bool = True,
+    candidate_pool: int = 100,
+    index_backend: str = "chroma",
+    context_budget: ContextBudget = ContextBudget()
+):
+    """Recommender.recommend for callers that pass the settings on every call."""
+    recommender = get_recommender(
+        persist_dir, chat_model, embed_model, embed_cache_dir, embed_cache_size, index_backend, candidate_pool,
+        context_budget
+    )
+    return recommender.recommend(blurb, k, rating_boost, dnf_penalty, use_cache)
+
+def get_recommendation(
+    blurb: str, 
+    persist_dir: str, 
+    chat_model: str, 
+    embed_model: str, 
+    k: int,
+    rating_boost: float = 0.3,
+    dnf_penalty: float = 0.4,
+    embed_cache_dir: str = DEFAULT_CACHE_DIR,
+    embed_cache_size: int = DEFAULT_MAX_ENTRIES,
+    use_cache: bool = True,
+    candidate_pool: int = 100,
+    index_backend: str = "chroma",
+    context_budget: ContextBudget = ContextBudget()
+):
+    rag_out = stream_recommendation(
+        blurb, persist_dir, chat_model, embed_model, k,
+        rating_boost=rating_boost,
+        dnf_penalty=dnf_penalty,
+        embed_cache_dir=embed_cache_dir,
+        embed_cache_size=embed_cache_size,
+        use_cache=use_cache,
+        candidate_pool=candidate_pool,
+        index_backend=index_backend,
+        context_budget=context_budget
     )
-    
-    response = rag_chain.invoke(blurb)
-    
     return {
-        "explanation": response, 
-        "contexts": final_context_docs
+        "explanation": "".join(rag_out["stream"]), 
+        "contexts": rag_out["contexts"],
+        "cached": rag_out["cached"]
     }
\ No newline at end of file
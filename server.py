@@ -0,0 +1,307 @@
+"""Headless HTTP API around the recommender.
+
+    python server.py --port 8080
+
+    POST /recommend  {"blurb": "...", "library": "Anna", "k": 5}  -> verdict, explanation, contexts
+    POST /retrieve   {"blurb": "..."}                              -> contexts and like probability only
+    GET  /health                                                  -> queue and batching counters
+
+Every request shares the same open stores (see StoreRegistry). Blurbs arriving
+at the same time are embedded together in micro-batches. Generations go
+through a bounded queue: when it is full the server answers 503 with
+Retry-After, and requests that take longer than the timeout get 504.
+"""
+import argparse
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import utils.conf as config
+from recommend_rag import (
+    NO_RESULTS_MESSAGE, build_context_string, get_embeddings, get_library_table, get_rag_chain,
+    get_response_cache, get_taste_model, get_taste_profile, parse_verdict, select_contexts_for_vector, store_key,
+    store_registry
+)
+from utils.context_budget import ContextBudget
+from utils.embed_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from utils.rerank import RankedBook
+from utils.response_cache import response_key
+from utils.serving import EmbeddingBatcher, GenerationQueue, Overloaded
+from utils.store_version import read_store_version
+from utils.vector_index import NumpyVectorStore
+
+SETTINGS = web.AppKey("settings", dict)
+BATCHER = web.AppKey("batcher", EmbeddingBatcher)
+LLM_QUEUE = web.AppKey("llm_queue", GenerationQueue)
+RETRIEVAL_POOL = web.AppKey("retrieval_pool", ThreadPoolExecutor)
+# Each candidate is reranked per request; far beyond this the search gets slow for nothing.
+MAX_CANDIDATE_POOL = 1000
+
+
+def load_settings(cfg):
+    persist_dir = cfg.get("persist_dir")
+    return {
+        "persist_dir": persist_dir,
+        "libraries": {"default": persist_dir, **(cfg.get("libraries") or {})},
+        "chat_model": cfg.get("chat_model"),
+        "embed_model": cfg.get("embed_model"),
+        "embed_cache_dir": cfg.get("embed_cache_dir", DEFAULT_CACHE_DIR),
+        "embed_cache_size": int(cfg.get("embed_cache_size", DEFAULT_MAX_ENTRIES)),
+        "index_backend": cfg.get("index_backend", "chroma"),
+        "k": int(cfg.get("k", 5)),
+        "candidate_pool": int(cfg.get("candidate_pool", 100)),
+        "context_budget": ContextBudget.from_config(cfg),
+        "taste_profile_n_probe": int(cfg.get("taste_profile_n_probe", 0)),
+        "max_open_stores": int(cfg.get("max_open_stores", 4)),
+        "max_open_stores_mb": float(cfg.get("max_open_stores_mb", 0)),
+        "llm_concurrency": int(cfg.get("server_llm_concurrency", 2)),
+        "llm_queue_size": int(cfg.get("server_llm_queue_size", 16)),
+        "llm_timeout_s": float(cfg.get("server_llm_timeout_s", 120)),
+        "embed_batch_size": int(cfg.get("server_embed_batch_size", 32)),
+        "embed_batch_wait_ms": float(cfg.get("server_embed_batch_wait_ms", 5)),
+    }
+
+
+class BadRequest(Exception):
+    pass
+
+
+async def parse_query(request):
+    settings = request.app[SETTINGS]
+    try:
+        body = await request.json()
+    except ValueError:
+        raise BadRequest("body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("body must be a JSON object")
+    blurb = str(body.get("blurb") or "").strip()
+    if not blurb:
+        raise BadRequest("'blurb' is required")
+    library = body.get("library", "default")
+    if not isinstance(library, str) or library not in settings["libraries"]:
+        raise BadRequest(f"unknown library '{library}'")
+    try:
+        query = {
+            "blurb": blurb,
+            "persist_dir": settings["libraries"][library],
+            "k": int(body.get("k", settings["k"])),
+            "rating_boost": float(body.get("rating_boost", 0.3)),
+            "dnf_penalty": float(body.get("dnf_penalty", 0.4)),
+            "candidate_pool": int(body.get("candidate_pool", settings["candidate_pool"])),
+        }
+    except (TypeError, ValueError, OverflowError):
+        raise BadRequest("k, rating_boost, dnf_penalty and candidate_pool must be numbers")
+    if query["k"] < 1:
+        raise BadRequest("k must be at least 1")
+    if not 1 <= query["candidate_pool"] <= MAX_CANDIDATE_POOL:
+        raise BadRequest(f"candidate_pool must be between 1 and {MAX_CANDIDATE_POOL}")
+    if not (math.isfinite(query["rating_boost"]) and math.isfinite(query["dnf_penalty"])):
+        raise BadRequest("rating_boost and dnf_penalty must be finite")
+    return query
+
+
+def library_key(settings, query):
+    return store_key(query["persist_dir"], settings["embed_model"], settings["embed_cache_dir"],
+                     settings["embed_cache_size"], settings["index_backend"])
+
+
+def like_probability_sync(vectorstore, query, store_version, query_vector):
+    model = get_taste_model(vectorstore, query["persist_dir"], store_version)
+    return float(model.predict_proba(query_vector)[0]) if model is not None else None
+
+
+def retrieve_sync(settings, query, query_vector):
+    with store_registry.lease(library_key(settings, query)) as vectorstore:
+        if isinstance(vectorstore, NumpyVectorStore):
+            vectorstore.reload_if_changed()
+        store_version = read_store_version(query["persist_dir"])
+        table = get_library_table(vectorstore, store_version)
+        profile = get_taste_profile(vectorstore, query["persist_dir"], store_version)
+        contexts = select_contexts_for_vector(
+            vectorstore, table, query_vector, query["k"], query["rating_boost"], query["dnf_penalty"],
+            query["candidate_pool"], profile, settings["taste_profile_n_probe"]
+        )
+        like_probability = like_probability_sync(vectorstore, query, store_version, query_vector)
+    return contexts, like_probability
+
+
+def cached_like_probability_sync(settings, query, store_version, query_vector):
+    with store_registry.lease(library_key(settings, query)) as vectorstore:
+        return like_probability_sync(vectorstore, query, store_version, query_vector)
+
+
+async def embed_blurb(request, query):
+    app = request.app
+    return await asyncio.wait_for(app[BATCHER].embed(query["blurb"]), app[SETTINGS]["llm_timeout_s"])
+
+
+async def retrieve(request, query):
+    query_vector = await embed_blurb(request, query)
+    return await asyncio.get_running_loop().run_in_executor(
+        request.app[RETRIEVAL_POOL], retrieve_sync, request.app[SETTINGS], query, query_vector
+    )
+
+
+def context_json(book):
+    meta = book.metadata
+    return {
+        "book_id": book.book_id,
+        "title": meta.get("title", "N/A"),
+        "author": meta.get("author", "N/A"),
+        "shelf": meta.get("shelf", "unknown"),
+        "rating": meta.get("rating", 0),
+        "original_score": book.original_score,
+        "adjustment": book.adjustment,
+        "rerank_score": book.rerank_score,
+        "pinned": book.is_pinned_match,
+    }
+
+
+async def handle_retrieve(request):
+    start = time.perf_counter()
+    query = await parse_query(request)
+    contexts, like_probability = await retrieve(request, query)
+    return web.json_response({
+        "like_probability": like_probability,
+        "contexts": [context_json(book) for book in contexts],
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    })
+
+
+async def handle_recommend(request):
+    start = time.perf_counter()
+    settings = request.app[SETTINGS]
+    query = await parse_query(request)
+
+    store_version = read_store_version(query["persist_dir"])
+    cache_key = response_key(
+        query["blurb"], query["k"], query["rating_boost"], query["dnf_penalty"], settings["chat_model"],
+        settings["embed_model"], store_version, query["candidate_pool"], settings["context_budget"],
+        settings["taste_profile_n_probe"]
+    )
+    response_cache = get_response_cache(query["persist_dir"])
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        like_probability = cached.get("like_probability")
+        if "like_probability" not in cached and cached["contexts"]:
+            # Entries written by the app don't carry it; the blurb's vector is in the embedding cache.
+            query_vector = await embed_blurb(request, query)
+            like_probability = await asyncio.get_running_loop().run_in_executor(
+                request.app[RETRIEVAL_POOL], cached_like_probability_sync, settings, query, store_version,
+                query_vector
+            )
+        return recommend_response(
+            cached["explanation"], like_probability, [RankedBook(**c) for c in cached["contexts"]], True, start
+        )
+
+    contexts, like_probability = await retrieve(request, query)
+    if not contexts:
+        explanation = NO_RESULTS_MESSAGE
+    else:
+        explanation = await request.app[LLM_QUEUE].run(get_rag_chain(settings["chat_model"]).invoke, {
+            "query": query["blurb"], "context": build_context_string(contexts, settings["context_budget"])
+        })
+        response_cache.put(cache_key, store_version, {
+            "explanation": explanation,
+            "like_probability": like_probability,
+            "contexts": [d._asdict() for d in contexts]
+        })
+    return recommend_response(explanation, like_probability, contexts, False, start)
+
+
+def recommend_response(explanation, like_probability, contexts, cached, start):
+    # Fresh and cached answers share one schema.
+    return web.json_response({
+        "verdict": parse_verdict(explanation),
+        "explanation": explanation,
+        "like_probability": like_probability,
+        "contexts": [context_json(book) for book in contexts],
+        "cached": cached,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    })
+
+
+async def handle_health(request):
+    app = request.app
+    return web.json_response({
+        "status": "ok",
+        "stores": store_registry.stats()["open"],
+        "llm": app[LLM_QUEUE].stats(),
+        "embedding": app[BATCHER].stats(),
+    })
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except BadRequest as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except Overloaded as e:
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "timed out"}, status=504)
+    except FileNotFoundError as e:
+        return web.json_response({"error": str(e)}, status=404)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+
+
+def create_app(settings):
+    app = web.Application(middlewares=[error_middleware])
+    app[SETTINGS] = settings
+    embeddings = get_embeddings(settings["embed_model"], settings["embed_cache_dir"], settings["embed_cache_size"])
+    app[BATCHER] = EmbeddingBatcher(
+        embeddings.embed_documents,
+        max_batch_size=settings["embed_batch_size"],
+        max_wait=settings["embed_batch_wait_ms"] / 1000,
+    )
+    app[LLM_QUEUE] = GenerationQueue(
+        max_concurrency=settings["llm_concurrency"],
+        max_waiting=settings["llm_queue_size"],
+        timeout=settings["llm_timeout_s"],
+    )
+    app[RETRIEVAL_POOL] = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+    store_registry.resize(settings["max_open_stores"], int(settings["max_open_stores_mb"] * 2**20))
+
+    async def on_startup(app):
+        # Import LangChain and build the chain now rather than on the first request.
+        get_rag_chain(settings["chat_model"])
+        for library_dir in list(settings["libraries"].values())[:settings["max_open_stores"]]:
+            store_registry.warm(store_key(library_dir, settings["embed_model"], settings["embed_cache_dir"],
+                                          settings["embed_cache_size"], settings["index_backend"]))
+
+    async def on_cleanup(app):
+        await app[BATCHER].close()
+        app[LLM_QUEUE].close()
+        app[RETRIEVAL_POOL].shutdown(wait=False, cancel_futures=True)
+        store_registry.close_all()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/recommend", handle_recommend)
+    app.router.add_post("/retrieve", handle_retrieve)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    settings = load_settings(config.load_config("configs/config.yaml"))
+    print(f"Serving {len(settings['libraries'])} librar{'y' if len(settings['libraries']) == 1 else 'ies'} "
+          f"on http://{args.host}:{args.port} (LLM concurrency {settings['llm_concurrency']}, "
+          f"queue {settings['llm_queue_size']}, timeout {settings['llm_timeout_s']:g}s)")
+    web.run_app(create_app(settings), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
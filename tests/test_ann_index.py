@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from utils.ann_index import IVFIndex, _top_k, assign, kmeans, recall_at_k
+from utils.vector_index import normalize_rows
+
+
+def clustered(n=2000, dim=32, n_genres=20, seed=0):
+    rng = np.random.default_rng(seed)
+    genres = normalize_rows(rng.standard_normal((n_genres, dim)))
+    labels = rng.integers(0, n_genres, n)
+    return normalize_rows(genres[labels] + rng.standard_normal((n, dim)) * 0.3).astype(np.float32)
+
+
+@pytest.fixture
+def index(tmp_path):
+    vectors = clustered()
+    ids = [f"b{i}" for i in range(len(vectors))]
+    metadatas = [{"title": f"Book {i}"} for i in range(len(vectors))]
+    return IVFIndex.build(str(tmp_path), vectors, ids, metadatas, n_lists=16), vectors
+
+
+def test_top_k_is_sorted_best_first():
+    scores = np.array([[0.1, 0.9, 0.5, 0.7]])
+    assert _top_k(scores, 2).tolist() == [[1, 3]]
+    assert _top_k(scores, 10).tolist() == [[1, 3, 2, 0]]
+    assert _top_k(scores, 0).shape == (1, 0)
+
+
+def test_kmeans_centroids_are_unit_length_and_assign_to_nearest():
+    vectors = clustered(500)
+    centroids = kmeans(vectors, 8, iterations=5)
+    assert centroids.shape == (8, vectors.shape[1])
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1.0, atol=1e-5)
+    assert np.array_equal(assign(vectors, centroids), np.argmax(vectors @ centroids.T, axis=1))
+
+
+def test_build_groups_rows_by_cluster_and_keeps_ids_with_their_vectors(index):
+    index, vectors = index
+    assert len(index) == len(vectors)
+    assert index.offsets[0] == 0 and index.offsets[-1] == len(vectors)
+    assert np.all(np.diff(index.offsets) >= 0)
+    rows = [int(name[1:]) for name in index.ids]
+    assert np.allclose(np.asarray(index.vectors), vectors[rows], atol=1e-6)
+    assert [m["title"] for m in index.metadatas[:5]] == [f"Book {r}" for r in rows[:5]]
+    # Every row sits in the list of its nearest centroid.
+    labels = assign(np.asarray(index.vectors), index.centroids)
+    for c in range(len(index.centroids)):
+        assert np.all(labels[index.offsets[c]:index.offsets[c + 1]] == c)
+
+
+def test_load_round_trip(index, tmp_path):
+    index, _ = index
+    assert IVFIndex.exists(str(tmp_path))
+    loaded = IVFIndex.load(str(tmp_path))
+    assert loaded.ids == index.ids and loaded.metadatas == index.metadatas
+    assert np.array_equal(loaded.centroids, index.centroids)
+
+
+def test_probing_every_list_is_exact(index):
+    index, vectors = index
+    queries = vectors[:10] + 0.01
+    approx_rows, approx_sims = index.search(queries, k=15, n_probe=len(index.centroids))
+    exact_rows, exact_sims = index.exact_search(queries, k=15)
+    for a, e, a_s, e_s in zip(approx_rows, exact_rows, approx_sims, exact_sims):
+        assert np.allclose(a_s, e_s, atol=1e-5)
+        assert np.all(np.diff(a_s) <= 1e-6)
+        assert set(a) == set(e)
+
+
+def test_exact_search_matches_brute_force(index):
+    index, _ = index
+    query = normalize_rows(np.random.default_rng(1).standard_normal((1, index.centroids.shape[1])))
+    rows, sims = index.exact_search(query, k=5)
+    brute = np.argsort(-(np.asarray(index.vectors) @ query[0]))[:5]
+    assert rows[0].tolist() == brute.tolist()
+
+
+def test_recall_grows_with_n_probe(index):
+    index, vectors = index
+    queries = vectors[::97]
+    low = recall_at_k(index, queries, k=10, n_probe=1)
+    high = recall_at_k(index, queries, k=10, n_probe=8)
+    assert 0.0 < low <= high
+    assert recall_at_k(index, queries, k=10, n_probe=len(index.centroids)) == 1.0
+
+
+def test_k_larger_than_the_probed_lists(index):
+    index, vectors = index
+    rows, sims = index.search(vectors[:1], k=len(vectors) + 5, n_probe=1)
+    c = int(np.argmax(index.centroids @ vectors[0]))
+    assert len(rows[0]) == index.offsets[c + 1] - index.offsets[c]
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+import utils.get_blurbs as get_blurbs
+from utils.blurb_cache import BlurbCache, cache_keys
+from utils.get_blurbs import get_book_blurb
+from utils.stub_books_api import start_stub_server
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = BlurbCache(str(tmp_path / "blurbs.sqlite"), ttl_days=1, negative_ttl_days=0.5)
+    yield cache
+    cache.close()
+
+
+def _age(cache, days):
+    """Pretend every entry was fetched `days` ago."""
+    cache.conn.execute("UPDATE blurbs SET fetched_at = ?", (time.time() - days * 86400,))
+    cache.conn.commit()
+
+
+def test_keys_go_from_most_to_least_specific():
+    assert cache_keys("9780000000001", "0000000001", " The  Hobbit", "J.R.R. Tolkien ") == [
+        "isbn13:9780000000001", "isbn:0000000001", "title:the hobbit|j.r.r. tolkien"
+    ]
+    assert cache_keys(None, None, float("nan"), "Someone") == []
+
+
+def test_found_blurb_is_stored_under_every_key(cache):
+    cache.put(cache_keys("9780000000001", None, "Dune", "Herbert"), "Sand.")
+    assert cache.get(["isbn13:9780000000001"]) == "Sand."
+    assert cache.get(cache_keys(None, None, "dune", "HERBERT")) == "Sand."
+    assert cache.get(["isbn13:9780000000002"]) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_negative_answer_only_counts_for_the_key_queried(cache):
+    keys = cache_keys("9780000000001", None, "Dune", "Herbert")
+    cache.put(keys, "Book not found via API.")
+    assert cache.get(keys) == "Book not found via API."
+    # A title lookup of the same book may still find it.
+    assert cache.get(keys[1:]) is None
+
+
+def test_entries_expire_but_offline_reads_keep_them(cache):
+    cache.put(["isbn:1"], "Found.")
+    cache.put(["isbn:2"], "No blurb found.")
+    _age(cache, 0.75)  # past the negative TTL only
+    assert cache.get(["isbn:1"]) == "Found."
+    assert cache.get(["isbn:2"]) is None
+    _age(cache, 2)
+    assert cache.get(["isbn:1"]) is None
+    assert cache.get(["isbn:1"], allow_stale=True) == "Found."
+
+
+def test_iter_found_groups_keys_by_blurb(cache):
+    cache.put(["isbn13:1", "title:a|b"], "Alpha.")
+    cache.put(["isbn13:2"], "Beta.")
+    cache.put(["isbn13:3"], "Book not found via API.")
+    assert sorted(cache.iter_found(batch_size=1)) == [("Alpha.", ["isbn13:1", "title:a|b"]), ("Beta.", ["isbn13:2"])]
+
+
+def test_fetcher_answers_repeat_lookups_from_the_cache(cache, monkeypatch):
+    server, url = start_stub_server()
+    monkeypatch.setattr(get_blurbs, "BASE_URL", url)
+    try:
+        first = get_book_blurb("9780000000001", None, "T", "A", cache=cache)
+        assert get_book_blurb("9780000000001", None, "T", "A", cache=cache) == first
+        assert server.request_count == 1
+        # Offline, a book missing from the cache is an error rather than a request.
+        assert get_book_blurb("9780000000002", None, "U", "B", cache=cache,
+                              offline=True).startswith("API Request Error")
+        assert server.request_count == 1
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,93 @@
+from utils.context_budget import (ContextBudget, _render, build_budgeted_context, summarize_review,
+                                  truncate_to_tokens)
+from utils.rerank import RankedBook
+from utils.tracing import estimate_tokens
+
+BLURB = " ".join(f"Sentence {i} of the blurb goes on about dragons." for i in range(40))
+REVIEW = ("I picked this up on a whim. The harbour town is described at length. "
+          "I loved the characters but the pacing was awful. There is a map at the front. "
+          "The second act wanders through three sieges. Honestly the ending was the best part.")
+
+
+def _book(title, score, pinned=False, **metadata):
+    meta = {"title": title, "author": "Someone", "rating": 4, "shelf": "read", "clean_blurb": BLURB, **metadata}
+    return RankedBook(title, meta, score, 0.0, score, pinned)
+
+
+def test_truncate_prefers_a_sentence_end():
+    assert truncate_to_tokens("Short.", 10) == "Short."
+    cut = truncate_to_tokens(BLURB, 30)
+    assert len(cut) <= 120 and cut.endswith("dragons.") and BLURB.startswith(cut)
+    # Without a sentence end in the second half, it cuts after a word.
+    words = "word " * 100
+    assert truncate_to_tokens(words, 10) == "word " * 7 + "word …"
+    assert truncate_to_tokens("x" * 100, 5) == "x" * 20 + " …"
+
+
+def test_summary_keeps_first_last_and_opinionated_sentences():
+    summary = summarize_review(REVIEW, 30)
+    assert estimate_tokens(summary) <= 30
+    assert summary == ("I picked this up on a whim. I loved the characters but the pacing was awful. "
+                       "Honestly the ending was the best part.")
+    assert summarize_review("  fits  ", 30) == "fits"
+    # One long sentence is cut instead.
+    assert summarize_review("word " * 200, 10).endswith(" …")
+
+
+def test_summary_of_sentences_that_never_fit():
+    review = "A" * 200 + ". " + "B" * 200 + "."
+    assert summarize_review(review, 10) == truncate_to_tokens("A" * 200 + ".", 10)
+
+
+def test_render_trims_blurb_and_review_to_their_budgets():
+    budget = ContextBudget(1200, 30, 20)
+    text = _render({"title": "T", "author": "A", "rating": 0, "shelf": "to-read", "clean_blurb": BLURB,
+                    "my_review": REVIEW}, budget)
+    blurb = text.split("Official Blurb: ")[1].split("\n")[0]
+    review = text.split("My Personal Review: ")[1]
+    assert blurb == truncate_to_tokens(BLURB, 30)
+    assert review == summarize_review(REVIEW, 20)
+    assert "My Rating: I have not rated this book." in text
+    # The summary made at ingest wins over the full review.
+    assert "My Personal Review: short" in _render({"my_review": REVIEW, "review_summary": "short"}, budget)
+    compact = _render({"title": "T", "clean_blurb": BLURB, "my_review": REVIEW, "shelf": "dnf"}, budget, compact=True)
+    assert "Blurb" not in compact and "Review" not in compact and "(DNF)" in compact
+
+
+def test_pinned_book_first_then_by_rerank_score():
+    docs = [_book("c", 0.5), _book("a", 0.1), _book("dnf", 0.9, pinned=True, shelf="dnf"), _book("b", 0.3)]
+    context, used = build_budgeted_context(docs, ContextBudget(10000, 30, 20))
+    assert used == 4
+    titles = [block.split("Title: ")[1].split("\n")[0] for block in context.split("\n---\n")]
+    assert titles == ["dnf", "a", "b", "c"]
+
+
+def test_context_stays_within_the_budget():
+    docs = [_book(f"book {i}", i / 10) for i in range(10)]
+    for total in (60, 150, 300):
+        context, used = build_budgeted_context(docs, ContextBudget(total, 60, 20))
+        assert len(context) <= total * 4
+        assert 0 < used < 10
+        assert context.count("\n---\n") == used - 1
+    assert build_budgeted_context(docs, ContextBudget(10000, 60, 20))[1] == 10
+
+
+def test_books_that_do_not_fit_in_full_are_added_compact():
+    budget = ContextBudget(100, 20, 20)
+    full = _render(_book("a", 0.1).metadata, budget)
+    compact = _render(_book("b", 0.2).metadata, budget, compact=True)
+    # Room for one full book and one compact one, not for two full ones or a third book.
+    assert len(full) + 5 + len(compact) <= 400 < len(full) + 5 + len(full)
+    assert len(full) + 2 * (5 + len(compact)) > 400
+    context, used = build_budgeted_context([_book("a", 0.1), _book("b", 0.2), _book("c", 0.3)], budget)
+    assert used == 2 and context.split("\n---\n") == [full, compact]
+
+
+def test_first_book_is_kept_even_over_budget():
+    context, used = build_budgeted_context([_book("a", 0.1), _book("b", 0.2)], ContextBudget(5, 60, 20))
+    assert used == 1 and "Title: a" in context and "Blurb" not in context
+
+
+def test_budget_from_config():
+    assert ContextBudget.from_config({}) == ContextBudget()
+    assert ContextBudget.from_config({"context_token_budget": "300", "context_review_tokens": 10}) == (300, 120, 10)
@@ -0,0 +1,116 @@
+import multiprocessing
+
+import numpy as np
+
+from utils.embed_cache import CachedEmbeddings, DiskVectorCache, text_key
+
+
+def _vec(i, dim=4):
+    return np.full(dim, i, dtype=np.float32)
+
+
+def test_put_get_and_reopen(tmp_path):
+    cache = DiskVectorCache(str(tmp_path), max_entries=8)
+    cache.put_many(["a", "b"], [_vec(1), _vec(2)])
+    assert np.array_equal(cache.get("a"), _vec(1))
+    assert cache.get("missing") is None
+
+    reopened = DiskVectorCache(str(tmp_path), max_entries=8)
+    assert len(reopened) == 2
+    assert np.array_equal(reopened.get("b"), _vec(2))
+
+
+def test_oldest_entries_are_evicted_round_robin(tmp_path):
+    cache = DiskVectorCache(str(tmp_path), max_entries=3)
+    cache.put_many(["a", "b", "c", "d"], [_vec(i) for i in range(4)])
+    assert cache.get("a") is None
+    assert [cache.get(k)[0] for k in "bcd"] == [1, 2, 3]
+
+
+def test_compaction_keeps_entries_and_eviction_order(tmp_path):
+    cache = DiskVectorCache(str(tmp_path), max_entries=3)
+    for i in range(10):
+        cache.put_many([f"k{i}"], [_vec(i)])
+    assert cache.log_lines <= 2 * 3
+    reopened = DiskVectorCache(str(tmp_path), max_entries=3)
+    assert [reopened.get(f"k{i}")[0] for i in (7, 8, 9)] == [7, 8, 9]
+    reopened.put_many(["new"], [_vec(42)])
+    assert reopened.get("k7") is None and reopened.get("k8")[0] == 8
+
+
+def test_changed_capacity_starts_over(tmp_path):
+    DiskVectorCache(str(tmp_path), max_entries=4).put_many(["a"], [_vec(1)])
+    assert DiskVectorCache(str(tmp_path), max_entries=5).get("a") is None
+
+
+def test_two_handles_never_share_a_slot(tmp_path):
+    # Like the app and ingest.py: each has its own view of the same directory.
+    app = DiskVectorCache(str(tmp_path), max_entries=16)
+    ingest = DiskVectorCache(str(tmp_path), max_entries=16)
+    ingest.put_many(["doc1"], [_vec(1)])
+    app.put_many(["query"], [_vec(2)])
+    assert np.array_equal(ingest.get("doc1"), _vec(1))
+    assert np.array_equal(ingest.get("query"), _vec(2))
+    assert np.array_equal(app.get("doc1"), _vec(1))
+
+
+def test_reader_drops_keys_whose_slot_was_overwritten(tmp_path):
+    reader = DiskVectorCache(str(tmp_path), max_entries=2)
+    writer = DiskVectorCache(str(tmp_path), max_entries=2)
+    writer.put_many(["a"], [_vec(1)])
+    assert reader.get("a")[0] == 1
+    writer.put_many(["b", "c"], [_vec(2), _vec(3)])
+    assert reader.get("a") is None
+    assert reader.get("c")[0] == 3
+
+
+def test_reader_follows_compaction_by_another_handle(tmp_path):
+    reader = DiskVectorCache(str(tmp_path), max_entries=2)
+    writer = DiskVectorCache(str(tmp_path), max_entries=2)
+    for i in range(7):
+        writer.put_many([f"k{i}"], [_vec(i)])
+    assert reader.get("k6")[0] == 6 and reader.get("k5")[0] == 5
+    assert reader.get("k4") is None
+
+
+def _writer(path, prefix, n):
+    cache = DiskVectorCache(path, max_entries=1000)
+    for i in range(n):
+        cache.put_many([f"{prefix}{i}"], [np.full(4, hash((prefix, i)) % 1000, dtype=np.float32)])
+
+
+def test_concurrent_processes_keep_every_vector_with_its_key(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_writer, args=(str(tmp_path), p, 100)) for p in "xyz"]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    cache = DiskVectorCache(str(tmp_path), max_entries=1000)
+    assert len(cache) == 300
+    for p in "xyz":
+        for i in range(100):
+            assert cache.get(f"{p}{i}")[0] == hash((p, i)) % 1000
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_cached_embeddings_only_embeds_misses_once(tmp_path):
+    base = CountingEmbeddings()
+    emb = CachedEmbeddings(base, "some/model", cache_dir=str(tmp_path), max_entries=10, memory_entries=1)
+    assert emb.embed_documents(["ab", "abc", "ab"]) == [[2.0, 1.0], [3.0, 1.0], [2.0, 1.0]]
+    assert base.calls == [["ab", "abc"]]
+    assert emb.embed_query("abc") == [3.0, 1.0]
+    assert base.calls == [["ab", "abc"]]
+
+    fresh = CachedEmbeddings(CountingEmbeddings(), "some/model", cache_dir=str(tmp_path), max_entries=10)
+    assert fresh.embed_query("ab") == [2.0, 1.0]
+    assert fresh.stats()["disk_hits"] == 1 and fresh.base.calls == []
+    assert fresh.disk.get(text_key("ab")) is not None
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from langchain_ollama import OllamaEmbeddings
+
+from utils.embed_pipeline import AdaptiveEmbedder
+from utils.stub_ollama import start_stub_ollama, stub_embedding
+
+TEXTS = [f"book number {i} about dragons and tea" for i in range(200)]
+
+
+@pytest.fixture
+def stub_ollama():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_ollama(dim=16, **kwargs)
+        servers.append(server)
+        return server, OllamaEmbeddings(model="stub", base_url=url)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class Flaky:
+    """Fails the first `failures` calls, then embeds every text as [len(text)]."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("500 EOF")
+        return [[float(len(text))] for text in texts]
+
+
+def test_grows_to_the_largest_batch_size(stub_ollama):
+    server, embeddings = stub_ollama()
+    embedder = AdaptiveEmbedder(embeddings, initial_batch_size=4, max_batch_size=32, max_concurrency=1)
+    vectors = embedder.embed(TEXTS)
+    np.testing.assert_allclose(vectors, [stub_embedding(text, 16) for text in TEXTS], atol=1e-6)
+    assert embedder.batch_size == 32
+    assert embedder.failures == 0
+    # 4, 8, 16, then halfway towards the cap: 24, 28, 30, 31, 32, and the 27 left over.
+    assert server.embed_requests == 9
+
+
+def test_settles_below_what_the_server_copes_with(stub_ollama):
+    server, embeddings = stub_ollama(max_batch=12)
+    embedder = AdaptiveEmbedder(embeddings, initial_batch_size=4, max_batch_size=64, max_concurrency=1)
+    vectors = embedder.embed(TEXTS)
+    np.testing.assert_allclose(vectors, [stub_embedding(text, 16) for text in TEXTS], atol=1e-6)
+    assert 0 < embedder.failures == server.embed_failures
+    assert 6 <= embedder.batch_size <= 12
+    # Once the ceiling is known, growth stops probing at sizes that are bound to fail.
+    failures = server.embed_failures
+    embedder.embed(TEXTS)
+    assert server.embed_failures - failures <= 1
+
+
+def test_keeps_order_with_concurrent_requests(stub_ollama):
+    _, embeddings = stub_ollama(per_item_latency=0.001)
+    embedder = AdaptiveEmbedder(embeddings, initial_batch_size=2, max_batch_size=16, max_concurrency=4)
+    vectors = embedder.embed(TEXTS)
+    np.testing.assert_allclose(vectors, [stub_embedding(text, 16) for text in TEXTS], atol=1e-6)
+
+
+def test_failed_batch_is_retried_one_by_one_with_backoff():
+    flaky = Flaky(failures=2)  # the batch, then the first single text once
+    embedder = AdaptiveEmbedder(flaky, initial_batch_size=4, max_concurrency=1, backoff=0.001)
+    assert embedder.embed(["a", "bb", "ccc", "dddd"]) == [[1.0], [2.0], [3.0], [4.0]]
+    assert embedder.failures == 2
+    assert embedder.batch_size == 2
+    assert embedder.requests == 1 + 5
+
+
+def test_single_text_batches_are_retried_too():
+    flaky = Flaky(failures=2)
+    embedder = AdaptiveEmbedder(flaky, initial_batch_size=1, max_concurrency=1, backoff=0.001)
+    assert embedder.embed(["a", "bb", "ccc"]) == [[1.0], [2.0], [3.0]]
+    assert embedder.failures == 2
+    assert embedder.batch_size == 4  # it grows again once texts go through: 1, then 2
+
+
+def test_gives_up_on_a_text_after_max_retries():
+    flaky = Flaky(failures=100)
+    embedder = AdaptiveEmbedder(flaky, initial_batch_size=2, max_concurrency=1, max_retries=2, backoff=0.001)
+    with pytest.raises(ConnectionError):
+        embedder.embed(["a", "b"])
+    # The batch, then "a" three times.
+    assert flaky.calls == 1 + 3
@@ -0,0 +1,83 @@
+import json
+import random
+import time
+
+import pandas as pd
+import pytest
+
+import utils.get_blurbs as get_blurbs
+from utils.get_blurbs import TokenBucket, fetch_blurbs, get_book_blurb, load_checkpoint, make_session
+from utils.stub_books_api import start_stub_server
+
+
+@pytest.fixture
+def books_api(monkeypatch):
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_server(**kwargs)
+        servers.append(server)
+        monkeypatch.setattr(get_blurbs, "BASE_URL", url)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _export(n):
+    return pd.DataFrame({
+        "Book Id": [str(100 + i) for i in range(n)],
+        "Title": [f"Book {i}" for i in range(n)],
+        "Author": ["Some Author"] * n,
+        "clean_isbn13": [f"978000000{i:04d}" for i in range(n)],
+        "clean_isbn": [None] * n,
+    })
+
+
+def test_fetches_every_book_through_transient_errors(books_api, tmp_path):
+    # One worker keeps the stub's random 429/503s reproducible.
+    random.seed(7)
+    server = books_api(error_rate=0.3)
+    blurbs = fetch_blurbs(_export(40), checkpoint_path=str(tmp_path / "ckpt.jsonl"), max_workers=1,
+                          requests_per_second=1000)
+    assert blurbs.tolist() == [f"A stub blurb for 'isbn:978000000{i:04d}'." for i in range(40)]
+    assert server.request_count > 40  # some books needed a retry
+
+
+def test_gives_up_after_max_retries(books_api):
+    server = books_api(error_rate=1.0)
+    blurb = get_book_blurb("9780000000001", None, "T", "A", session=make_session(1), max_retries=2)
+    assert blurb.startswith("API Request Error")
+    assert server.request_count == 3
+
+
+def test_unknown_isbn_is_not_found_and_search_terms_are_required(books_api):
+    books_api(books={"isbn:9780000000001": "Known."})
+    session = make_session(1)
+    assert get_book_blurb("9780000000001", None, "T", "A", session=session) == "Known."
+    assert get_book_blurb("9780000000002", None, "T", "A", session=session) == "Book not found via API."
+    assert get_book_blurb(None, None, float("nan"), "A").startswith("No valid search terms")
+
+
+def test_resumes_from_the_checkpoint(books_api, tmp_path):
+    server = books_api()
+    checkpoint = tmp_path / "ckpt.jsonl"
+    with open(checkpoint, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"key": "100", "blurb": "From the last run."}) + "\n")
+        f.write(json.dumps({"key": "101", "blurb": "API Request Error: 503"}) + "\n")  # retried
+        f.write('{"key": "102", "blu')  # torn line of an interrupted run
+    blurbs = fetch_blurbs(_export(4), checkpoint_path=str(checkpoint), max_workers=2, requests_per_second=1000)
+    assert blurbs[0] == "From the last run."
+    assert server.request_count == 3
+    assert set(load_checkpoint(str(checkpoint))) == {"100", "101", "102", "103"}
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # The first token is there already; the other ten take 1/100 s each.
+    assert time.monotonic() - start >= 0.09
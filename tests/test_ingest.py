@@ -0,0 +1,164 @@
+import sys
+
+import pandas as pd
+import pytest
+from langchain_community.vectorstores import Chroma
+
+import ingest
+import utils.prep as prep
+from graph_builder import LibraryGraph
+from ingest import keyed_documents, plan_sync
+from utils.store_version import read_store_version, store_is_dirty
+from utils.taste_profile import TasteProfile
+from utils.stub_ollama import start_stub_ollama
+from utils.vector_index import NumpyVectorStore
+
+BOOKS = [
+    {"Book Id": "101", "Title": "Dune", "Author": "Frank Herbert", "My Rating": 5, "Exclusive Shelf": "read",
+     "Blurb": "Sand, spice and a desert planet."},
+    {"Book Id": "102", "Title": "Emma", "Author": "Jane Austen", "My Rating": 3, "Exclusive Shelf": "read",
+     "Blurb": "A matchmaker in a small village."},
+    {"Book Id": "103", "Title": "Ulysses", "Author": "James Joyce", "My Rating": 0, "Exclusive Shelf": "dnf",
+     "Blurb": "One day in Dublin."},
+    {"Book Id": "104", "Title": "Persuasion", "Author": "Jane Austen", "My Rating": 0, "Exclusive Shelf": "to-read",
+     "Blurb": "A second chance, eight years later."},
+]
+
+
+def _documents(tmp_path, books, name="export.csv"):
+    path = tmp_path / name
+    pd.DataFrame(books).to_csv(path, index=False)
+    return keyed_documents(prep.iter_book_documents_from_csv(str(path)))
+
+
+def _stored(keyed_docs):
+    return {key: dict(doc.metadata) for key, doc in keyed_docs.items()}
+
+
+def test_first_run_embeds_everything(tmp_path):
+    keyed = _documents(tmp_path, BOOKS)
+    assert plan_sync(keyed, {}) == (["101", "102", "103", "104"], [], [])
+
+
+def test_unchanged_export_needs_nothing(tmp_path):
+    existing = _stored(_documents(tmp_path, BOOKS, "v1.csv"))
+    assert plan_sync(_documents(tmp_path, BOOKS, "v2.csv"), existing) == ([], [], [])
+
+
+def test_added_updated_and_deleted_books(tmp_path):
+    existing = _stored(_documents(tmp_path, BOOKS, "v1.csv"))
+    books = [dict(book) for book in BOOKS if book["Book Id"] != "103"]  # deleted
+    books[0]["Blurb"] = "Spice, sand and a desert planet."                # new text: re-embedded
+    books[1]["My Rating"] = 4                                            # metadata only
+    books.append({"Book Id": "105", "Title": "Beloved", "Author": "Toni Morrison", "My Rating": 5,
+                  "Exclusive Shelf": "read", "Blurb": "A house haunted by the past."})
+    to_embed, to_update, to_delete = plan_sync(_documents(tmp_path, books, "v2.csv"), existing)
+    assert sorted(to_embed) == ["101", "105"]
+    assert to_update == ["102"]
+    assert to_delete == ["103"]
+
+
+def test_books_without_an_id_keep_a_stable_key(tmp_path):
+    books = [dict(book) for book in BOOKS]
+    books[2]["Book Id"] = None
+    first = _documents(tmp_path, books, "v1.csv")
+    assert [key for key in first if key.startswith("ta-")] == [list(first)[2]]
+    assert plan_sync(_documents(tmp_path, books, "v2.csv"), _stored(first)) == ([], [], [])
+
+
+def test_duplicate_ids_keep_the_last_row(tmp_path):
+    books = BOOKS + [dict(BOOKS[0], Blurb="A later edition.")]
+    keyed = _documents(tmp_path, books)
+    assert len(keyed) == 4
+    assert keyed["101"].page_content == "A later edition."
+
+
+MORE_BOOKS = [
+    {"Book Id": str(200 + i), "Title": f"Sequel {i}", "Author": f"Writer {i % 3}", "My Rating": i % 6,
+     "Exclusive Shelf": "read", "Blurb": f"Another voyage, number {i}, with dragons and tea."}
+    for i in range(6)
+]
+
+
+@pytest.fixture
+def run_ingest(tmp_path, monkeypatch):
+    """Runs ingest.main() on a CSV of `books` against the stub Ollama, with two books per chunk."""
+    server, url = start_stub_ollama(dim=16)
+    monkeypatch.setenv("OLLAMA_HOST", url)
+    monkeypatch.setattr(ingest, "INSERT_CHUNK", 2)
+    persist_dir = str(tmp_path / "store")
+
+    def run(books, backend, incremental=False):
+        csv_path = tmp_path / "export.csv"
+        pd.DataFrame(books).to_csv(csv_path, index=False)
+        cfg = {"goodreads_csv_path": str(csv_path), "persist_dir": persist_dir, "embed_model": "stub",
+               "index_backend": backend, "embed_cache_dir": str(tmp_path / "embed_cache")}
+        monkeypatch.setattr(ingest.config, "load_config", lambda path: cfg)
+        monkeypatch.setattr(sys, "argv", ["ingest.py"] + (["--incremental"] if incremental else []))
+        ingest.main()
+        return persist_dir
+
+    yield run
+    server.shutdown()
+    server.server_close()
+
+
+def _stored_ids(persist_dir, backend):
+    if backend == "numpy":
+        return set(NumpyVectorStore.load(persist_dir).ids)
+    return set(Chroma(persist_directory=persist_dir).get(include=[])["ids"])
+
+
+@pytest.mark.parametrize("backend", ["chroma", "numpy"])
+def test_interrupted_ingest_is_caught_up_by_the_next_one(run_ingest, monkeypatch, backend):
+    persist_dir = run_ingest(BOOKS, backend)
+    version = read_store_version(persist_dir)
+    assert not store_is_dirty(persist_dir)
+
+    # The third chunk of new books fails: Chroma already holds the first two. After the first
+    # one, a reader cached a taste profile under the version the ingest had already bumped.
+    upsert = ingest.upsert_embedded
+    calls = []
+
+    def failing_upsert(vectorstore, *args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise ConnectionError("Ollama went away")
+        upsert(vectorstore, *args)
+        if len(calls) == 1:
+            TasteProfile.from_store(vectorstore).save(persist_dir, read_store_version(persist_dir))
+
+    monkeypatch.setattr(ingest, "upsert_embedded", failing_upsert)
+    with pytest.raises(ConnectionError):
+        run_ingest(BOOKS + MORE_BOOKS, backend, incremental=True)
+    # Readers already see a new version, and the next run knows it has to rebuild.
+    assert store_is_dirty(persist_dir) and read_store_version(persist_dir) != version
+
+    monkeypatch.setattr(ingest, "upsert_embedded", upsert)
+    run_ingest(BOOKS + MORE_BOOKS, backend, incremental=True)
+    assert not store_is_dirty(persist_dir)
+    ids = _stored_ids(persist_dir, backend)
+    assert len(ids) == 10
+    graph = LibraryGraph.load(persist_dir)
+    assert set(graph.books.index) == ids and graph.store_version == read_store_version(persist_dir)
+    profile = TasteProfile.load(persist_dir)
+    assert set(profile.ids) == ids and profile.store_version == read_store_version(persist_dir)
+
+
+def test_ingest_that_died_after_the_store_rebuilds_graph_and_profile(run_ingest, monkeypatch):
+    persist_dir = run_ingest(BOOKS, "chroma")
+    # Everything reached the store; the run died while saving what is derived from it.
+    save = LibraryGraph.save
+
+    def failing_save(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(LibraryGraph, "save", failing_save)
+    with pytest.raises(OSError):
+        run_ingest(BOOKS + MORE_BOOKS, "chroma", incremental=True)
+    monkeypatch.setattr(LibraryGraph, "save", save)
+    # Nothing is left to embed, but the graph is rebuilt anyway.
+    run_ingest(BOOKS + MORE_BOOKS, "chroma", incremental=True)
+    assert not store_is_dirty(persist_dir)
+    ids = _stored_ids(persist_dir, "chroma")
+    assert set(LibraryGraph.load(persist_dir).books.index) == ids == set(TasteProfile.load(persist_dir).ids)
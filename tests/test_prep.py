@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+import utils.prep as prep
+from graph_builder import LibraryGraph, build_knowledge_graph
+
+METADATA_KEYS = ["title", "author", "rating", "pages", "shelf", "book_id", "clean_blurb", "my_review", "user_verdict"]
+
+
+def reference_documents(df):
+    """The original row-by-row create_book_documents, as (page_content, metadata) pairs."""
+    docs = []
+    for _, row in df.iterrows():
+        blurb_text = str(row.get('blurb', '')).strip()
+        review_text = str(row.get('my_review', '')).strip()
+        rating = row.get('my_rating', 0)
+        shelf = row.get('exclusive_shelf', 'unknown')
+        pages = row.get('number_of_pages', 'unknown')
+        title = row.get('title', 'N/A')
+        author = row.get('author', 'N/A')
+        page_content = blurb_text
+        lowered = page_content.lower()
+        if (not page_content or 'no blurb found' in lowered or 'book not found' in lowered
+                or 'api request error' in lowered):
+            page_content = f"Title: {title}\nAuthor: {author}"
+            blurb_text = ""
+        user_verdict = ""
+        if shelf in ['dnf', 'did-not-finish']:
+            user_verdict = "[USER OPINION: STRONGLY NEGATIVE (Did Not Finish)]"
+        elif rating >= 4:
+            user_verdict = f"[USER OPINION: EXTRAORDINARY ({rating}/5 stars)]"
+        elif rating == 3:
+            user_verdict = f"[USER OPINION: GOOD ({rating}/5 stars)]"
+        elif rating > 0:
+            user_verdict = f"[USER OPINION: NEGATIVE ({rating}/5 stars)]"
+        docs.append((page_content, {
+            "title": title,
+            "author": author,
+            "rating": int(rating),
+            "pages": int(pages) if str(pages).isdigit() else 0,
+            "shelf": shelf,
+            "book_id": str(row.get('book_id', '')),
+            "clean_blurb": blurb_text,
+            "my_review": review_text.replace('<br/>', '\n') if review_text and review_text != 'nan' else "",
+            "user_verdict": user_verdict,
+        }))
+    return docs
+
+
+def _export(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    blurbs = ["A quiet story about tea.", "", "No blurb found.", "API Request Error: 503", "  Book not found via API. ",
+              "Dragons over the sea.\nAnd more dragons."]
+    reviews = ["", "Loved it.<br/>Would read again.", "  meh  ", "Too long." * 5]
+    return pd.DataFrame({
+        "Book Id": np.arange(1000, 1000 + n),
+        "Title": [f"Title {i}" for i in range(n)],
+        "Author": [f"Author {i % 17}" for i in range(n)],
+        "My Rating": rng.integers(0, 6, n),
+        "Number of Pages": rng.integers(0, 900, n),
+        "Exclusive Shelf": rng.choice(["read", "to-read", "dnf", "did-not-finish", "currently-reading"], n),
+        "My Review": rng.choice(reviews, n),
+        "Blurb": rng.choice(blurbs, n),
+    })
+
+
+def _raw_prepped(path):
+    """What the original load_and_prep_data handed to create_book_documents."""
+    df = pd.read_csv(path)
+    df.columns = [prep.normalize_column(col) for col in df.columns]
+    df = df[df['exclusive_shelf'].isin(['read', 'dnf', 'did-not-finish', 'to-read'])].copy()
+    df['my_review'] = df['my_review'].fillna('')
+    df['blurb'] = df['blurb'].fillna('')
+    return df
+
+
+def test_documents_match_the_row_by_row_version(tmp_path):
+    path = tmp_path / "export.csv"
+    _export().to_csv(path, index=False)
+    docs = list(prep.iter_book_documents_from_csv(str(path), chunksize=64))
+    expected = reference_documents(_raw_prepped(path))
+    assert len(docs) == len(expected) > 0
+    for doc, (page_content, meta) in zip(docs, expected):
+        assert doc.page_content == page_content
+        assert {key: doc.metadata[key] for key in METADATA_KEYS} == meta
+        assert "review_summary" in doc.metadata
+
+
+def test_bad_page_counts_and_missing_columns():
+    df = pd.DataFrame({"title": ["A", "B", "C"], "author": ["X", "Y", "Z"], "number_of_pages": [300, -5, None],
+                       "exclusive_shelf": ["read", "read", "dnf"]})
+    docs = list(prep.iter_book_documents(df))
+    assert [d.metadata["pages"] for d in docs] == [300, 0, 0]
+    assert [d.metadata["rating"] for d in docs] == [0, 0, 0]
+    assert [d.page_content for d in docs] == ["Title: A\nAuthor: X", "Title: B\nAuthor: Y", "Title: C\nAuthor: Z"]
+    assert docs[2].metadata["user_verdict"] == "[USER OPINION: STRONGLY NEGATIVE (Did Not Finish)]"
+
+
+def test_graph_matches_the_row_by_row_version(tmp_path):
+    path = tmp_path / "export.csv"
+    _export(n=120).to_csv(path, index=False)
+    df = prep.load_and_prep_data(str(path))
+    graph = build_knowledge_graph(df)
+    # The original keyed books by title (unique here) and authors by name.
+    for _, row in _raw_prepped(path).iterrows():
+        shelf, rating = row['exclusive_shelf'], row['my_rating']
+        color = "#e31a1c" if shelf in ['dnf', 'did-not-finish'] else "#33a02c" if rating >= 4 else "#1f78b4"
+        node = f"book:{row['book_id']}"
+        assert graph.nodes[node]["color"] == color
+        assert graph.nodes[node]["label"] == row['title']
+        assert graph.has_edge(f"author:{row['author']}", node)
+        assert graph.edges["You", node]["label"] == ("DNF" if shelf in ['dnf', 'did-not-finish'] else f"{rating}★")
+    assert graph.number_of_nodes() == 1 + len(df) + df['author'].nunique()
+
+
+def test_books_with_the_same_title_stay_apart():
+    df = pd.DataFrame({"book_id": ["1", "2"], "title": ["Emma", "Emma"], "author": ["Jane Austen", "Someone Else"],
+                       "my_rating": [5, 1], "exclusive_shelf": ["read", "read"]})
+    graph = LibraryGraph.from_dataframe(df)
+    assert graph.books.index.tolist() == ["1", "2"]
+    assert graph.to_networkx().number_of_nodes() == 1 + 2 + 2
+
+
+def test_book_ids_stay_text_whatever_the_chunk_holds(tmp_path):
+    # A blank id in a chunk used to turn every id parsed with it into a float ("101.0").
+    df = pd.DataFrame({"Book Id": ["101", "102", None, "104"], "Title": list("ABCD"), "Author": list("WXYZ"),
+                       "Exclusive Shelf": ["read"] * 4})
+    path = tmp_path / "export.csv"
+    df.to_csv(path, index=False)
+    for chunksize in (2, 10):
+        ids = [doc.metadata["book_id"] for doc in prep.iter_book_documents_from_csv(str(path), chunksize=chunksize)]
+        assert ids == ["101", "102", "nan", "104"]
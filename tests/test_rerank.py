@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from utils.rerank import LibraryTable, hybrid_rerank, rank_candidates, rank_candidates_batch
+
+SHELVES = ["read", "read", "to-read", "dnf", "did-not-finish", "currently-reading"]
+
+
+def reference_ranking(candidates, k, rating_boost, dnf_penalty):
+    """The original get_recommendation logic: pin the first DNF among the 5 closest, rerank the rest.
+
+    `candidates` are (book_id, metadata, score) nearest first; returns [(book_id, is_pinned)].
+    """
+    def is_dnf(meta):
+        shelf = meta.get("shelf", "").lower()
+        return "dnf" in shelf or "did-not-finish" in shelf
+
+    def rerank(items):
+        scored = []
+        for book_id, meta, score in items:
+            adjustment = 0.0
+            if meta.get("rating", 0) >= 4:
+                adjustment -= rating_boost
+            if is_dnf(meta):
+                adjustment += dnf_penalty
+            scored.append((book_id, score + adjustment))
+        scored.sort(key=lambda x: x[1])
+        return [(book_id, False) for book_id, _ in scored]
+
+    remaining = list(candidates)
+    for i, (book_id, meta, _) in enumerate(candidates[:5]):
+        if is_dnf(meta):
+            remaining.pop(i)
+            return [(book_id, True)] + rerank(remaining)[:k - 1]
+    return rerank(candidates)[:k]
+
+
+def _library(rng, n):
+    ids = [f"b{i}" for i in range(n)]
+    metadatas = [{"rating": int(rng.integers(0, 6)), "shelf": str(rng.choice(SHELVES))} for _ in range(n)]
+    return LibraryTable(ids, metadatas)
+
+
+def _candidates(rng, table, n_candidates):
+    rows = rng.choice(len(table), n_candidates, replace=False)
+    # Coarse scores so that ties (kept in distance order by both versions) come up often.
+    scores = np.sort(np.round(rng.uniform(0, 2, n_candidates), 1))
+    return rows, scores
+
+
+def test_matches_the_original_ranking():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        table = _library(rng, 60)
+        rows, scores = _candidates(rng, table, int(rng.integers(1, 30)))
+        k = int(rng.integers(1, 12))
+        boost, penalty = float(rng.choice([0.0, 0.3, 0.5])), float(rng.choice([0.0, 0.4, 1.0]))
+        got = rank_candidates(table, rows, scores, k, boost, penalty)
+        expected = reference_ranking(
+            [(table.ids[r], table.metadatas[r], s) for r, s in zip(rows, scores)], k, boost, penalty
+        )
+        assert [(book.book_id, book.is_pinned_match) for book in got] == expected
+
+
+def test_dnf_is_pinned_only_within_the_window():
+    table = LibraryTable(["a", "b", "c", "d", "e", "f", "g"],
+                         [{"rating": 5, "shelf": "read"}] * 6 + [{"rating": 0, "shelf": "dnf"}])
+    scores = np.linspace(0.1, 0.7, 7)
+    # The DNF book is 7th closest: outside the default window of 5 and pushed back by its penalty.
+    books = rank_candidates(table, np.arange(7), scores, 3, 0.3, 0.4)
+    assert [b.book_id for b in books] == ["a", "b", "c"] and not any(b.is_pinned_match for b in books)
+    books = rank_candidates(table, np.arange(7), scores, 3, 0.3, 0.4, pin_window=7)
+    assert [b.book_id for b in books] == ["g", "a", "b"]
+    assert books[0].is_pinned_match and books[0].adjustment == 0.0
+    assert books[0].rerank_score == books[0].original_score == pytest.approx(0.7)
+    assert not rank_candidates(table, [6, 0], [0.1, 0.2], 2, 0.3, 0.4, pin_window=0)[0].is_pinned_match
+
+
+def test_missing_rows_are_skipped_and_do_not_use_up_the_window():
+    table = LibraryTable(["a", "b", "dnf"], [{"rating": 3, "shelf": "read"}] * 2 + [{"shelf": "dnf"}])
+    books = rank_candidates(table, [-1, 0, -1, 1, 2], [0.1, 0.2, 0.3, 0.4, 0.5], 5, 0.3, 0.4, pin_window=3)
+    assert [(b.book_id, b.is_pinned_match) for b in books] == [("dnf", True), ("a", False), ("b", False)]
+
+
+def test_batch_matches_single_queries():
+    rng = np.random.default_rng(1)
+    table = _library(rng, 40)
+    blocks = [_candidates(rng, table, 15) for _ in range(6)]
+    batch = rank_candidates_batch(table, [r for r, _ in blocks], [s for _, s in blocks], 4, 0.3, 0.4)
+    assert batch == [rank_candidates(table, r, s, 4, 0.3, 0.4) for r, s in blocks]
+
+
+def test_hybrid_rerank_adjustments():
+    order, scores, adjustments = hybrid_rerank([0.5, 0.4, 0.3], [True, False, False], [False, False, True], 0.3, 0.4)
+    np.testing.assert_allclose(adjustments, [-0.3, 0.0, 0.4])
+    np.testing.assert_allclose(scores, [0.2, 0.4, 0.7])
+    assert order.tolist() == [0, 1, 2]
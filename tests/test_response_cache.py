@@ -0,0 +1,56 @@
+import time
+
+from utils.context_budget import ContextBudget
+from utils.response_cache import ResponseCache, response_key
+
+
+def _key(blurb="A dragon.", **overrides):
+    args = dict(k=5, rating_boost=0.3, dnf_penalty=0.4, chat_model="llama3", embed_model="nomic",
+                store_version="v1")
+    args.update(overrides)
+    return response_key(blurb, **args)
+
+
+def test_key_ignores_whitespace_but_not_settings():
+    assert _key("A  dragon.\n") == _key(" A dragon.")
+    assert _key(k=6) != _key()
+    assert _key(store_version="v2") != _key()
+    assert _key(context_budget=ContextBudget(100, 10, 10)) != _key(context_budget=ContextBudget())
+    # Exact profile search keeps the old key; a capped one gets its own.
+    assert _key(profile_n_probe=0) == _key()
+    assert _key(profile_n_probe=4) != _key()
+
+
+def test_get_put_round_trip_and_counters(tmp_path):
+    cache = ResponseCache(str(tmp_path / "r.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", "v1", {"verdict": "like", "contexts": [1, 2]})
+    assert cache.get("k") == {"verdict": "like", "contexts": [1, 2]}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / "r.sqlite")
+    ResponseCache(path).put("k", "v1", {"a": 1})
+    assert ResponseCache(path).get("k") == {"a": 1}
+
+
+def test_new_store_version_drops_older_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / "r.sqlite"))
+    cache.put("old", "v1", 1)
+    cache.put("new", "v2", 2)
+    assert cache.get("old") is None
+    assert cache.get("new") == 2
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "r.sqlite"), max_entries=2)
+    cache.put("a", "v1", 1)
+    time.sleep(0.01)
+    cache.put("b", "v1", 2)
+    time.sleep(0.01)
+    assert cache.get("a") == 1  # "a" is now fresher than "b"
+    time.sleep(0.01)
+    cache.put("c", "v1", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
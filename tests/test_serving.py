@@ -0,0 +1,252 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.serving import EmbeddingBatcher, GenerationQueue, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# --- EmbeddingBatcher ------------------------------------------------------
+
+class RecordingEmbedder:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if self.fail:
+            raise RuntimeError("embedder down")
+        return [[float(len(t))] for t in texts]
+
+
+def test_concurrent_texts_share_a_batch_and_duplicates_are_embedded_once():
+    embedder = RecordingEmbedder()
+
+    async def main():
+        batcher = EmbeddingBatcher(embedder, max_batch_size=8, max_wait=0.05)
+        try:
+            return await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "a", "ccc"])), batcher.stats()
+        finally:
+            await batcher.close()
+
+    vectors, stats = run(main())
+    assert vectors == [[1.0], [2.0], [1.0], [3.0]]
+    assert embedder.batches == [["a", "bb", "ccc"]]
+    assert stats["batches"] == 1 and stats["texts"] == 4
+
+
+def test_batches_never_exceed_max_batch_size():
+    embedder = RecordingEmbedder()
+
+    async def main():
+        batcher = EmbeddingBatcher(embedder, max_batch_size=3, max_wait=0.05)
+        try:
+            return await asyncio.gather(*(batcher.embed(str(i)) for i in range(7)))
+        finally:
+            await batcher.close()
+
+    assert len(run(main())) == 7
+    assert sorted(len(b) for b in embedder.batches) == [1, 3, 3]
+
+
+def test_embedder_errors_reach_every_caller_in_the_batch():
+    async def main():
+        batcher = EmbeddingBatcher(RecordingEmbedder(fail=True), max_wait=0.01)
+        try:
+            return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    assert all(isinstance(r, RuntimeError) for r in run(main()))
+
+
+def test_full_embedding_queue_is_rejected():
+    gate = threading.Event()
+
+    def blocked(texts):
+        gate.wait(5)
+        return [[0.0] for _ in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(blocked, max_batch_size=1, max_wait=0, max_in_flight=1, max_pending=2)
+        tasks = []
+        # One batch in flight, one held by the collector, two waiting in the queue.
+        for i in range(4):
+            tasks.append(asyncio.create_task(batcher.embed(str(i))))
+            await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(Overloaded):
+                await batcher.embed("one too many")
+        finally:
+            gate.set()
+            await asyncio.gather(*tasks)
+            await batcher.close()
+
+    run(main())
+
+
+# --- GenerationQueue -------------------------------------------------------
+
+def test_at_most_max_concurrency_calls_run_at_once():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return x * 2
+
+    async def main():
+        queue = GenerationQueue(max_concurrency=2, max_waiting=10, timeout=5)
+        try:
+            return await asyncio.gather(*(queue.run(work, i) for i in range(6))), queue.stats()
+        finally:
+            queue.close()
+
+    results, stats = run(main())
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert peak[0] == 2
+    assert stats["completed"] == 6 and stats["active"] == 0 and stats["waiting"] == 0
+
+
+def test_overflowing_the_waiting_room_raises_overloaded():
+    gate = threading.Event()
+
+    async def main():
+        queue = GenerationQueue(max_concurrency=1, max_waiting=1, timeout=5)
+        first = asyncio.create_task(queue.run(gate.wait, 5))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(queue.run(lambda: "second"))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(Overloaded):
+                await queue.run(lambda: "third")
+        finally:
+            gate.set()
+        assert await second == "second"
+        await first
+        assert queue.stats()["rejected"] == 1
+        queue.close()
+
+    run(main())
+
+
+def test_timed_out_generation_keeps_its_slot_until_it_finishes():
+    gate = threading.Event()
+
+    async def main():
+        queue = GenerationQueue(max_concurrency=1, max_waiting=4, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await queue.run(gate.wait, 5)
+        assert queue.stats()["active"] == 1
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert queue.stats()["active"] == 0
+        assert await queue.run(lambda: "free again") == "free again"
+        queue.close()
+
+    run(main())
+
+
+def _frozen_clock(loop):
+    now = [loop.time()]
+    loop.time = lambda: now[0]
+    return now
+
+
+def _settle(check, steps=500):
+    async def wait():
+        for _ in range(steps):
+            if check():
+                return
+            time.sleep(0.001)  # let executor threads finish
+            await asyncio.sleep(0)
+    return wait()
+
+
+def test_slot_granted_as_the_wait_times_out_is_not_lost():
+    async def main():
+        loop = asyncio.get_running_loop()
+        now = _frozen_clock(loop)
+        queue = GenerationQueue(max_concurrency=1, max_waiting=4, timeout=1.0)
+        queue.semaphore = asyncio.Semaphore(1)
+        await queue.semaphore.acquire()  # someone else holds the only slot
+
+        def holder_finishes():
+            # The slot is granted now, and the waiter's timeout is due in the
+            # very next loop step, before the waiter gets to run.
+            queue.semaphore.release()
+            now[0] += 1.0
+
+        waiter = asyncio.create_task(queue.run(lambda: "ran"))
+        for _ in range(3):
+            await asyncio.sleep(0)  # until the waiter is parked on the semaphore
+        loop.call_at(now[0] + 0.5, holder_finishes)
+        now[0] += 0.5
+        try:
+            await waiter
+        except asyncio.TimeoutError:
+            pass
+        # Whether the waiter ran or timed out, the slot must come back.
+        await _settle(lambda: not queue.semaphore.locked())
+        assert not queue.semaphore.locked()
+        queue.close()
+
+    run(main())
+
+
+def test_slot_granted_as_the_waiter_is_cancelled_is_handed_back():
+    calls = []
+
+    async def main():
+        queue = GenerationQueue(max_concurrency=1, max_waiting=4, timeout=5)
+        queue.semaphore = asyncio.Semaphore(1)
+        await queue.semaphore.acquire()
+        waiter = asyncio.create_task(queue.run(calls.append, "ran"))
+        for _ in range(3):
+            await asyncio.sleep(0)  # until the waiter is parked on the semaphore
+
+        # The client goes away in the same loop step in which the slot frees up.
+        # Depending on the Python version, wait_for either kept that slot forever
+        # or swallowed the cancellation and generated for nobody.
+        queue.semaphore.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await _settle(lambda: not queue.semaphore.locked())
+        assert not queue.semaphore.locked()
+        queue.close()
+
+    run(main())
+    assert calls == []
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    async def main():
+        queue = GenerationQueue(max_concurrency=1, max_waiting=4, timeout=5)
+        gate = threading.Event()
+        holder = asyncio.create_task(queue.run(gate.wait, 5))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(queue.run(lambda: "never"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        gate.set()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+        assert not queue.semaphore.locked()
+        assert queue.stats()["waiting"] == 0
+        queue.close()
+
+    run(main())
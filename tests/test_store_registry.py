@@ -0,0 +1,172 @@
+import threading
+import time
+
+import pytest
+
+from utils.store_registry import StoreRegistry
+
+
+class FakeStore:
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Opener:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, key):
+        with self.lock:
+            self.calls.append(key)
+        time.sleep(self.delay)
+        return FakeStore(key)
+
+
+def test_get_reuses_an_open_store():
+    opener = Opener()
+    registry = StoreRegistry(opener, max_open=2)
+    assert registry.get("a") is registry.get("a")
+    assert opener.calls == ["a"]
+
+
+def test_least_recently_used_store_is_closed():
+    closed = []
+    registry = StoreRegistry(Opener(), max_open=2, on_close=lambda key, store: closed.append(key))
+    a = registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert closed == ["b"]
+    assert not a.closed
+    assert registry.stats()["libraries"] == ["a", "c"]
+    assert registry.stats()["evicted"] == 1
+
+
+def test_concurrent_gets_share_one_load():
+    opener = Opener(delay=0.05)
+    registry = StoreRegistry(opener)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("a"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert opener.calls == ["a"]
+    assert all(store is results[0] for store in results)
+
+
+def test_failed_load_is_not_cached():
+    attempts = []
+
+    def flaky(key):
+        attempts.append(key)
+        if len(attempts) == 1:
+            raise OSError("disk hiccup")
+        return FakeStore(key)
+
+    registry = StoreRegistry(flaky)
+    with pytest.raises(OSError):
+        registry.get("a")
+    assert registry.get("a").key == "a"
+    assert attempts == ["a", "a"]
+
+
+def test_leased_store_is_closed_only_after_the_lease_ends():
+    closed = []
+    registry = StoreRegistry(Opener(), max_open=1, on_close=lambda key, store: closed.append(key))
+    with registry.lease("a") as a:
+        registry.get("b")  # evicts "a" while it is still in use
+        assert not a.closed and closed == []
+    assert a.closed and closed == ["a"]
+
+
+def test_nested_leases_keep_the_store_open():
+    registry = StoreRegistry(Opener(), max_open=1)
+    with registry.lease("a") as outer:
+        with registry.lease("a"):
+            registry.close("a")
+        assert not outer.closed
+    assert outer.closed
+    assert registry.leases == {}
+
+
+def test_lease_is_released_when_the_load_fails():
+    def broken(key):
+        raise OSError("gone")
+
+    registry = StoreRegistry(broken)
+    with pytest.raises(OSError):
+        with registry.lease("a"):
+            pass
+    assert registry.leases == {}
+
+
+def test_resize_and_close_all():
+    registry = StoreRegistry(Opener(), max_open=3)
+    stores = [registry.get(key) for key in "abc"]
+    registry.resize(1)
+    assert [s.closed for s in stores] == [True, True, False]
+    registry.close_all()
+    assert stores[2].closed
+    assert registry.stats()["open"] == 0
+
+
+def test_warm_opens_in_the_background():
+    registry = StoreRegistry(Opener(delay=0.01))
+    store = registry.warm("a").result(timeout=5)
+    assert registry.get("a") is store
+    assert registry.warm("a").result() is store
+    registry.close_all()
+
+
+class SizedStore(FakeStore):
+    def __init__(self, key, size):
+        super().__init__(key)
+        self.size = size
+
+    def nbytes(self):
+        return self.size
+
+
+def test_memory_budget_closes_least_recently_used_stores():
+    sizes = {"a": 40, "b": 30, "c": 50, "huge": 500}
+    registry = StoreRegistry(lambda key: SizedStore(key, sizes[key]), max_open=10, max_bytes=100)
+    a, b = registry.get("a"), registry.get("b")
+    registry.get("a")
+    registry.get("c")  # 120 bytes open: "b" goes first
+    assert b.closed and not a.closed
+    assert registry.stats()["bytes"] == 90
+    # A store bigger than the whole budget still opens; everything else makes room for it.
+    huge = registry.get("huge")
+    assert not huge.closed and registry.stats()["libraries"] == ["huge"]
+    registry.resize(10, max_bytes=0)
+    assert registry.get("a") is not a and registry.stats()["libraries"] == ["huge", "a"]
+
+
+def test_store_nbytes_estimates():
+    import numpy as np
+
+    from utils.store_registry import store_nbytes
+    from utils.vector_index import NumpyVectorStore
+
+    class Collection:
+        def count(self):
+            return 1000
+
+        def peek(self, n):
+            return {"embeddings": [[0.0] * 768]}
+
+    class ChromaLike:
+        _collection = Collection()
+
+    assert store_nbytes(SizedStore("a", 123)) == 123
+    numpy_store = NumpyVectorStore("", ["a", "b"], [{}, {}], ["", ""], np.zeros((2, 768), dtype=np.float32))
+    assert store_nbytes(numpy_store) > 2 * 768 * 4
+    assert 1000 * 768 * 4 < store_nbytes(ChromaLike()) < 1000 * 768 * 8
+    assert store_nbytes(FakeStore("a")) == 0
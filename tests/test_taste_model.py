@@ -0,0 +1,82 @@
+import numpy as np
+
+from utils.taste_model import TasteModel, like_labels, taste_queries, train_from_store
+from utils.vector_index import NumpyVectorStore, normalize_rows
+
+
+def _two_tastes(n=200, dim=16, seed=0):
+    """Liked books around one direction, disliked ones around another."""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(2, dim)))
+    labels = rng.integers(0, 2, n)
+    vectors = centers[1 - labels] + 0.3 * rng.normal(size=(n, dim))
+    return vectors.astype(np.float32), labels, centers
+
+
+def test_labels_from_rating_and_shelf():
+    metadatas = [{"rating": 5, "shelf": "read"}, {"rating": 4, "shelf": "dnf"}, {"rating": 2, "shelf": "read"},
+                 {"rating": 3, "shelf": "read"}, {"rating": 0, "shelf": "to-read"}, {"shelf": "did-not-finish"}]
+    assert like_labels(metadatas).tolist() == [1, 0, 0, -1, -1, 0]
+
+
+def test_separates_liked_from_disliked_books():
+    vectors, labels, centers = _two_tastes()
+    model = TasteModel().fit(vectors[:150], labels[:150])
+    probs = model.predict_proba(vectors[150:])
+    assert ((probs >= 0.5) == (labels[150:] == 1)).mean() >= 0.95
+    assert model.predict_proba(centers[0])[0] > 0.9 > 0.1 > model.predict_proba(centers[1])[0]
+
+
+def test_one_class_only_predicts_the_prior():
+    vectors, _, _ = _two_tastes(n=20)
+    model = TasteModel().fit(vectors, np.ones(20))
+    np.testing.assert_allclose(model.predict_proba(vectors), 0.999, atol=1e-6)
+
+
+def test_probabilities_are_roughly_calibrated():
+    # Labels drawn from a known logistic model: the predicted rates should track the observed ones.
+    rng = np.random.default_rng(1)
+    vectors = normalize_rows(rng.normal(size=(4000, 8)))
+    truth = 1 / (1 + np.exp(-(vectors @ np.full(8, 1.5) + 0.2)))
+    labels = (rng.uniform(size=4000) < truth).astype(int)
+    probs = TasteModel().fit(vectors[:3000], labels[:3000], l2=0.1).predict_proba(vectors[3000:])
+    checked = 0
+    for lo in (0.0, 0.25, 0.5, 0.75):
+        in_bin = (probs >= lo) & (probs < lo + 0.25)
+        if in_bin.sum() > 50:
+            assert abs(probs[in_bin].mean() - labels[3000:][in_bin].mean()) < 0.08
+            checked += 1
+    assert checked >= 3
+
+
+def test_save_load_and_train_from_store(tmp_path):
+    vectors, labels, _ = _two_tastes(n=40)
+    store = NumpyVectorStore.empty(str(tmp_path))
+    metadatas = [{"rating": 5 if label else 1, "shelf": "read"} for label in labels]
+    metadatas[0] = {"rating": 0, "shelf": "to-read"}  # no signal: left out of training
+    store.upsert([str(i) for i in range(40)], vectors, metadatas, [""] * 40)
+    model = train_from_store(store, "v7")
+    assert model.n_train == 39 and model.store_version == "v7"
+    model.save(str(tmp_path))
+    loaded = TasteModel.load(str(tmp_path))
+    assert loaded.store_version == "v7" and loaded.n_train == 39
+    np.testing.assert_allclose(loaded.predict_proba(vectors), model.predict_proba(vectors))
+    assert TasteModel.load(str(tmp_path / "nothing")) is None
+
+
+def test_train_from_store_without_rated_books(tmp_path):
+    store = NumpyVectorStore.empty(str(tmp_path))
+    store.upsert(["a"], np.ones((1, 4)), [{"rating": 0, "shelf": "to-read"}], [""])
+    assert train_from_store(store) is None
+
+
+def test_taste_queries_follow_the_liked_books_and_avoid_dnfs():
+    vectors, labels, centers = _two_tastes(n=100)
+    liked, dnf = labels == 1, labels == 0
+    queries, members = taste_queries(vectors, liked, dnf, n_queries=3)
+    assert len(queries) == len(members) <= 3
+    assert sorted(np.concatenate(members).tolist()) == np.flatnonzero(liked).tolist()
+    np.testing.assert_allclose(np.linalg.norm(queries, axis=1), 1.0, atol=1e-5)
+    assert np.all(queries @ centers[0] > queries @ centers[1])
+    empty, none = taste_queries(vectors, np.zeros(100, bool), dnf)
+    assert empty.shape == (0, 16) and none == []
@@ -0,0 +1,270 @@
+import numpy as np
+import pytest
+
+from recommend_rag import select_contexts_for_vector
+from utils import tracing
+from utils.rerank import LibraryTable
+from utils.taste_profile import TasteProfile
+from utils.vector_index import NumpyVectorStore, normalize_rows
+
+SHELVES = ["read", "to-read", "dnf"]
+
+
+def library(n=600, dim=24, seed=0, spread=0.4):
+    rng = np.random.default_rng(seed)
+    genres = normalize_rows(rng.standard_normal((12, dim)))
+    vectors = normalize_rows(genres[rng.integers(0, 12, n)] + rng.standard_normal((n, dim)) * spread)
+    ids = [f"b{seed}-{i}" for i in range(n)]
+    metadatas = [{"rating": int(rng.integers(0, 6)), "shelf": SHELVES[int(rng.integers(0, 3))]} for _ in range(n)]
+    return ids, vectors.astype(np.float32), metadatas
+
+
+def brute_force(profile, query, n):
+    sims = profile.vectors @ normalize_rows(query)
+    order = np.argsort(-sims, kind="stable")[:n]
+    return [profile.ids[r] for r in order], 2.0 - 2.0 * sims[order]
+
+
+def mean_direction(vectors):
+    return normalize_rows(vectors.sum(axis=0))
+
+
+def assert_same_state(a, b):
+    assert sorted(a.ids) == sorted(b.ids)
+    assert {name: c for name, c in a.counts.items() if c} == {name: c for name, c in b.counts.items() if c}
+    for name in ("all", "liked", "dnf", "shelf:read", "shelf:dnf"):
+        assert np.allclose(a.centroid(name), b.centroid(name), atol=1e-5)
+    flags = lambda p: {i: (bool(p.liked[r]), bool(p.dnf[r]), p.shelves[r]) for i, r in p.row_of.items()}
+    assert flags(a) == flags(b)
+
+
+def test_centroids_match_the_books_on_each_shelf():
+    ids, vectors, metadatas = library()
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    liked = np.array([m["rating"] >= 4 for m in metadatas])
+    dnf = np.array([m["shelf"] == "dnf" for m in metadatas])
+    assert profile.counts["liked"] == liked.sum() and profile.counts["dnf"] == dnf.sum()
+    assert np.allclose(profile.centroid("liked"), mean_direction(vectors[liked]), atol=1e-5)
+    assert np.allclose(profile.centroid("dnf"), mean_direction(vectors[dnf]), atol=1e-5)
+    assert set(profile.shelf_centroids()) == set(SHELVES)
+    assert profile.centroid("shelf:currently-reading") is None
+
+
+@pytest.mark.parametrize("spread", [0.1, 0.4, 3.0])
+def test_search_is_exact(spread):
+    ids, vectors, metadatas = library(spread=spread)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    rng = np.random.default_rng(1)
+    for query in list(vectors[:10] + 0.05) + list(rng.standard_normal((10, vectors.shape[1]))):
+        expected, expected_distances = brute_force(profile, query, 25)
+        # Probing every prototype still prunes, and always answers.
+        for n_probe in (None, len(profile.prototypes)):
+            result = profile.search(query, 25, n_probe)
+            if result is None:
+                continue
+            found, distances, scanned = result
+            assert np.allclose(distances, expected_distances, atol=1e-5)
+            assert set(found) == set(expected)
+            assert 25 <= scanned <= len(profile)
+
+
+def test_hands_the_query_to_the_store_when_pruning_would_not_pay():
+    ids, vectors, metadatas = library(spread=3.0)  # no clusters to speak of
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    rng = np.random.default_rng(2)
+    queries = rng.standard_normal((10, vectors.shape[1]))
+    assert all(profile.search(query, 25) is None for query in queries)
+    # Asking for most of the library leaves nothing to prune either.
+    ids, vectors, metadatas = library(spread=0.1)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    assert profile.search(vectors[0], 10) is not None
+    assert profile.search(vectors[0], 400) is None
+
+
+def test_recommendations_ask_the_store_only_when_the_profile_cannot_prune(tmp_path):
+    ids, vectors, metadatas = library(spread=0.1)
+    store = NumpyVectorStore.empty(str(tmp_path))
+    store.upsert(ids, vectors, metadatas, [""] * len(ids))
+    table = LibraryTable(store.ids, store.metadatas)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    for candidate_pool in (10, 400):
+        trace = tracing.Trace("test")
+        with tracing.activate(trace):
+            books = select_contexts_for_vector(store, table, vectors[0], 5, 0.3, 0.4, candidate_pool, profile)
+        expected = select_contexts_for_vector(store, table, vectors[0], 5, 0.3, 0.4, candidate_pool)
+        assert [b.book_id for b in books] == [b.book_id for b in expected]
+        # Only the profile reports how many rows it scanned.
+        assert ("scanned" in trace.spans[0]) == (candidate_pool == 10)
+
+
+def test_clustered_search_scans_only_part_of_the_library():
+    ids, vectors, metadatas = library(n=3000, spread=0.1)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    _, _, scanned = profile.search(vectors[0], 10)
+    assert scanned < len(profile) // 2
+
+
+def test_n_probe_caps_the_scan():
+    ids, vectors, metadatas = library()
+    profile = TasteProfile.from_rows(ids, vectors, metadatas, n_prototypes=20)
+    found, distances, scanned = profile.search(vectors[3], 5, n_probe=1)
+    nearest = int(np.argmax(profile.prototypes @ vectors[3]))
+    assert scanned == profile.offsets[nearest + 1] - profile.offsets[nearest]
+    assert found[0] == ids[3] and distances[0] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_more_results_than_books():
+    ids, vectors, metadatas = library(n=30)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    assert profile.search(vectors[0], 100) is None
+    found, distances, _ = profile.search(vectors[0], 100, n_probe=len(profile.prototypes))
+    assert len(found) == 30 and np.all(np.diff(distances) >= -1e-6)
+
+
+def test_incremental_updates_match_a_rebuild():
+    ids, vectors, metadatas = library()
+    profile = TasteProfile.from_rows(ids[:500], vectors[:500], metadatas[:500])
+
+    profile.delete(ids[:40] + ["not-there"])
+    profile.upsert(ids[500:], vectors[500:], metadatas[500:])
+    moved = [{"rating": 5, "shelf": "dnf"} for _ in range(20)]
+    profile.update_metadata(ids[100:120], moved)
+    # Re-embedding a known book replaces its vector.
+    new_vector = normalize_rows(np.ones((1, vectors.shape[1]), dtype=np.float32))
+    profile.upsert([ids[200]], new_vector, [metadatas[200]])
+
+    final_vectors = vectors.copy()
+    final_vectors[200] = new_vector[0]
+    final_metadatas = list(metadatas)
+    final_metadatas[100:120] = moved
+    rebuilt = TasteProfile.from_rows(ids[40:], final_vectors[40:], final_metadatas[40:])
+
+    assert_same_state(profile, rebuilt)
+    for query in vectors[::50]:
+        assert set(profile.search(query, 20, n_probe=1000)[0]) == set(rebuilt.search(query, 20, n_probe=1000)[0])
+    assert profile.search(new_vector[0], 1, n_probe=1000)[0] == [ids[200]]
+
+
+def test_upsert_joins_nearest_prototype_until_the_library_drifts():
+    ids, vectors, metadatas = library(n=1200)
+    profile = TasteProfile.from_rows(ids[:300], vectors[:300], metadatas[:300])
+    prototypes = profile.prototypes.copy()
+    profile.upsert(ids[300:500], vectors[300:500], metadatas[300:500])
+    assert not profile.retrain_if_drifted()
+    assert np.array_equal(profile.prototypes, prototypes)
+    row = profile.row_of[ids[400]]
+    assert profile.labels[row] == np.argmax(profile.prototypes @ profile.vectors[row])
+
+    profile.upsert(ids[500:], vectors[500:], metadatas[500:])
+    assert profile.retrain_if_drifted()
+    assert profile.n_trained == 1200
+
+    profile.delete(ids[:1000])
+    assert profile.retrain_if_drifted()
+    assert profile.n_trained == 200
+
+
+def test_empty_profile_trains_on_first_upsert():
+    ids, vectors, metadatas = library(n=50)
+    profile = TasteProfile.from_rows([], np.zeros((0, vectors.shape[1])), [])
+    assert len(profile) == 0 and profile.search(vectors[0], 5)[0] == []
+    profile.upsert(ids, vectors, metadatas)
+    assert len(profile.prototypes) > 0
+    assert profile.search(vectors[7], 1)[0] == [ids[7]]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    ids, vectors, metadatas = library()
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    assert TasteProfile.load(str(tmp_path)) is None
+    profile.save(str(tmp_path), "v7")
+    loaded = TasteProfile.load(str(tmp_path))
+    assert loaded.store_version == "v7" and loaded.n_trained == profile.n_trained
+    assert loaded.ids == profile.ids
+    assert np.array_equal(loaded.prototypes, profile.prototypes)
+    assert np.array_equal(loaded.radii, profile.radii)
+    assert_same_state(loaded, profile)
+    # The vectors are mapped from their own file rather than read into memory.
+    assert isinstance(loaded.vectors, np.memmap)
+    assert np.array_equal(loaded.vectors, profile.vectors)
+    (found, distances, _), (expected, expected_distances, _) = (p.search(vectors[5], 10, n_probe=3)
+                                                                for p in (loaded, profile))
+    assert found == expected and np.array_equal(distances, expected_distances)
+    loaded.upsert(["extra"], vectors[:1], [{"rating": 5, "shelf": "read"}])
+    assert loaded.counts["liked"] == profile.counts["liked"] + 1
+
+
+def test_saving_a_new_version_drops_the_old_vectors(tmp_path):
+    ids, vectors, metadatas = library(n=100)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    profile.save(str(tmp_path), "v1")
+    reader = TasteProfile.load(str(tmp_path))
+    profile.upsert(["extra"], vectors[:1], [{"rating": 5, "shelf": "read"}])
+    profile.save(str(tmp_path), "v2")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["taste_profile.npz", "taste_profile.v2.f32"]
+    # A reader that loaded the old profile keeps working on its mapping.
+    assert reader.search(vectors[3], 1, n_probe=100)[0] == [ids[3]]
+    assert len(TasteProfile.load(str(tmp_path))) == 101
+
+
+def test_load_without_the_vectors_file(tmp_path):
+    ids, vectors, metadatas = library(n=20)
+    TasteProfile.from_rows(ids, vectors, metadatas).save(str(tmp_path), "v1")
+    (tmp_path / "taste_profile.v1.f32").unlink()
+    assert TasteProfile.load(str(tmp_path)) is None
+    TasteProfile.from_rows([], np.zeros((0, 24)), []).save(str(tmp_path), "v2")
+    assert len(TasteProfile.load(str(tmp_path))) == 0
+
+
+def one_dnf_genre():
+    """A clustered library whose DNF books all sit in the cluster of its first book."""
+    ids, vectors, metadatas = library(spread=0.1)
+    dnf = vectors @ vectors[0] > 0.8
+    metadatas = [{"rating": m["rating"], "shelf": "dnf" if d else "read"} for m, d in zip(metadatas, dnf)]
+    return ids, vectors, metadatas
+
+
+def test_dnf_pin_check_never_misses_a_close_dnf_book():
+    ids, vectors, metadatas = one_dnf_genre()
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    rng = np.random.default_rng(3)
+    ruled_out = 0
+    for query in list(vectors[::10]) + list(rng.standard_normal((40, vectors.shape[1]))):
+        distances = 2.0 - 2.0 * (profile.vectors @ normalize_rows(query))
+        window_distance = np.sort(distances)[4]
+        dnf_in_window = np.any(distances[profile.dnf] <= window_distance)
+        possible = profile.dnf_pin_possible(query, window_distance)
+        assert possible or not dnf_in_window
+        ruled_out += not possible
+    assert ruled_out > 30  # most queries are nowhere near the DNF genre
+    assert profile.dnf_pin_possible(vectors[0], 0.0)
+    without_dnf = TasteProfile.from_rows(ids, vectors, [{"shelf": "read"}] * len(ids))
+    assert not without_dnf.dnf_pin_possible(vectors[0], 4.0)
+
+
+def test_dnf_radius_follows_updates():
+    ids, vectors, metadatas = one_dnf_genre()
+    profile = TasteProfile.from_rows(ids[:500], vectors[:500], metadatas[:500])
+    far = int(np.argmin(vectors @ vectors[0]))
+    profile.update_metadata([ids[far]], [{"rating": 0, "shelf": "dnf"}])
+    # A DNF book far from the others widens the radius, so queries near it can still pin.
+    assert profile.dnf_pin_possible(vectors[far], 1e-6)
+    profile.upsert(ids[500:], vectors[500:], metadatas[500:])
+    metadatas[far] = {"rating": 0, "shelf": "dnf"}
+    rebuilt = TasteProfile.from_rows(ids, vectors, metadatas)
+    assert profile.dnf_radius == pytest.approx(rebuilt.dnf_radius, abs=1e-5)
+
+
+def test_skipping_the_pin_check_keeps_the_recommendations(tmp_path):
+    ids, vectors, metadatas = one_dnf_genre()
+    store = NumpyVectorStore.empty(str(tmp_path))
+    store.upsert(ids, vectors, metadatas, [""] * len(ids))
+    table = LibraryTable(store.ids, store.metadatas)
+    profile = TasteProfile.from_rows(ids, vectors, metadatas)
+    pinned = 0
+    for query in vectors[::15]:
+        books = select_contexts_for_vector(store, table, query, 5, 0.3, 0.4, 20, profile)
+        expected = select_contexts_for_vector(store, table, query, 5, 0.3, 0.4, 20)
+        assert [(b.book_id, b.is_pinned_match) for b in books] == [(b.book_id, b.is_pinned_match) for b in expected]
+        pinned += books[0].is_pinned_match
+    assert pinned > 0
@@ -0,0 +1,160 @@
+import json
+import threading
+
+import pytest
+from langchain_core.outputs import Generation, LLMResult
+
+import utils.tracing as tracing
+from utils.tracing import (JsonlExporter, LogExporter, RingBufferExporter, Trace, activate, add_exporter,
+                           configure_tracing, estimate_tokens, llm_span_callback, remove_exporter, span)
+
+
+@pytest.fixture
+def exporters():
+    """Exporters added through this fixture are removed again after the test."""
+    added = []
+
+    def add(exporter):
+        added.append(add_exporter(exporter))
+        return exporter
+
+    yield add
+    for exporter in added:
+        remove_exporter(exporter)
+
+
+def test_spans_record_into_the_active_trace_only():
+    trace = Trace("recommendation", user="me")
+    with span("outside"):
+        pass
+    with activate(trace):
+        with span("embed_query", cached=False) as attrs:
+            attrs["dim"] = 768
+        with span("vector_search"):
+            pass
+        with span("embed_query"):
+            pass
+    with span("after"):
+        pass
+    assert [s["name"] for s in trace.spans] == ["embed_query", "vector_search", "embed_query"]
+    assert trace.spans[0]["cached"] is False and trace.spans[0]["dim"] == 768
+    assert all(s["duration_ms"] >= 0 and s["start_ms"] >= 0 for s in trace.spans)
+    stages = trace.stage_ms()
+    assert list(stages) == ["embed_query", "vector_search"]
+    assert stages["embed_query"] == pytest.approx(trace.spans[0]["duration_ms"] + trace.spans[2]["duration_ms"])
+
+
+def test_span_is_recorded_when_the_block_raises():
+    trace = Trace("recommendation")
+    with activate(trace), pytest.raises(ValueError):
+        with span("llm_generate"):
+            raise ValueError("model gone")
+    assert [s["name"] for s in trace.spans] == ["llm_generate"]
+
+
+def test_each_thread_keeps_its_own_trace():
+    traces = [Trace(f"t{i}") for i in range(4)]
+    barrier = threading.Barrier(4)
+
+    def work(trace):
+        with activate(trace):
+            barrier.wait()
+            with span(trace.name):
+                pass
+
+    threads = [threading.Thread(target=work, args=(trace,)) for trace in traces]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [[s["name"] for s in trace.spans] for trace in traces] == [["t0"], ["t1"], ["t2"], ["t3"]]
+
+
+def test_finish_exports_once_and_survives_a_broken_exporter(exporters, capsys):
+    class Broken:
+        def export(self, trace):
+            raise OSError("disk full")
+
+    ring = exporters(RingBufferExporter(size=2))
+    exporters(Broken())
+    trace = Trace("recommendation")
+    trace.finish(status="ok")
+    trace.finish(status="again")
+    assert ring.recent() == [trace]
+    assert trace.attributes == {"status": "ok"} and trace.duration_ms >= 0
+    assert "trace exporter Broken failed: disk full" in capsys.readouterr().out
+
+
+def test_ring_buffer_keeps_the_last_traces():
+    ring = RingBufferExporter(size=3)
+    traces = [Trace(str(i)) for i in range(5)]
+    for trace in traces:
+        ring.export(trace)
+    assert ring.recent() == traces[2:]
+    assert ring.recent(2) == traces[3:]
+
+
+def test_log_exporter_prints_one_line(capsys):
+    trace = Trace("recommendation")
+    trace.add_span("embed_query", trace.start, trace.start + 0.0091)
+    trace.add_span("llm_generate", trace.start, trace.start + 0.5)
+    trace.duration_ms = 812.4
+    LogExporter().export(trace)
+    assert capsys.readouterr().out == "[trace] recommendation 812 ms | embed_query 9.1 | llm_generate 500.0\n"
+
+
+def test_jsonl_exporter_appends_one_trace_per_line(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = JsonlExporter(str(path))
+    for name in ("first", "second"):
+        trace = Trace(name, query="dragons")
+        with trace.span("vector_search", scanned=120):
+            pass
+        trace.finish()
+        exporter.export(trace)
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [line["name"] for line in lines] == ["first", "second"]
+    assert lines[0]["attributes"] == {"query": "dragons"}
+    assert lines[0]["spans"][0]["name"] == "vector_search" and lines[0]["spans"][0]["scanned"] == 120
+    assert lines[0]["trace_id"] != lines[1]["trace_id"]
+
+
+def test_configure_tracing_adds_each_exporter_once(tmp_path):
+    before = list(tracing._exporters)
+    cfg = {"trace_exporters": ["log", "jsonl"], "trace_jsonl_path": str(tmp_path / "t.jsonl")}
+    try:
+        configure_tracing(cfg)
+        configure_tracing(cfg)
+        added = [e for e in tracing._exporters if e not in before]
+        assert sorted(type(e).__name__ for e in added) == ["JsonlExporter", "LogExporter"]
+    finally:
+        for exporter in list(tracing._exporters):
+            if exporter not in before:
+                remove_exporter(exporter)
+
+
+def test_llm_span_uses_reported_counts_or_estimates():
+    trace = Trace("recommendation")
+    callback = llm_span_callback(trace)
+    callback.on_llm_start({}, ["x" * 400])
+    callback.on_llm_new_token("Hi")
+    callback.on_llm_new_token(" there")
+    info = {"prompt_eval_count": 97, "eval_count": 3}
+    callback.on_llm_end(LLMResult(generations=[[Generation(text="Hi there", generation_info=info)]]))
+    llm = trace.spans[0]
+    assert llm["name"] == "llm_generate"
+    assert (llm["prompt_tokens"], llm["output_tokens"], llm["tokens_estimated"]) == (97, 3, False)
+    assert 0 <= llm["first_token_ms"] <= llm["duration_ms"]
+
+    callback = llm_span_callback(trace, name="summarize")
+    callback.on_llm_start({}, ["x" * 400])
+    callback.on_llm_end(LLMResult(generations=[[Generation(text="y" * 40)]]))
+    summary = trace.spans[1]
+    assert (summary["prompt_tokens"], summary["output_tokens"], summary["tokens_estimated"]) == (100, 10, True)
+    assert summary["first_token_ms"] is None
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hi") == 1
+    assert estimate_tokens("x" * 4000) == 1000
@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.vector_index import NumpyVectorStore, normalize_rows, search_by_vectors
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _store(tmp_path, n=50):
+    store = NumpyVectorStore.empty(str(tmp_path))
+    vectors = _vectors(n)
+    store.upsert([f"b{i}" for i in range(n)], vectors, [{"i": i} for i in range(n)], [f"doc {i}" for i in range(n)])
+    return store, vectors
+
+
+def _exact(vectors, ids, query, k):
+    sims = normalize_rows(vectors) @ normalize_rows(query)
+    top = np.argsort(-sims, kind="stable")[:k]
+    return [ids[i] for i in top], 2.0 - 2.0 * sims[top]
+
+
+def test_search_is_exact_and_nearest_first(tmp_path):
+    store, vectors = _store(tmp_path)
+    queries = _vectors(5, seed=1)
+    ids, distances = store.search(queries, 7)
+    for query, got_ids, got_distances in zip(queries, ids, distances):
+        want_ids, want_distances = _exact(vectors, store.ids, query, 7)
+        assert got_ids == want_ids
+        np.testing.assert_allclose(got_distances, want_distances, atol=1e-5)
+    assert search_by_vectors(store, queries, 7)[0] == ids
+    # Asking for more than there is returns everything.
+    assert len(store.search(queries[0], 500)[0][0]) == 50
+
+
+def test_upsert_replaces_known_ids_and_delete_drops_them(tmp_path):
+    store, vectors = _store(tmp_path, n=10)
+    store.upsert(["b3", "new", "new"], [vectors[0], vectors[1], vectors[2]], [{"v": 1}, {"v": 2}, {"v": 3}],
+                 ["three", "first", "second"])
+    assert len(store) == 11
+    assert store.get(["b3", "new"]) == {"ids": ["b3", "new"], "metadatas": [{"v": 1}, {"v": 3}],
+                                        "documents": ["three", "second"]}
+    # b3 now has b0's vector, and the last write of "new" (b2's vector) won.
+    assert sorted(store.search(vectors[0], 2)[0][0]) == ["b0", "b3"]
+    assert sorted(store.search(vectors[2], 2)[0][0]) == ["b2", "new"]
+    store.update_metadata(["b4"], [{"rating": 5}])
+    assert store.get(["b4"], include=["metadatas"])["metadatas"] == [{"rating": 5}]
+
+    store.delete(["b3", "b5", "unknown"])
+    assert len(store) == 9 and "b3" not in store.ids and "b5" not in store.ids
+    np.testing.assert_allclose(store.get(["b6"], include=["embeddings"])["embeddings"],
+                               normalize_rows(vectors[6:7]), atol=1e-6)
+    assert all(store.ids[store.row_of[book_id]] == book_id for book_id in store.ids)
+
+
+def test_saved_store_reopens_memory_mapped(tmp_path):
+    store, vectors = _store(tmp_path)
+    store.save()
+    assert NumpyVectorStore.exists(str(tmp_path))
+    reopened = NumpyVectorStore.load(str(tmp_path))
+    assert isinstance(reopened.matrix, np.memmap)
+    assert reopened.ids == store.ids and reopened.metadatas == store.metadatas
+    assert reopened.documents == store.documents
+    query = _vectors(1, seed=2)
+    assert reopened.search(query, 5)[0] == store.search(query, 5)[0]
+    assert not os.path.exists(os.path.join(store.path, "table.json.tmp"))
+
+
+def test_empty_store_round_trip(tmp_path):
+    store = NumpyVectorStore.empty(str(tmp_path))
+    assert store.search(_vectors(1), 3)[0] == [[]]
+    store.save()
+    assert len(NumpyVectorStore.load(str(tmp_path))) == 0
+
+
+def test_reload_picks_up_a_new_ingest(tmp_path):
+    store, _ = _store(tmp_path, n=5)
+    store.save()
+    reader = NumpyVectorStore.load(str(tmp_path))
+    assert not reader.reload_if_changed()
+    store.delete(["b0"])
+    store.upsert(["b9"], _vectors(1, seed=3), [{}], [""])
+    # Make sure the new table.json gets a different mtime even on coarse clocks.
+    store.save()
+    os.utime(os.path.join(store.path, "table.json"), ns=(1, 1))
+    assert reader.reload_if_changed()
+    assert reader.ids == ["b1", "b2", "b3", "b4", "b9"]
+
+
+def test_close_lets_go_of_the_matrix(tmp_path):
+    store, _ = _store(tmp_path)
+    store.save()
+    reopened = NumpyVectorStore.load(str(tmp_path))
+    reopened.close()
+    # A closed store is empty: callers must hold a registry lease while they use one.
+    assert len(reopened) == 0 and reopened.search(_vectors(1), 3)[0] == [[]]
+
+
+def test_missing_index_raises(tmp_path):
+    assert not NumpyVectorStore.exists(str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        NumpyVectorStore.load(str(tmp_path))
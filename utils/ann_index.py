@@ -0,0 +1,178 @@
+import json
+import os
+
+import numpy as np
+
+from utils.vector_index import normalize_rows
+
+META_FILE = "catalog.json"
+CHUNK = 16384
+
+
+def _top_k(scores, k):
+    """Column indices of the k highest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((len(scores), 0), dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else \
+        np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def assign(vectors, centroids):
+    """Nearest centroid (by cosine) of every unit-length row, computed in chunks."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), CHUNK):
+        block = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Spherical k-means: unit-length centroids that maximize cosine similarity to their members."""
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(vectors)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], starts, axis=0)
+        empty = ~sums.any(axis=1)
+        # A cluster that lost all its members restarts at a random point.
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index for approximate cosine search over a large catalog.
+
+    The vectors are clustered with k-means and stored grouped by cluster; a query
+    only scans the `n_probe` clusters whose centroids are closest to it. On disk
+    it is `centroids.npy`, `offsets.npy` (where each cluster starts), a
+    memory-mapped float32 `vectors.f32` and `catalog.json` with the ids and
+    metadatas, all in the order of the clusters.
+    """
+
+    def __init__(self, centroids, offsets, vectors, ids, metadatas=None, path=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = list(ids)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.ids]
+        self.path = path
+
+    @classmethod
+    def build(cls, path, vectors, ids, metadatas=None, n_lists=None, train_size=None, iterations=10, seed=0):
+        """Cluster `vectors` (any array-like, e.g. a memmap) and write the index to `path`.
+
+        Defaults: about sqrt(n) clusters, trained on a sample of 40 points per cluster.
+        """
+        n = len(ids)
+        n_lists = n_lists or max(1, int(round(np.sqrt(n))))
+        train_size = min(n, train_size or 40 * n_lists)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, train_size, replace=False))
+        centroids = kmeans(np.asarray(vectors[sample], dtype=np.float32), n_lists, iterations, seed)
+
+        # Normalize once while assigning, then write the rows out grouped by cluster.
+        labels = np.empty(n, dtype=np.int32)
+        for start in range(0, n, CHUNK):
+            block = normalize_rows(vectors[start:start + CHUNK])
+            labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+
+        os.makedirs(path, exist_ok=True)
+        dim = centroids.shape[1]
+        out = np.memmap(os.path.join(path, "vectors.f32.tmp"), dtype=np.float32, mode="w+", shape=(max(n, 1), dim))
+        for start in range(0, n, CHUNK):
+            rows = order[start:start + CHUNK]
+            out[start:start + len(rows)] = normalize_rows(vectors[np.sort(rows)])[np.argsort(np.argsort(rows))]
+        out.flush()
+        del out
+        os.replace(os.path.join(path, "vectors.f32.tmp"), os.path.join(path, "vectors.f32"))
+        np.save(os.path.join(path, "centroids.npy"), centroids)
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+        ids = [ids[i] for i in order]
+        metadatas = [metadatas[i] for i in order] if metadatas is not None else None
+        tmp_path = os.path.join(path, META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "ids": ids, "metadatas": metadatas}, f)
+        os.replace(tmp_path, os.path.join(path, META_FILE))
+        return cls.load(path)
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        centroids = np.load(os.path.join(path, "centroids.npy"))
+        offsets = np.load(os.path.join(path, "offsets.npy"))
+        vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r",
+                            shape=(max(len(meta["ids"]), 1), meta["dim"]))
+        return cls(centroids, offsets, vectors, meta["ids"], meta["metadatas"], path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- Query side -------------------------------------------------------
+
+    def search(self, query_vectors, k=10, n_probe=16):
+        """Approximate (rows, similarities) per query, best first; rows index self.ids."""
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        probes = _top_k(queries @ self.centroids.T, n_probe)
+        # Each probed cluster is one contiguous slice of the memmap, read and scored
+        # once for all the queries that probe it.
+        pair_lists = probes.ravel()
+        pair_queries = np.repeat(np.arange(len(queries)), probes.shape[1])
+        order = np.argsort(pair_lists, kind="stable")
+        lists, starts = np.unique(pair_lists[order], return_index=True)
+        row_pieces = [[] for _ in queries]
+        sim_pieces = [[] for _ in queries]
+        for c, group in zip(lists.tolist(), np.split(pair_queries[order], starts[1:])):
+            lo, hi = int(self.offsets[c]), int(self.offsets[c + 1])
+            if lo == hi:
+                continue
+            sims = queries[group] @ np.asarray(self.vectors[lo:hi], dtype=np.float32).T
+            for q, q_sims in zip(group.tolist(), sims):
+                row_pieces[q].append(np.arange(lo, hi))
+                sim_pieces[q].append(q_sims)
+
+        all_rows, all_sims = [], []
+        for rows, sims in zip(row_pieces, sim_pieces):
+            rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+            sims = np.concatenate(sims) if sims else np.zeros(0, dtype=np.float32)
+            top = _top_k(sims[None, :], k)[0] if len(sims) else rows
+            all_rows.append(rows[top])
+            all_sims.append(sims[top])
+        return all_rows, all_sims
+
+    def exact_search(self, query_vectors, k=10):
+        """The same result by scanning every vector; the reference recall is measured against."""
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_sims = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), CHUNK):
+            sims = queries @ np.asarray(self.vectors[start:start + CHUNK], dtype=np.float32).T
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + sims.shape[1]), sims.shape)],
+                                  axis=1)
+            sims = np.concatenate([best_sims, sims], axis=1)
+            top = _top_k(sims, k)
+            best_rows, best_sims = np.take_along_axis(rows, top, axis=1), np.take_along_axis(sims, top, axis=1)
+        return list(best_rows), list(best_sims)
+
+
+def recall_at_k(index, query_vectors, k=10, n_probe=16):
+    """Share of the exact top-k that the IVF search also returns, averaged over the queries."""
+    approx, _ = index.search(query_vectors, k, n_probe)
+    exact, _ = index.exact_search(query_vectors, k)
+    hits = [len(np.intersect1d(a, e)) / max(1, len(e)) for a, e in zip(approx, exact)]
+    return float(np.mean(hits)) if hits else 0.0
@@ -0,0 +1,115 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = os.getenv("BLURB_CACHE_FILE", "blurb_cache.sqlite")
+TTL_DAYS = float(os.getenv("BLURB_CACHE_TTL_DAYS", 180))
+NEGATIVE_TTL_DAYS = float(os.getenv("BLURB_CACHE_NEGATIVE_TTL_DAYS", 30))
+
+# Answers that mean "the API has nothing for this book"; cached with the shorter TTL.
+NEGATIVE_RESULTS = {"Book not found via API.", "No blurb found."}
+
+
+def _norm(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+def cache_keys(isbn13, isbn, title, author):
+    """Lookup keys for a book, most specific first (the same order get_book_blurb queries in)."""
+    keys = []
+    if isbn13:
+        keys.append(f"isbn13:{isbn13}")
+    if isbn:
+        keys.append(f"isbn:{isbn}")
+    if title is not None and author is not None and title == title and author == author:
+        keys.append(f"title:{_norm(title)}|{_norm(author)}")
+    return keys
+
+
+class BlurbCache:
+    def __init__(self, path=CACHE_FILE, ttl_days=TTL_DAYS, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blurbs ("
+            " key TEXT PRIMARY KEY, blurb TEXT NOT NULL,"
+            " negative INTEGER NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, keys, allow_stale=False):
+        """Return the cached blurb for the first fresh key, or None.
+
+        Negative entries only count for the primary key: a miss by ISBN says
+        nothing about a title/author lookup of the same book.
+        """
+        now = time.time()
+        with self.lock:
+            for i, key in enumerate(keys):
+                row = self.conn.execute(
+                    "SELECT blurb, negative, fetched_at FROM blurbs WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                blurb, negative, fetched_at = row
+                if negative and i > 0:
+                    continue
+                ttl = self.negative_ttl if negative else self.ttl
+                if allow_stale or now - fetched_at < ttl:
+                    self.hits += 1
+                    return blurb
+            self.misses += 1
+            return None
+
+    def put(self, keys, blurb):
+        if not keys:
+            return
+        negative = blurb in NEGATIVE_RESULTS
+        # A found blurb is valid under every identifier; a negative only under the one queried.
+        targets = keys[:1] if negative else keys
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO blurbs (key, blurb, negative, fetched_at) VALUES (?, ?, ?, ?)",
+                [(key, blurb, int(negative), now) for key in targets],
+            )
+            self.conn.commit()
+
+    def iter_found(self, batch_size=10000):
+        """Yield (blurb, keys) for every found blurb, each blurb once with all keys it is stored under.
+
+        Rows are streamed in blurb order, so the whole cache is never held in memory.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT blurb, key FROM blurbs WHERE negative = 0 ORDER BY blurb, key")
+            rows = cursor.fetchmany(batch_size)
+        blurb, keys = None, []
+        while rows:
+            for text, key in rows:
+                if text != blurb and keys:
+                    yield blurb, keys
+                    keys = []
+                blurb = text
+                keys.append(key)
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+        if keys:
+            yield blurb, keys
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits / {self.misses} misses ({rate:.0%} hit rate)"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
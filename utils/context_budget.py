@@ -0,0 +1,135 @@
+"""Keeps the LLM context inside a token budget.
+
+Every context book is rendered with its blurb and review cut down to a per-field
+budget, and books are added in priority order (the pinned DNF match first, then
+the best reranked ones) until the whole context would exceed its budget. Reviews
+are compacted at ingest time into `review_summary`, so a query only has to trim.
+"""
+import re
+from typing import NamedTuple
+
+from utils.tracing import estimate_tokens
+
+DEFAULT_CONTEXT_TOKENS = 1200
+DEFAULT_BLURB_TOKENS = 120
+DEFAULT_REVIEW_TOKENS = 80
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+# Sentences that say how the book felt are the ones worth keeping from a review.
+_OPINION_WORDS = re.compile(
+    r"\b(lov\w*|hat\w*|like[ds]?|dislike\w*|enjoy\w*|bor\w*|favou?rite|best|worst|great|awful|"
+    r"beautiful|annoy\w*|disappoint\w*|recommend\w*|couldn'?t|could not|didn'?t|did not|dnf|"
+    r"stars?|but|however|too|never|always|characters?|writing|plot|ending|pacing)\b",
+    re.IGNORECASE,
+)
+
+
+class ContextBudget(NamedTuple):
+    total_tokens: int = DEFAULT_CONTEXT_TOKENS
+    blurb_tokens: int = DEFAULT_BLURB_TOKENS
+    review_tokens: int = DEFAULT_REVIEW_TOKENS
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(
+            int(cfg.get("context_token_budget", DEFAULT_CONTEXT_TOKENS)),
+            int(cfg.get("context_blurb_tokens", DEFAULT_BLURB_TOKENS)),
+            int(cfg.get("context_review_tokens", DEFAULT_REVIEW_TOKENS)),
+        )
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` to about `max_tokens`, preferably after a full sentence."""
+    max_chars = max_tokens * 4  # the same 4 characters per token as estimate_tokens
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence_end >= max_chars // 2:
+        return cut[:sentence_end + 1].rstrip()
+    word_end = cut.rfind(" ")
+    return (cut[:word_end] if word_end > 0 else cut).rstrip(" ,;:") + " …"
+
+
+def summarize_review(review, max_tokens=DEFAULT_REVIEW_TOKENS):
+    """Extractive summary: the first and last sentence plus the most opinionated ones, in their order."""
+    review = review.strip()
+    if estimate_tokens(review) <= max_tokens:
+        return review
+    sentences = [s.strip() for s in _SENTENCE_END.split(review) if s.strip()]
+    if len(sentences) <= 1:
+        return truncate_to_tokens(review, max_tokens)
+
+    def priority(i):
+        edge = 2 if i in (0, len(sentences) - 1) else 0
+        return -(edge + len(_OPINION_WORDS.findall(sentences[i]))), i
+
+    keep, used = [], 0
+    for i in sorted(range(len(sentences)), key=priority):
+        cost = estimate_tokens(sentences[i])
+        if used + cost > max_tokens:
+            continue
+        keep.append(i)
+        used += cost
+    if not keep:
+        return truncate_to_tokens(sentences[0], max_tokens)
+    return " ".join(sentences[i] for i in sorted(keep))
+
+
+def _render(meta, budget, compact=False):
+    parts = []
+    if meta.get('user_verdict'):
+        parts.append(meta['user_verdict'])
+
+    parts.append(f"Title: {meta.get('title', 'N/A')}")
+    parts.append(f"Author: {meta.get('author', 'N/A')}")
+
+    if meta.get('clean_blurb') and not compact:
+        parts.append(f"Official Blurb: {truncate_to_tokens(meta['clean_blurb'], budget.blurb_tokens)}")
+
+    if meta.get('rating', 0) > 0:
+        parts.append(f"My Rating: I rated this book {meta.get('rating')} out of 5 stars.")
+    else:
+        parts.append("My Rating: I have not rated this book.")
+
+    shelf = meta.get('shelf', 'unknown')
+    if shelf in ['dnf', 'did-not-finish']:
+        parts.append(f"Shelf Status: I did not finish this book (DNF).")
+    elif shelf == 'to-read':
+        parts.append(f"Shelf Status: This book is on my 'to-read' list.")
+    else:
+        parts.append(f"Shelf Status: I have read this book.")
+
+    review = meta.get('review_summary') or meta.get('my_review')
+    if review:
+        if not compact:
+            # Stores ingested before summaries existed only have the full review.
+            parts.append(f"My Personal Review: {summarize_review(review, budget.review_tokens)}")
+    elif shelf != 'to-read':
+        parts.append("My Personal Review: I did not write a review.")
+
+    return "\n".join(parts)
+
+
+def build_budgeted_context(docs, budget=ContextBudget()):
+    """Render the context books until `budget.total_tokens` is used up.
+
+    Books are taken pinned match first, then by rerank score. One that no longer
+    fits in full is added without blurb and review if that still fits; after the
+    first book that does not fit at all the rest are left out. Returns
+    (context_string, number_of_books_used).
+    """
+    ordered = sorted(docs, key=lambda d: (not d.is_pinned_match, d.rerank_score))
+    separator = "\n---\n"
+    max_chars = budget.total_tokens * 4  # counted in characters so the pieces add up exactly
+    blocks, used = [], 0
+    for doc in ordered:
+        extra = len(separator) if blocks else 0
+        block = _render(doc.metadata, budget)
+        if used + extra + len(block) > max_chars:
+            block = _render(doc.metadata, budget, compact=True)
+            if used + extra + len(block) > max_chars and blocks:
+                break
+        blocks.append(block)
+        used += extra + len(block)
+    return separator.join(blocks), len(blocks)
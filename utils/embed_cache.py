@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run one writer at a time.
+    fcntl = None
+
+DEFAULT_CACHE_DIR = "embedding_cache"
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MEMORY_ENTRIES = 2048
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DiskVectorCache:
+    """Fixed-size on-disk vector store: an mmap'd float32 matrix plus an append-only index.
+
+    Slots are reused round-robin once `max_entries` is reached, so the oldest
+    entries are evicted first. `index.log` holds one "<slot> <key>" line per write;
+    replaying it on open rebuilds the key -> slot map, and it is compacted when it
+    grows past twice the capacity.
+
+    The app, the server and ingest.py share one cache directory. Writers hold an
+    exclusive lock on `index.lock` and readers a shared one, and both first replay
+    whatever other processes appended to the log, so a slot is never handed out
+    twice and a key never points at a slot that was overwritten since.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.matrix = None
+        self.slots = {}
+        self.slot_keys = {}
+        self.next_slot = 0
+        self.log_lines = 0
+        self.log_inode = None
+        self.log_offset = 0
+        self.log_path = os.path.join(path, "index.log")
+        os.makedirs(path, exist_ok=True)
+        with self._locked(exclusive=True):
+            self._open()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        # A fresh descriptor per call, so threads of one process exclude each other too.
+        with open(os.path.join(self.path, "index.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["max_entries"] != self.max_entries:
+            # Capacity changed: the old layout can't be reused.
+            self._reset()
+            return
+        self.matrix = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32,
+                                mode="r+", shape=(self.max_entries, meta["dim"]))
+        self._sync()
+
+    def _sync(self):
+        """Replay the index.log lines written (by any process) since this one last read it."""
+        if self.matrix is None:
+            if not os.path.exists(os.path.join(self.path, "meta.json")):
+                return
+            self._open()
+            return
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self.log_inode or stat.st_size < self.log_offset:
+            # Compacted (or recreated) by someone else: start over from the new file.
+            self.slots, self.slot_keys = {}, {}
+            self.next_slot = self.log_lines = self.log_offset = 0
+            self.log_inode = stat.st_ino
+        if stat.st_size == self.log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self.log_offset)
+            data = f.read(stat.st_size - self.log_offset)
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue  # torn write
+            self._assign(int(parts[0]), parts[1])
+            self.log_lines += 1
+        self.log_offset += complete
+
+    def _reset(self):
+        for name in ("meta.json", "vectors.f32", "index.log"):
+            target = os.path.join(self.path, name)
+            if os.path.exists(target):
+                os.remove(target)
+
+    def _create(self, dim):
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "max_entries": self.max_entries}, f)
+        self.matrix = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32,
+                                mode="w+", shape=(self.max_entries, dim))
+
+    def _assign(self, slot, key):
+        old = self.slot_keys.get(slot)
+        if old is not None and self.slots.get(old) == slot:
+            del self.slots[old]
+        self.slots[key] = slot
+        self.slot_keys[slot] = key
+        self.next_slot = (slot + 1) % self.max_entries
+
+    def get(self, key):
+        with self._locked(exclusive=False):
+            self._sync()
+            slot = self.slots.get(key)
+            if slot is None:
+                return None
+            return np.array(self.matrix[slot])
+
+    def put_many(self, keys, vectors):
+        with self._locked(exclusive=True):
+            self._sync()
+            if self.matrix is None:
+                self._create(len(vectors[0]))
+            lines = []
+            for key, vector in zip(keys, vectors):
+                slot = self.next_slot
+                self.matrix[slot] = vector
+                self._assign(slot, key)
+                lines.append(f"{slot} {key}\n")
+            # Vectors hit the disk before the index entries that point at them.
+            self.matrix.flush()
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+            self.log_lines += len(lines)
+            if self.log_lines > 2 * self.max_entries:
+                self._compact()
+            # Nobody else wrote while the lock was held, so the whole log is accounted for.
+            stat = os.stat(self.log_path)
+            self.log_inode, self.log_offset = stat.st_ino, stat.st_size
+
+    def _compact(self):
+        tmp_path = os.path.join(self.path, "index.log.tmp")
+        # Write in slot order starting after the newest entry so replay keeps the eviction order.
+        order = sorted(self.slot_keys, key=lambda s: (s - self.next_slot) % self.max_entries)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{slot} {self.slot_keys[slot]}\n" for slot in order)
+        os.replace(tmp_path, self.log_path)
+        self.log_lines = len(order)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class CachedEmbeddings:
+    """Embeddings wrapper with an in-memory LRU over a persistent DiskVectorCache.
+
+    Entries are keyed by sha256(text) inside a per-model directory, i.e. by
+    (embed_model, sha256(text)). It has LangChain's Embeddings interface
+    (embed_documents/embed_query) without subclassing it, so importing this
+    module does not import LangChain.
+    """
+
+    def __init__(self, base, model, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES,
+                 memory_entries=DEFAULT_MEMORY_ENTRIES):
+        self.base = base
+        self.model = model
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.disk = DiskVectorCache(os.path.join(cache_dir, safe_model), max_entries)
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def embed_documents(self, texts):
+        keys = [text_key(text) for text in texts]
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in found:
+                    continue
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                else:
+                    vector = self.disk.get(key)
+                    if vector is None:
+                        continue
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                found[key] = vector
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            # The network call happens outside the lock so concurrent batches overlap.
+            vectors = np.asarray(self.base.embed_documents(list(missing.values())), dtype=np.float32)
+            with self.lock:
+                self.misses += len(missing)
+                self.disk.put_many(list(missing), vectors)
+                for key, vector in zip(missing, vectors):
+                    self._remember(key, vector)
+                    found[key] = vector
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_entries": len(self.disk),
+        }
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class AdaptiveEmbedder:
+    """Embed many texts through an Embeddings object with an adaptive batch size.
+
+    Every successful batch doubles the batch size (up to `max_batch_size`); a failed
+    batch halves it and its texts are retried one by one. The smallest failing size
+    is remembered and later growth only probes halfway towards it, so a local Ollama
+    that falls over on large requests settles on the largest size it can handle.
+    At most `max_concurrency` requests are in flight at once.
+    """
+
+    def __init__(self, embeddings, initial_batch_size=8, min_batch_size=1, max_batch_size=256,
+                 max_concurrency=4, max_retries=3, backoff=0.5):
+        self.embeddings = embeddings
+        self.batch_size = initial_batch_size
+        self.ceiling = max_batch_size + 1
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.docs = 0
+        self.requests = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    def _grow(self, size):
+        with self.lock:
+            if size >= self.batch_size:
+                probe = (self.batch_size + self.ceiling) // 2
+                self.batch_size = max(self.batch_size, min(self.max_batch_size, self.batch_size * 2, probe))
+
+    def _shrink(self, size):
+        with self.lock:
+            self.failures += 1
+            self.ceiling = min(self.ceiling, size)
+            self.batch_size = max(self.min_batch_size, min(self.batch_size, size) // 2)
+
+    def _embed_batch(self, texts):
+        if len(texts) == 1:
+            # Nothing left to split: a lone text gets the retries with backoff instead.
+            vector = self._embed_single(texts[0])
+            self._grow(1)
+            return [vector]
+        with self.lock:
+            self.requests += 1
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception:
+            self._shrink(len(texts))
+            return [self._embed_single(text) for text in texts]
+        self._grow(len(texts))
+        return vectors
+
+    def _embed_single(self, text):
+        for attempt in range(self.max_retries + 1):
+            with self.lock:
+                self.requests += 1
+            try:
+                return self.embeddings.embed_documents([text])[0]
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.failures += 1
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def embed(self, texts):
+        start = time.perf_counter()
+        vectors = [None] * len(texts)
+        pending = {}
+        position = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while position < len(texts) or pending:
+                while position < len(texts) and len(pending) < self.max_concurrency:
+                    size = self.batch_size
+                    batch = texts[position:position + size]
+                    pending[pool.submit(self._embed_batch, batch)] = position
+                    position += len(batch)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset = pending.pop(future)
+                    result = future.result()
+                    vectors[offset:offset + len(result)] = result
+
+        self.docs += len(texts)
+        self.seconds += time.perf_counter() - start
+        return vectors
+
+    def report(self):
+        rate = self.docs / self.seconds if self.seconds else 0.0
+        return (f"Embedded {self.docs} documents in {self.seconds:.1f}s ({rate:.1f} docs/s), "
+                f"{self.requests} requests, {self.failures} failed, final batch size {self.batch_size}")
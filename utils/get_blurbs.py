@@ -1,14 +1,81 @@
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import random
+import json
 import time
 import re
 import os
 from dotenv import load_dotenv
+try:
+    from blurb_cache import BlurbCache, cache_keys
+except ImportError:  # imported as utils.get_blurbs
+    from utils.blurb_cache import BlurbCache, cache_keys
+try:
+    from goodreads_csv import read_export_chunks
+except ImportError:
+    from utils.goodreads_csv import read_export_chunks
 
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_BOOKS_API_KEY")
+# Overridable so the fetcher can be pointed at utils/stub_books_api.py
+BASE_URL = os.getenv("GOOGLE_BOOKS_API_URL", "https://www.googleapis.com/books/v1/volumes")
 INPUT_FILE = 'goodreads_library_export.csv'
 OUTPUT_FILE = 'goodreads_with_blurbs.csv'
+CHECKPOINT_FILE = 'goodreads_with_blurbs.checkpoint.jsonl'
+
+MAX_WORKERS = int(os.getenv("BLURB_WORKERS", 8))
+REQUESTS_PER_SECOND = float(os.getenv("BLURB_REQUESTS_PER_SECOND", 5))
+# Answer from the local blurb cache only (stale entries included) and never hit the network.
+OFFLINE = os.getenv("BLURB_OFFLINE", "").lower() in ("1", "true", "yes")
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 15
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    # One keep-alive pool shared by all worker threads instead of a new connection per book.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _retry_delay(response, attempt, backoff):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * (2 ** attempt) + random.uniform(0, backoff)
+
+
+def is_retryable_blurb(blurb):
+    return not isinstance(blurb, str) or blurb.startswith(("API Request Error", "An error occurred"))
 
 
 def clean_isbn(isbn_str):
@@ -19,8 +86,23 @@ def clean_isbn(isbn_str):
         return match.group(0)
     return None
 
-def get_book_blurb(isbn13, isbn, title, author):
-    base_url = "https://www.googleapis.com/books/v1/volumes"
+def get_book_blurb(isbn13, isbn, title, author, session=None, limiter=None,
+                   max_retries=MAX_RETRIES, backoff=1.0, cache=None, offline=OFFLINE):
+    if cache is not None:
+        keys = cache_keys(isbn13, isbn, title, author)
+        blurb = cache.get(keys, allow_stale=offline)
+        if blurb is not None:
+            return blurb
+        if offline:
+            return "API Request Error: offline mode and not in the blurb cache"
+        blurb = _fetch_book_blurb(isbn13, isbn, title, author, session, limiter, max_retries, backoff)
+        if not is_retryable_blurb(blurb) and not blurb.startswith("No valid search terms"):
+            cache.put(keys, blurb)
+        return blurb
+    return _fetch_book_blurb(isbn13, isbn, title, author, session, limiter, max_retries, backoff)
+
+
+def _fetch_book_blurb(isbn13, isbn, title, author, session, limiter, max_retries, backoff):
     query = ""
     if isbn13:
         query = f"isbn:{isbn13}"
@@ -31,68 +113,156 @@ def get_book_blurb(isbn13, isbn, title, author):
     else:
         return "No valid search terms (ISBN, Title, or Author)"
 
-    url = f"{base_url}?q={query}&key={API_KEY}"
+    url = f"{BASE_URL}?q={query}&key={API_KEY}"
+    http = session or requests
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()  
-        data = response.json()
+        for attempt in range(max_retries + 1):
+            if limiter:
+                limiter.acquire()
+            try:
+                response = http.get(url, timeout=REQUEST_TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == max_retries:
+                    raise
+                time.sleep(_retry_delay(None, attempt, backoff))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < max_retries:
+                time.sleep(_retry_delay(response, attempt, backoff))
+                continue
+
+            response.raise_for_status()
+            data = response.json()
 
-        if data.get('totalItems', 0) > 0:
-            volume_info = data.get('items', [{}])[0].get('volumeInfo', {})
-            description = volume_info.get('description', 'No blurb found.')
-            return description
-        else:
-            return "Book not found via API."
+            if data.get('totalItems', 0) > 0:
+                volume_info = data.get('items', [{}])[0].get('volumeInfo', {})
+                description = volume_info.get('description', 'No blurb found.')
+                return description
+            else:
+                return "Book not found via API."
 
     except requests.exceptions.RequestException as e:
         return f"API Request Error: {e}"
     except Exception as e:
         return f"An error occurred: {e}"
 
-def main():
-    print(f"Loading data from {INPUT_FILE}...")
-    try:
-        df = pd.read_csv(INPUT_FILE)
-    except FileNotFoundError:
-        print(f"ERROR: Input file '{INPUT_FILE}' not found.")
-        print("Please make sure your Goodreads file is in the same directory as this script.")
-        return
 
-    df['Blurb'] = ''
+def row_keys(df):
+    # 'Book Id' survives re-exports and re-sorting; fall back to the row position.
+    if 'Book Id' in df.columns:
+        return df['Book Id'].astype(str)
+    return pd.Series(df.index.astype(str), index=df.index)
+
 
-    print("Cleaning ISBNs...")
-    df['clean_isbn13'] = df['ISBN13'].apply(clean_isbn)
-    df['clean_isbn'] = df['ISBN'].apply(clean_isbn)
+def load_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            if not is_retryable_blurb(entry.get("blurb")):
+                done[entry["key"]] = entry["blurb"]
+    return done
 
+
+def end_torn_line(path):
+    # An interrupted run can leave half a line behind; the next entry must not be glued onto it.
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def fetch_blurbs(df, checkpoint_path=CHECKPOINT_FILE, max_workers=MAX_WORKERS,
+                 requests_per_second=REQUESTS_PER_SECOND, session=None, cache=None):
+    keys = row_keys(df)
+    done = load_checkpoint(checkpoint_path)
+    todo = [idx for idx in df.index if keys[idx] not in done]
     total_books = len(df)
-    print(f"Found {total_books} books. Starting to fetch blurbs...")
+    if len(todo) < total_books:
+        print(f"Resuming from checkpoint: {total_books - len(todo)}/{total_books} books already fetched.")
+
+    session = session or make_session(max_workers)
+    limiter = TokenBucket(requests_per_second)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    end_torn_line(checkpoint_path)
+    try:
+        with open(checkpoint_path, "a", encoding="utf-8") as ckpt:
+            futures = {
+                pool.submit(
+                    get_book_blurb,
+                    isbn13=df.at[idx, 'clean_isbn13'],
+                    isbn=df.at[idx, 'clean_isbn'],
+                    title=df.at[idx, 'Title'],
+                    author=df.at[idx, 'Author'],
+                    session=session,
+                    limiter=limiter,
+                    cache=cache,
+                ): idx
+                for idx in todo
+            }
+            for n, future in enumerate(as_completed(futures), start=total_books - len(todo) + 1):
+                idx = futures[future]
+                blurb = future.result()
+                done[keys[idx]] = blurb
+                ckpt.write(json.dumps({"key": keys[idx], "blurb": blurb}) + "\n")
+                ckpt.flush()
+                print(f"Processed {n}/{total_books}: {df.at[idx, 'Title']}")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print(f"\nInterrupted. Progress is saved in '{checkpoint_path}'; re-run to resume.")
+        raise
+    pool.shutdown()
 
-  
-    for index, row in df.iterrows():
-        title = row['Title']
-        print(f"Processing {index + 1}/{total_books}: {title}...")
+    return keys.map(done)
 
-        blurb = get_book_blurb(
-            isbn13=row['clean_isbn13'],
-            isbn=row['clean_isbn'],
-            title=title,
-            author=row['Author']
-        )
-  
-        df.at[index, 'Blurb'] = blurb  
 
-        time.sleep(1) # 1-second delay between requests
+def main():
+    print(f"Loading data from {INPUT_FILE}...")
+    if not os.path.exists(INPUT_FILE):
+        print(f"ERROR: Input file '{INPUT_FILE}' not found.")
+        print("Please make sure your Goodreads file is in the same directory as this script.")
+        return
+
+    print(f"Fetching blurbs with {MAX_WORKERS} workers at up to {REQUESTS_PER_SECOND:g} requests/s...")
+    cache = BlurbCache()
+    if OFFLINE:
+        print("Offline mode: answering from the blurb cache only.")
+    # The export is handled one chunk at a time and every row and column is written
+    # back out; trimming to what the app uses happens later, in prep.
+    tmp_path = OUTPUT_FILE + ".tmp"
+    total_books = 0
+    try:
+        for n, chunk in enumerate(read_export_chunks(INPUT_FILE)):
+            chunk['clean_isbn13'] = chunk['ISBN13'].apply(clean_isbn)
+            chunk['clean_isbn'] = chunk['ISBN'].apply(clean_isbn)
+            chunk['Blurb'] = fetch_blurbs(chunk, cache=cache)
+            chunk = chunk.drop(columns=['clean_isbn13', 'clean_isbn'])
+            chunk.to_csv(tmp_path, mode="w" if n == 0 else "a", header=n == 0, index=False, encoding='utf-8')
+            total_books += len(chunk)
+    except KeyboardInterrupt:
+        return
+    finally:
+        print(f"Blurb cache: {cache.stats()}")
+        cache.close()
 
-    df = df.drop(columns=['clean_isbn13', 'clean_isbn'])
+    print(f"\nProcessing complete: {total_books} books.")
 
-    print("\nProcessing complete.")
-    
     try:
-        df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8')
+        os.replace(tmp_path, OUTPUT_FILE)
         print(f"Successfully saved updated library to: {OUTPUT_FILE}")
+        if os.path.exists(CHECKPOINT_FILE):
+            os.remove(CHECKPOINT_FILE)
     except Exception as e:
         print(f"Error saving file: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,76 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+RELEVANT_SHELVES = ['read', 'dnf', 'did-not-finish', 'to-read']
+SHELF_DTYPE = pd.CategoricalDtype(RELEVANT_SHELVES)
+DEFAULT_CHUNKSIZE = 20000
+
+# The only export columns anything downstream looks at.
+PREP_COLUMNS = ['Book Id', 'Title', 'Author', 'My Rating', 'Number of Pages', 'Exclusive Shelf', 'My Review', 'Blurb']
+# Identifiers: ISBNs parsed as numbers would lose leading zeros, and a chunk with one
+# blank 'Book Id' would turn every id in it into a float ("101.0").
+TEXT_COLUMNS = {'Book Id': str, 'ISBN': str, 'ISBN13': str}
+
+
+def normalize_column(col):
+    return col.lower().replace(' ', '_').replace('-', '_')
+
+
+def book_key(book_id, title, author):
+    """The id a book is stored under: its Goodreads id, or a hash of title and author without one."""
+    if book_id and book_id != "nan":
+        return book_id
+    # Rows without a Goodreads id still need a stable key across runs.
+    key = f"{title}|{author}"
+    return "ta-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def book_keys(book_ids, titles, authors):
+    """book_key for whole columns; `book_ids` as strings (NaN -> 'nan'). Only rows without an id are hashed."""
+    keys = pd.Series(book_ids, dtype=object).reset_index(drop=True)
+    missing = ((keys == '') | (keys == 'nan')).to_numpy()
+    if missing.any():
+        keys[missing] = [book_key('', title, author) for title, author in zip(
+            np.asarray(titles, dtype=object)[missing], np.asarray(authors, dtype=object)[missing])]
+    return keys.tolist()
+
+
+def compact_dtypes(chunk):
+    """Small ints for ratings, float32 pages, and a fixed categorical for the shelf."""
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        key = normalize_column(col)
+        if key == 'my_rating':
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(0).astype(np.int8)
+        elif key == 'number_of_pages':
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype(np.float32)
+        elif key == 'exclusive_shelf':
+            chunk[col] = chunk[col].astype(SHELF_DTYPE)
+    return chunk
+
+
+def read_export_chunks(file_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield a Goodreads export in chunks with every column and row, as get_blurbs passes it on."""
+    yield from pd.read_csv(file_path, dtype=TEXT_COLUMNS, chunksize=chunksize)
+
+
+def read_shelved_chunks(file_path, columns, chunksize=DEFAULT_CHUNKSIZE, shelves=RELEVANT_SHELVES):
+    """Yield compact chunks of a Goodreads export, keeping only `columns` and rows on `shelves`.
+
+    Column names are matched after normalization ('My Rating' ~ 'my_rating') and
+    returned as they appear in the file. Raises FileNotFoundError like read_csv.
+    """
+    wanted = {normalize_column(c) for c in columns}
+    reader = pd.read_csv(
+        file_path,
+        usecols=lambda c: normalize_column(c) in wanted,
+        dtype={**TEXT_COLUMNS, 'Exclusive Shelf': str},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        shelf_col = next((c for c in chunk.columns if normalize_column(c) == 'exclusive_shelf'), None)
+        if shelf_col is None:
+            raise ValueError("The required column 'exclusive_shelf' is missing from the dataset.")
+        yield compact_dtypes(chunk[chunk[shelf_col].isin(shelves)])
@@ -1,80 +1,204 @@
+import os
+
+import numpy as np
 import pandas as pd
 from langchain.docstore.document import Document
 from tqdm import tqdm
 
-def load_and_prep_data(file_path):
+from utils.context_budget import DEFAULT_REVIEW_TOKENS, summarize_review
+from utils.goodreads_csv import DEFAULT_CHUNKSIZE, PREP_COLUMNS, normalize_column, read_shelved_chunks
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")
+
+
+def _clean_chunk(chunk, warn_missing_blurb=False):
+    chunk.columns = [normalize_column(col) for col in chunk.columns]
+    chunk['my_review'] = chunk['my_review'].fillna('') if 'my_review' in chunk.columns else ''
+    if 'blurb' in chunk.columns:
+        chunk['blurb'] = chunk['blurb'].fillna('')
+    else:
+        if warn_missing_blurb:
+            print("Warning: 'blurb' column not found in the CSV.")
+            print("Blurbs will be missing. Please run 'get_blurbs_env.py' first.")
+        chunk['blurb'] = ''
+    return chunk
+
+
+def _read_parquet_cache(parquet_cache, signature, chunksize):
+    """Chunks from the Parquet cache, or None if it is missing, stale or unreadable."""
+    if not parquet_cache or not os.path.exists(parquet_cache):
+        return None
+    try:
+        import pyarrow.parquet as pq
+        cached = pq.ParquetFile(parquet_cache)
+    except Exception:
+        return None
+    if (cached.schema_arrow.metadata or {}).get(b"source") != signature:
+        return None
+    return (batch.to_pandas() for batch in cached.iter_batches(batch_size=chunksize))
+
+
+class _ParquetCacheWriter:
+    """Streams cleaned chunks into `<path>.tmp`; finish() publishes it atomically."""
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.writer = None
+
+    def write(self, chunk):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(chunk, preserve_index=False,
+                                     schema=self.writer.schema if self.writer else None)
+        if self.writer is None:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"source": self.signature})
+            self.writer = pq.ParquetWriter(self.path + ".tmp", table.schema)
+        self.writer.write_table(table)
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path + ".tmp", self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.remove(self.path + ".tmp")
+
+
+def iter_prepped_chunks(file_path, chunksize=DEFAULT_CHUNKSIZE, parquet_cache=None):
+    """Yield the cleaned export chunk by chunk; the whole file is never held in memory.
+
+    With `parquet_cache`, the cleaned rows are also streamed into a Parquet file
+    and later calls read that instead of the CSV until the CSV changes.
+    """
     try:
-        df = pd.read_csv(file_path)
+        signature = _source_signature(file_path)
     except FileNotFoundError:
         print(f"Error: File not found at {file_path}")
         print("Have you run the 'get_blurbs_env.py' script first?")
+        return
+
+    cached = _read_parquet_cache(parquet_cache, signature, chunksize)
+    if cached is not None:
+        print(f"Reading the cleaned library from '{parquet_cache}'.")
+        yield from cached
+        return
+
+    writer = None
+    if parquet_cache:
+        try:
+            import pyarrow  # noqa: F401
+            writer = _ParquetCacheWriter(parquet_cache, signature)
+        except ImportError:
+            print("Warning: pyarrow is not installed; skipping the Parquet cache.")
+
+    try:
+        for n, chunk in enumerate(read_shelved_chunks(file_path, PREP_COLUMNS, chunksize)):
+            chunk = _clean_chunk(chunk, warn_missing_blurb=n == 0)
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+    except BaseException:
+        # Includes a consumer that stops early: a partial cache must never be published.
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.finish()
+
+
+def load_and_prep_data(file_path, chunksize=DEFAULT_CHUNKSIZE, parquet_cache=None):
+    chunks = list(iter_prepped_chunks(file_path, chunksize, parquet_cache))
+    if not chunks:
         return pd.DataFrame()
-    
-    original_columns = df.columns
-    new_columns = [col.lower().replace(' ', '_').replace('-', '_') for col in original_columns]
-    df.columns = new_columns
-    relevant_shelves = ['read', 'dnf', 'did-not-finish', 'to-read']
-    if 'exclusive_shelf' not in df.columns:
-        raise ValueError("The required column 'exclusive_shelf' is missing from the dataset.")
-        
-    df_filtered = df[df['exclusive_shelf'].isin(relevant_shelves)].copy()
-    df_filtered['my_review'] = df_filtered['my_review'].fillna('')
-    if 'blurb' in df_filtered.columns:
-        df_filtered['blurb'] = df_filtered['blurb'].fillna('')
-    else:
-        print("Warning: 'blurb' column not found in the CSV.")
-        print("Blurbs will be missing. Please run 'get_blurbs_env.py' first.")
-        df_filtered['blurb'] = ''
-    return df_filtered
+    return pd.concat(chunks)
 
 
-def create_book_documents(df):
-    docs = []
-    print("Creating documents (blurb-only) for vector store...")
-    
-    for _, row in tqdm(df.iterrows(), total=len(df)):
-        
-        blurb_text = str(row.get('blurb', '')).strip()
-        review_text = str(row.get('my_review', '')).strip()
-        rating = row.get('my_rating', 0)
-        shelf = row.get('exclusive_shelf', 'unknown')
-        pages = row.get('number_of_pages', 'unknown')
-        title = row.get('title', 'N/A')
-        author = row.get('author', 'N/A')
-
-        page_content = blurb_text
-        
-        if (not page_content or 
-            'no blurb found' in page_content.lower() or 
-            'book not found' in page_content.lower() or
-            'api request error' in page_content.lower()):
-            page_content = f"Title: {title}\nAuthor: {author}"
-            blurb_text = "" 
-
-        meta = {
+DNF_SHELVES = ['dnf', 'did-not-finish']
+MISSING_BLURB_MARKERS = ['no blurb found', 'book not found', 'api request error']
+
+
+def _text_column(df, column, default):
+    """Column as strings the way str() would render each cell (NaN -> 'nan')."""
+    if column not in df.columns:
+        return pd.Series(str(default), index=df.index, dtype=object)
+    return df[column].astype(str).fillna('nan')
+
+
+def _raw_column(df, column, default):
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    return df[column]
+
+
+def user_verdicts(shelves, ratings):
+    """Verdict label per row: DNF shelf first, then by star rating."""
+    ratings = np.asarray(ratings)
+    stars = ratings.astype(str)
+    return np.select(
+        [np.isin(np.asarray(shelves, dtype=object), DNF_SHELVES), ratings >= 4, ratings == 3, ratings > 0],
+        [
+            "[USER OPINION: STRONGLY NEGATIVE (Did Not Finish)]",
+            np.char.add(np.char.add("[USER OPINION: EXTRAORDINARY (", stars), "/5 stars)]"),
+            np.char.add(np.char.add("[USER OPINION: GOOD (", stars), "/5 stars)]"),
+            np.char.add(np.char.add("[USER OPINION: NEGATIVE (", stars), "/5 stars)]"),
+        ],
+        default="",
+    ).astype(object)
+
+
+def iter_book_documents(df, review_summary_tokens=DEFAULT_REVIEW_TOKENS):
+    """Yield one Document per row; every per-row decision is made column-wise up front."""
+    titles = _raw_column(df, 'title', 'N/A')
+    authors = _raw_column(df, 'author', 'N/A')
+    shelves = _raw_column(df, 'exclusive_shelf', 'unknown')
+    ratings = pd.to_numeric(_raw_column(df, 'my_rating', 0), errors='coerce').fillna(0).astype(np.int64)
+    pages = pd.to_numeric(_raw_column(df, 'number_of_pages', 0), errors='coerce')
+    pages = pages.where(pages >= 0).fillna(0).astype(np.int64)
+
+    blurbs = _text_column(df, 'blurb', '').str.strip()
+    missing_blurb = (blurbs == '') | blurbs.str.lower().str.contains('|'.join(MISSING_BLURB_MARKERS), regex=True)
+    fallback = "Title: " + titles.astype(str).fillna('nan') + "\nAuthor: " + authors.astype(str).fillna('nan')
+    page_contents = fallback.where(missing_blurb, blurbs)
+    blurbs = blurbs.mask(missing_blurb, '')
+
+    reviews = _text_column(df, 'my_review', '').str.strip()
+    reviews = reviews.mask(reviews == 'nan', '').str.replace('<br/>', '\n', regex=False)
+    # The prompt only ever sees a compact version of long reviews; work it out once here.
+    summaries = reviews.map(lambda review: summarize_review(review, review_summary_tokens) if review else '')
+    verdicts = user_verdicts(shelves, ratings)
+    book_ids = _text_column(df, 'book_id', '')
+
+    columns = zip(page_contents.tolist(), titles.tolist(), authors.tolist(), ratings.tolist(), pages.tolist(),
+                  shelves.tolist(), book_ids.tolist(), blurbs.tolist(), reviews.tolist(), summaries.tolist(),
+                  verdicts.tolist())
+    for page_content, title, author, rating, n_pages, shelf, book_id, blurb, review, summary, verdict in tqdm(
+            columns, total=len(df)):
+        yield Document(page_content=page_content, metadata={
             "title": title,
             "author": author,
-            "rating": int(rating),
-            "pages": int(pages) if str(pages).isdigit() else 0,
+            "rating": rating,
+            "pages": n_pages,
             "shelf": shelf,
-            "book_id": str(row.get('book_id', '')),
-            "clean_blurb": blurb_text, 
-            "my_review": review_text.replace('<br/>', '\n') if review_text and review_text != 'nan' else "",
-            "user_verdict": "" 
-        }
-
-        user_verdict = ""
-        if shelf in ['dnf', 'did-not-finish']:
-            user_verdict = "[USER OPINION: STRONGLY NEGATIVE (Did Not Finish)]"
-        elif rating >= 4:
-            user_verdict = f"[USER OPINION: EXTRAORDINARY ({rating}/5 stars)]"
-        elif rating == 3:
-            user_verdict = f"[USER OPINION: GOOD ({rating}/5 stars)]"
-        elif rating > 0:
-            user_verdict = f"[USER OPINION: NEGATIVE ({rating}/5 stars)]"
-        
-        meta['user_verdict'] = user_verdict
-
-        docs.append(Document(page_content=page_content, metadata=meta))
-    
-    return docs
\ No newline at end of file
+            "book_id": book_id,
+            "clean_blurb": blurb,
+            "my_review": review,
+            "review_summary": summary,
+            "user_verdict": verdict,
+        })
+
+
+def iter_book_documents_from_csv(file_path, chunksize=DEFAULT_CHUNKSIZE, parquet_cache=None,
+                                 review_summary_tokens=DEFAULT_REVIEW_TOKENS):
+    for chunk in iter_prepped_chunks(file_path, chunksize, parquet_cache):
+        yield from iter_book_documents(chunk, review_summary_tokens)
+
+
+def create_book_documents(df):
+    print("Creating documents (blurb-only) for vector store...")
+    return list(iter_book_documents(df))
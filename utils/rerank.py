@@ -0,0 +1,116 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+# A DNF book among this many closest matches is pinned to the front of the context.
+PIN_WINDOW = 5
+
+
+class RankedBook(NamedTuple):
+    """One retrieved book with its scores. `metadata` is the shared, read-only store metadata."""
+    book_id: str
+    metadata: dict
+    original_score: float
+    adjustment: float
+    rerank_score: float
+    is_pinned_match: bool = False
+
+
+def is_dnf_shelf(shelf) -> bool:
+    shelf = str(shelf or "").lower()
+    return 'dnf' in shelf or 'did-not-finish' in shelf
+
+
+class LibraryTable:
+    """Column view of every book in the store, built once per store version.
+
+    Retrieval hands back row indices; ratings and shelf flags are looked up as
+    NumPy columns instead of being re-read from each Document's metadata.
+    """
+
+    def __init__(self, ids, metadatas):
+        self.ids = list(ids)
+        self.metadatas = list(metadatas)
+        self.row_of = {book_id: i for i, book_id in enumerate(self.ids)}
+        self.ratings = np.array([int(m.get('rating', 0) or 0) for m in self.metadatas], dtype=np.int16)
+        self.liked = self.ratings >= 4
+        self.dnf = np.array([is_dnf_shelf(m.get('shelf')) for m in self.metadatas], dtype=bool)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        stored = vectorstore.get(include=["metadatas"])
+        return cls(stored["ids"], stored["metadatas"])
+
+    def rows(self, ids):
+        return np.array([self.row_of.get(book_id, -1) for book_id in ids], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def hybrid_rerank(scores, liked, dnf, rating_boost: float, dnf_penalty: float):
+    """Vectorized score adjustment (lower is better, like the distances it starts from).
+
+    Works on 1-D candidate lists and on 2-D (queries x candidates) blocks alike.
+    Returns (order, rerank_scores, adjustments), `order` sorting each row ascending.
+    """
+    adjustments = np.where(dnf, dnf_penalty, 0.0) - np.where(liked, rating_boost, 0.0)
+    rerank_scores = np.asarray(scores, dtype=np.float64) + adjustments
+    order = np.argsort(rerank_scores, axis=-1, kind="stable")
+    return order, rerank_scores, adjustments
+
+
+def rank_candidates_batch(table: LibraryTable, rows, scores, k: int, rating_boost: float,
+                          dnf_penalty: float, pin_window: int = PIN_WINDOW) -> list[list[RankedBook]]:
+    """Pick the k context books for a block of queries at once.
+
+    `rows` and `scores` are (queries x candidates) arrays sorted by distance per
+    query; rows < 0 mark empty or excluded slots. In each query, a DNF book among
+    the `pin_window` closest valid matches is pinned to the front and everything
+    else is ordered by hybrid_rerank.
+    """
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.int64))
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    valid = rows >= 0
+    safe_rows = np.where(valid, rows, 0)
+    liked = table.liked[safe_rows] & valid
+    dnf = table.dnf[safe_rows] & valid
+
+    # Position of each valid candidate among its query's valid candidates.
+    valid_rank = np.cumsum(valid, axis=1) - 1
+    pin_candidates = dnf & (valid_rank < pin_window)
+    has_pin = pin_candidates.any(axis=1)
+    pin_col = pin_candidates.argmax(axis=1)
+
+    _, rerank_scores, adjustments = hybrid_rerank(scores, liked, dnf, rating_boost, dnf_penalty)
+    excluded = ~valid
+    excluded[has_pin, pin_col[has_pin]] = True
+    # Push excluded slots behind every real candidate.
+    rerank_scores = np.where(excluded, np.inf, rerank_scores)
+    order = np.argsort(rerank_scores, axis=1, kind="stable")
+
+    results = []
+    for q in range(rows.shape[0]):
+        picked = []
+        if has_pin[q]:
+            c = pin_col[q]
+            row = rows[q, c]
+            picked.append(RankedBook(table.ids[row], table.metadatas[row], float(scores[q, c]), 0.0,
+                                     float(scores[q, c]), True))
+        for c in order[q]:
+            if len(picked) >= k or excluded[q, c]:
+                break
+            row = rows[q, c]
+            picked.append(RankedBook(table.ids[row], table.metadatas[row], float(scores[q, c]),
+                                     float(adjustments[q, c]), float(rerank_scores[q, c])))
+        results.append(picked)
+    return results
+
+
+def rank_candidates(table: LibraryTable, rows, scores, k: int, rating_boost: float,
+                    dnf_penalty: float, pin_window: int = PIN_WINDOW) -> list[RankedBook]:
+    """Single-query form of rank_candidates_batch."""
+    if len(rows) == 0:
+        return []
+    return rank_candidates_batch(table, [rows], [scores], k, rating_boost, dnf_penalty, pin_window)[0]
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+def normalize_blurb(blurb):
+    return re.sub(r"\s+", " ", blurb).strip()
+
+
+def response_key(blurb, k, rating_boost, dnf_penalty, chat_model, embed_model, store_version,
+                 candidate_pool=100, context_budget=None, profile_n_probe=0):
+    raw = json.dumps([
+        normalize_blurb(blurb), int(k), round(float(rating_boost), 4), round(float(dnf_penalty), 4),
+        chat_model, embed_model, store_version, int(candidate_pool),
+        list(context_budget) if context_budget is not None else None,
+    # Exact search (n_probe 0) finds the same books as before, so only a capped search changes the key.
+    ] + ([int(profile_n_probe)] if profile_n_probe else []))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LRU of finished recommendations.
+
+    Every entry remembers the store version it was computed against; writing an
+    entry for a newer version drops all entries from older ones.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, store_version TEXT NOT NULL,"
+            " value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, store_version, value):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses WHERE store_version != ?", (store_version,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, store_version, value, last_used) VALUES (?, ?, ?, ?)",
+                (key, store_version, json.dumps(value), time.time()),
+            )
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.conn.commit()
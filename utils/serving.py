@@ -0,0 +1,187 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing more work than the service is configured to hold."""
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding calls into micro-batches.
+
+    Each `embed(text)` waits at most `max_wait` seconds for company before its
+    batch is sent; a batch never exceeds `max_batch_size` texts, and at most
+    `max_in_flight` batches run at once. Must be used from one event loop.
+    """
+
+    def __init__(self, embed_documents, max_batch_size=32, max_wait=0.005, max_in_flight=2,
+                 max_pending=1024):
+        self.embed_documents = embed_documents
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-batch")
+        self.slots = None
+        self.queue = None
+        self.collector = None
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, text):
+        if self.collector is None:
+            self.queue = asyncio.Queue()
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+            self.collector = asyncio.create_task(self._collect())
+        if self.queue.qsize() >= self.max_pending:
+            raise Overloaded("too many texts waiting for embedding")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((text, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            asyncio.create_task(self._flush(batch))
+
+    async def _flush(self, batch):
+        try:
+            texts = list(dict.fromkeys(text for text, _ in batch))  # identical blurbs are embedded once
+            try:
+                vectors = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.embed_documents, texts
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            by_text = dict(zip(texts, vectors))
+            for text, future in batch:
+                if not future.done():  # the caller may have timed out
+                    future.set_result(by_text[text])
+            self.batches += 1
+            self.texts += len(batch)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "waiting": self.queue.qsize() if self.queue is not None else 0,
+        }
+
+    async def close(self):
+        if self.collector is not None:
+            self.collector.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GenerationQueue:
+    """Bounded admission for blocking LLM calls.
+
+    At most `max_concurrency` calls run at once and at most `max_waiting` wait
+    for a slot; beyond that `run` raises Overloaded right away so the caller can
+    answer 503. `timeout` covers waiting plus generating. A call that times out
+    keeps its slot until the LLM actually finishes, so the local model never
+    sees more than `max_concurrency` requests.
+    """
+
+    def __init__(self, max_concurrency=2, max_waiting=16, timeout=120.0):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self.semaphore = None
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def run(self, fn, *args):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded("generation queue is full")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+
+        self.waiting += 1
+        try:
+            await self._acquire(self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        future = loop.run_in_executor(self.executor, fn, *args)
+
+        def release(done):
+            if not done.cancelled():
+                done.exception()  # a timed-out caller no longer looks at it
+            self.active -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+
+    async def _acquire(self, timeout):
+        """Take a slot within `timeout` seconds, or raise without holding one.
+
+        wait_for can give up (timeout or cancellation) in the same step in which
+        the semaphore grants the slot; depending on the Python version the slot
+        is then never released, or the cancellation is swallowed and the LLM
+        runs for a client that is gone. asyncio.wait reports a finished acquire
+        as done, and a grant that lands after the caller gave up is handed back.
+        """
+        acquire = asyncio.ensure_future(self.semaphore.acquire())
+        done = set()
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=timeout)
+        finally:
+            if not done:
+                acquire.add_done_callback(self._release_unused)
+                acquire.cancel()
+        if not done:
+            raise asyncio.TimeoutError()
+        acquire.result()
+
+    def _release_unused(self, acquire):
+        if not acquire.cancelled() and acquire.exception() is None:
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
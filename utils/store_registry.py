@@ -0,0 +1,200 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_MAX_OPEN = 4
+# hnswlib's default M=16 keeps up to 2*M neighbour ids per vector on the bottom layer, plus bookkeeping.
+HNSW_LINK_BYTES = 2 * 16 * 4 + 64
+
+
+def store_nbytes(store):
+    """Rough memory an open store holds: its vectors, plus Chroma's graph links or the NumPy store's table."""
+    nbytes = getattr(store, "nbytes", None)
+    if callable(nbytes):
+        return int(nbytes())
+    collection = getattr(store, "_collection", None)
+    if collection is None:
+        return 0
+    count = collection.count()
+    if not count:
+        return 0
+    dim = len(collection.peek(1)["embeddings"][0])
+    return count * (4 * dim + HNSW_LINK_BYTES)
+
+
+def close_store(store):
+    """Release what an open store holds: Chroma's client, or the NumPy matrix."""
+    close = getattr(store, "close", None)
+    if close is not None:
+        close()
+        return
+    client = getattr(store, "_client", None)
+    if client is not None and hasattr(client, "close"):
+        client.close()
+
+
+class StoreRegistry:
+    """Bounded LRU of open vector stores, keyed by library.
+
+    `open_store(key)` opens a store; at most `max_open` stay open, and with
+    `max_bytes` the open stores' estimated memory (see store_nbytes) stays within
+    it too. The least recently used store is closed first, but the one just
+    opened is always kept. Loads happen outside the lock, and concurrent requests
+    for the same library wait for a single load.
+    A store leased with `lease(key)` is never closed underneath its user: if it
+    gets evicted meanwhile, it is closed when the last lease ends.
+    """
+
+    def __init__(self, open_store, max_open=DEFAULT_MAX_OPEN, on_close=None, max_bytes=0, size_of=store_nbytes):
+        self.open_store = open_store
+        self.max_open = max(1, int(max_open))
+        self.max_bytes = int(max_bytes or 0)  # 0 = no limit
+        self.on_close = on_close
+        self.size_of = size_of
+        self.lock = threading.Lock()
+        self.stores = OrderedDict()  # key -> store, least recently used first
+        self.sizes = {}              # key -> estimated bytes of the open store
+        self.loading = {}            # key -> Future of a load in progress
+        self.leases = {}             # key -> active lease count
+        self.retired = {}            # key -> evicted stores waiting for their leases to end
+        self.warmer = None
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.stores:
+                self.stores.move_to_end(key)
+                return self.stores[key]
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            store = self.open_store(key)
+            size = self.size_of(store)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.stores[key] = store
+            self.sizes[key] = size
+            self.opened += 1
+            evicted = self._evict_locked()
+        future.set_result(store)
+        self._close_all(evicted)
+        return store
+
+    def lease(self, key):
+        return _Lease(self, key)
+
+    def warm(self, key):
+        """Open `key` on a background thread; returns a Future of the store."""
+        with self.lock:
+            if key in self.stores:
+                done = Future()
+                done.set_result(self.stores[key])
+                return done
+            if self.warmer is None:
+                self.warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-warmer")
+            warmer = self.warmer
+        return warmer.submit(self.get, key)
+
+    def resize(self, max_open, max_bytes=None):
+        """New limits; `max_bytes` None keeps the current one, 0 lifts it."""
+        with self.lock:
+            self.max_open = max(1, int(max_open))
+            if max_bytes is not None:
+                self.max_bytes = int(max_bytes)
+            evicted = self._evict_locked()
+        self._close_all(evicted)
+
+    def close(self, key):
+        with self.lock:
+            store = self.stores.pop(key, None)
+            self.sizes.pop(key, None)
+            evicted = self._retire_locked(key, store) if store is not None else []
+        self._close_all(evicted)
+
+    def close_all(self):
+        with self.lock:
+            evicted = []
+            for key in list(self.stores):
+                evicted += self._retire_locked(key, self.stores.pop(key))
+            self.sizes.clear()
+            warmer, self.warmer = self.warmer, None
+        self._close_all(evicted)
+        if warmer is not None:
+            warmer.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self.lock:
+            return {"open": len(self.stores), "max_open": self.max_open, "bytes": sum(self.sizes.values()),
+                    "max_bytes": self.max_bytes, "opened": self.opened, "evicted": self.evicted,
+                    "libraries": list(self.stores)}
+
+    # --- internals (call with self.lock held unless noted) -----------------
+
+    def _over_budget_locked(self):
+        if len(self.stores) > self.max_open:
+            return True
+        return bool(self.max_bytes) and len(self.stores) > 1 and sum(self.sizes.values()) > self.max_bytes
+
+    def _evict_locked(self):
+        evicted = []
+        while self._over_budget_locked():
+            key, store = self.stores.popitem(last=False)
+            self.sizes.pop(key, None)
+            self.evicted += 1
+            evicted += self._retire_locked(key, store)
+        return evicted
+
+    def _retire_locked(self, key, store):
+        if self.leases.get(key):
+            self.retired.setdefault(key, []).append(store)
+            return []
+        return [(key, store)]
+
+    def _acquire(self, key):
+        with self.lock:
+            self.leases[key] = self.leases.get(key, 0) + 1
+        try:
+            return self.get(key)
+        except BaseException:
+            self._release(key)
+            raise
+
+    def _release(self, key):
+        with self.lock:
+            self.leases[key] -= 1
+            if self.leases[key]:
+                return
+            del self.leases[key]
+            retired = self.retired.pop(key, [])
+        self._close_all([(key, store) for store in retired])
+
+    def _close_all(self, evicted):
+        # Called without the lock: closing a store can take a while.
+        for key, store in evicted:
+            close_store(store)
+            if self.on_close is not None:
+                self.on_close(key, store)
+
+
+class _Lease:
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        return self.registry._acquire(self.key)
+
+    def __exit__(self, *exc):
+        self.registry._release(self.key)
+        return False
@@ -0,0 +1,43 @@
+import os
+import uuid
+
+VERSION_FILE = "store_version"
+# Present while an ingest is changing the store; the caches derived from it can't be trusted until it is gone.
+DIRTY_FILE = "store_dirty"
+
+
+def read_store_version(persist_dir):
+    try:
+        with open(os.path.join(persist_dir, VERSION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_store_version(persist_dir):
+    """Mark the store as changed; anything keyed on the old version becomes stale."""
+    version = uuid.uuid4().hex
+    tmp_path = os.path.join(persist_dir, VERSION_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(persist_dir, VERSION_FILE))
+    return version
+
+
+def mark_store_dirty(persist_dir):
+    """Call before the first change to the store: readers drop what they cached, and an
+    interrupted ingest leaves the marker behind so the next one rebuilds the derived caches."""
+    with open(os.path.join(persist_dir, DIRTY_FILE), "w", encoding="utf-8") as f:
+        f.write(read_store_version(persist_dir))
+    return bump_store_version(persist_dir)
+
+
+def store_is_dirty(persist_dir):
+    return os.path.exists(os.path.join(persist_dir, DIRTY_FILE))
+
+
+def mark_store_clean(persist_dir):
+    try:
+        os.remove(os.path.join(persist_dir, DIRTY_FILE))
+    except FileNotFoundError:
+        pass
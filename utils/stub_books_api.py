@@ -0,0 +1,90 @@
+"""Local stand-in for the Google Books volumes endpoint.
+
+Run it and point the fetcher at it:
+
+    python stub_books_api.py --port 8765 --error-rate 0.2
+    GOOGLE_BOOKS_API_URL=http://127.0.0.1:8765/books/v1/volumes python get_blurbs.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubBooksHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+
+        parsed = urlparse(self.path)
+        if parsed.path != "/books/v1/volumes":
+            self._send(404, {"error": "not found"})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            status = random.choice([429, 503])
+            self._send(status, {"error": {"code": status}}, headers={"Retry-After": "0"})
+            return
+
+        query = parse_qs(parsed.query).get("q", [""])[0]
+        description = server.books.get(query)
+        if description is None and query.startswith("isbn:") and server.books:
+            self._send(200, {"totalItems": 0})
+            return
+        if description is None:
+            description = f"A stub blurb for '{query}'."
+        self._send(200, {"totalItems": 1, "items": [{"volumeInfo": {"description": description}}]})
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=0, books=None, error_rate=0.0, latency=0.0):
+    """Start the stub in a daemon thread; returns (server, volumes_url).
+
+    `books` maps a query string (e.g. "isbn:9780000000001") to a description. When
+    it is given, unknown ISBN queries answer with totalItems=0 like the real API.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubBooksHandler)
+    server.daemon_threads = True
+    server.books = books or {}
+    server.error_rate = error_rate
+    server.latency = latency
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}/books/v1/volumes"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Google Books API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(args.port, error_rate=args.error_rate, latency=args.latency)
+    print(f"Stub Books API listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,185 @@
+"""Local stand-in for the Ollama HTTP API.
+
+Embeddings are deterministic hashed bag-of-words vectors, so texts that share
+words end up close together and retrieval results are meaningful. Generation
+(/api/generate and /api/chat, streamed as NDJSON like Ollama does) answers with
+a canned explanation whose verdict follows the liked/disliked books in the
+prompt. Point the project at it through the OLLAMA_HOST variable the Ollama
+client already reads:
+
+    python utils/stub_ollama.py --port 11435 --max-batch 16
+    OLLAMA_HOST=http://127.0.0.1:11435 python ingest.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def stub_embedding(text, dim=768):
+    vec = [0.0] * dim
+    for token in TOKEN_RE.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        idx = int.from_bytes(digest[:4], "little") % dim
+        vec[idx] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+FILLER = ("Looking at the books you treasured and the ones you abandoned, this story shares "
+          "their pacing, their themes and the kind of characters you tend to follow closely.").split()
+
+
+def stub_answer_words(prompt, n_words=60):
+    """A canned explanation of roughly n_words words ending in a verdict."""
+    liked = prompt.count("EXTRAORDINARY")
+    disliked = prompt.count("NEGATIVE")
+    verdict = "You will like this book." if liked >= disliked else "You will NOT like this book."
+    body = [FILLER[i % len(FILLER)] for i in range(max(0, n_words - len(verdict.split())))]
+    return body + verdict.split()
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            with server.lock:
+                server.embed_requests += 1
+                server.embedded_texts += len(inputs)
+            if server.max_batch and len(inputs) > server.max_batch:
+                # Mimic the '500 EOF' a local Ollama answers with when it is overloaded.
+                with server.lock:
+                    server.embed_failures += 1
+                self._send(500, {"error": "EOF"})
+                return
+            time.sleep(server.latency + server.per_item_latency * len(inputs))
+            self._send(200, {
+                "model": payload.get("model", ""),
+                "embeddings": [stub_embedding(text, server.dim) for text in inputs],
+            })
+        elif self.path in ("/api/generate", "/api/chat"):
+            self._generate(payload, chat=self.path == "/api/chat")
+        else:
+            self._send(404, {"error": f"unsupported endpoint {self.path}"})
+
+    def _generate(self, payload, chat):
+        server = self.server
+        if chat:
+            prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        else:
+            prompt = payload.get("prompt", "")
+        words = stub_answer_words(prompt, server.answer_words)
+        with server.lock:
+            server.generate_requests += 1
+            server.active_generations += 1
+            server.peak_generations = max(server.peak_generations, server.active_generations)
+        try:
+            time.sleep(server.first_token_latency)
+            model = payload.get("model", "")
+
+            def part(text, done):
+                base = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "done": done}
+                if chat:
+                    base["message"] = {"role": "assistant", "content": text}
+                else:
+                    base["response"] = text
+                if done:
+                    base.update(done_reason="stop", prompt_eval_count=len(prompt.split()), eval_count=len(words))
+                return base
+
+            if not payload.get("stream", True):
+                time.sleep(server.token_latency * len(words))
+                self._send(200, part(" ".join(words), True))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                time.sleep(server.token_latency)
+                self._write_chunk(part(word if i == 0 else " " + word, False))
+            self._write_chunk(part("", True))
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            with server.lock:
+                server.active_generations -= 1
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_ollama(port=0, dim=768, max_batch=0, latency=0.0, per_item_latency=0.0,
+                      first_token_latency=0.0, token_latency=0.0, answer_words=60):
+    """Start the stub in a daemon thread; returns (server, base_url).
+
+    `max_batch` > 0 makes embed requests with more inputs fail with HTTP 500.
+    Generation waits `first_token_latency`, then `token_latency` per word.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.dim = dim
+    server.max_batch = max_batch
+    server.latency = latency
+    server.per_item_latency = per_item_latency
+    server.embed_requests = 0
+    server.embedded_texts = 0
+    server.embed_failures = 0
+    server.first_token_latency = first_token_latency
+    server.token_latency = token_latency
+    server.answer_words = answer_words
+    server.generate_requests = 0
+    server.active_generations = 0
+    server.peak_generations = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--max-batch", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--per-item-latency", type=float, default=0.002)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--answer-words", type=int, default=60)
+    args = parser.parse_args()
+
+    server, url = start_stub_ollama(args.port, args.dim, args.max_batch, args.latency, args.per_item_latency,
+                                    args.first_token_latency, args.token_latency, args.answer_words)
+    print(f"Stub Ollama listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+
+from utils.ann_index import kmeans
+from utils.rerank import hybrid_rerank, is_dnf_shelf
+from utils.vector_index import normalize_rows
+
+MODEL_FILE = "taste_model.npz"
+# How hard the DNF centroid pushes a taste query away, relative to the liked books pulling it (Rocchio's gamma/beta).
+DNF_PUSH = 0.25
+
+
+def like_labels(metadatas):
+    """1 = liked (4-5 stars), 0 = disliked (DNF or 1-2 stars), -1 = no signal (3 stars, unrated, to-read)."""
+    labels = np.full(len(metadatas), -1, dtype=np.int8)
+    for i, meta in enumerate(metadatas):
+        rating = int(meta.get('rating', 0) or 0)
+        if is_dnf_shelf(meta.get('shelf')) or 1 <= rating <= 2:
+            labels[i] = 0
+        elif rating >= 4:
+            labels[i] = 1
+    return labels
+
+
+class TasteModel:
+    """L2-regularized logistic regression on blurb embeddings -> P(user likes the book).
+
+    Logistic regression outputs calibrated probabilities on its training
+    distribution, and scoring is a single dot product, so a verdict takes
+    well under a millisecond once the blurb is embedded.
+    """
+
+    def __init__(self, weights=None, bias=0.0, store_version="", n_train=0):
+        self.weights = weights
+        self.bias = bias
+        self.store_version = store_version
+        self.n_train = n_train
+
+    def fit(self, vectors, labels, l2=1.0, steps=500, learning_rate=2.0):
+        X = normalize_rows(vectors).astype(np.float64)
+        y = np.asarray(labels, dtype=np.float64)
+        self.n_train = len(y)
+        prior = np.clip(y.mean() if len(y) else 0.5, 1e-3, 1 - 1e-3)
+        self.weights = np.zeros(X.shape[1])
+        self.bias = float(np.log(prior / (1 - prior)))
+        if len(np.unique(y)) < 2:
+            return self  # one class only: the prior is all we can say
+        # Full-batch gradient descent; the loss is convex and libraries are small.
+        for _ in range(steps):
+            p = 1.0 / (1.0 + np.exp(-(X @ self.weights + self.bias)))
+            error = p - y
+            self.weights -= learning_rate * (X.T @ error / len(y) + l2 * self.weights / len(y))
+            self.bias -= learning_rate * error.mean()
+        return self
+
+    def predict_proba(self, vectors):
+        X = normalize_rows(np.atleast_2d(vectors)).astype(np.float64)
+        return 1.0 / (1.0 + np.exp(-(X @ self.weights + self.bias)))
+
+    def save(self, persist_dir):
+        path = os.path.join(persist_dir, MODEL_FILE)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, weights=self.weights, bias=self.bias,
+                 store_version=self.store_version, n_train=self.n_train)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir):
+        path = os.path.join(persist_dir, MODEL_FILE)
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"]), str(data["store_version"]), int(data["n_train"]))
+
+
+def train_from_store(vectorstore, store_version=""):
+    stored = vectorstore.get(include=["embeddings", "metadatas"])
+    labels = like_labels(stored["metadatas"])
+    mask = labels >= 0
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    if not mask.any():
+        return None
+    return TasteModel(store_version=store_version).fit(vectors[mask], labels[mask])
+
+
+def taste_queries(vectors, liked, dnf, rating_boost=0.3, dnf_penalty=0.4, n_queries=4, seed=0):
+    """Query vectors describing what the user likes, for searching beyond the library.
+
+    The books are weighted by the same adjustments hybrid_rerank applies: the ones
+    it boosts are split by k-means into up to `n_queries` tastes, and each taste's
+    centroid is moved away from the centroid of the ones it penalizes (Rocchio).
+    Returns (queries, members), `members[i]` being the rows of taste i's books,
+    closest to its centroid first.
+    """
+    vectors = normalize_rows(vectors)
+    _, _, adjustments = hybrid_rerank(np.zeros(len(vectors)), liked, dnf, rating_boost, dnf_penalty)
+    positive, negative = np.flatnonzero(adjustments < 0), np.flatnonzero(adjustments > 0)
+    if len(positive) == 0:
+        return np.zeros((0, vectors.shape[1]), dtype=np.float32), []
+
+    centroids = kmeans(vectors[positive], min(n_queries, len(positive)), seed=seed)
+    labels = np.argmax(vectors[positive] @ centroids.T, axis=1)
+    push = np.zeros(vectors.shape[1], dtype=np.float32)
+    if len(negative):
+        push = DNF_PUSH * adjustments[negative].mean() * normalize_rows(vectors[negative].mean(axis=0))
+    queries, members = [], []
+    for i, centroid in enumerate(centroids):
+        rows = positive[labels == i]
+        if len(rows) == 0:
+            continue
+        pull = -adjustments[rows].mean()
+        queries.append(normalize_rows(pull * centroid - push))
+        members.append(rows[np.argsort(-(vectors[rows] @ centroid), kind="stable")])
+    return np.asarray(queries, dtype=np.float32), members
@@ -0,0 +1,313 @@
+"""The library's taste, precomputed at ingest time and stored next to the vector store.
+
+A TasteProfile keeps every book's unit vector with its liked/DNF/shelf flags,
+running sums for the liked, DNF and per-shelf centroids, and k-means prototypes
+over all the embeddings. It sits in front of the vector store: prototypes are
+scanned nearest first and a prototype is skipped once its radius shows that none
+of its books can make the candidate pool, so the result is the same as a full
+scan. When that would still leave most of the library to scan, search() gives
+up and the caller asks the store's own index instead. Whether a DNF book can be
+pinned is decided from the DNF centroid alone.
+
+The vectors are saved as a raw float32 file next to the profile and memory-mapped
+on load, so a loaded profile shares the page cache instead of holding its own copy.
+
+Ingest updates it in place (new books join their nearest prototype); k-means
+only runs again once the library has doubled or halved since it last did.
+"""
+import glob
+import os
+
+import numpy as np
+
+from utils.ann_index import assign, kmeans
+from utils.rerank import is_dnf_shelf
+from utils.vector_index import normalize_rows
+
+PROFILE_FILE = "taste_profile.npz"
+# Named after the store version, so a profile being read keeps its vectors while ingest saves the next one.
+VECTORS_FILE = "taste_profile.{}.f32"
+MAX_PROTOTYPES = 256
+# k-means runs again once the library has grown or shrunk by this factor since it last did.
+RETRAIN_FACTOR = 2.0
+
+
+def _flags(metadatas):
+    liked = np.array([int(m.get('rating', 0) or 0) >= 4 for m in metadatas], dtype=bool)
+    dnf = np.array([is_dnf_shelf(m.get('shelf')) for m in metadatas], dtype=bool)
+    shelves = np.array([str(m.get('shelf', 'unknown')) for m in metadatas], dtype=object)
+    return liked, dnf, shelves
+
+
+def _angle(cos):
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def _bound(query_cos, radius):
+    """Largest cosine any vector within `radius` (an angle) of a centroid can have with the query."""
+    return np.cos(np.maximum(0.0, _angle(query_cos) - radius))
+
+
+class TasteProfile:
+    def __init__(self, ids, vectors, liked, dnf, shelves, prototypes, labels, n_trained,
+                 stat_names=(), stat_sums=None, stat_counts=None, store_version=None, radii=None):
+        self.ids = list(ids)
+        self.prototypes = np.asarray(prototypes, dtype=np.float32)
+        self.dim = int(np.shape(vectors)[-1]) if len(self.ids) else self.prototypes.shape[-1]
+        self.vectors = np.asanyarray(vectors, dtype=np.float32).reshape(len(self.ids), self.dim)
+        self.liked, self.dnf = np.asarray(liked, dtype=bool), np.asarray(dnf, dtype=bool)
+        self.shelves = np.asarray(shelves, dtype=object)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.n_trained = int(n_trained)
+        self.sums = {name: np.asarray(s, dtype=np.float64)
+                     for name, s in zip(stat_names, stat_sums if stat_sums is not None else [])}
+        self.counts = {name: int(c) for name, c in zip(stat_names, stat_counts if stat_counts is not None else [])}
+        self.store_version = store_version
+        self._index(radii)
+
+    @classmethod
+    def from_rows(cls, ids, vectors, metadatas, store_version=None, n_prototypes=None):
+        if len(ids):
+            vectors = normalize_rows(vectors).reshape(len(ids), -1)
+        else:
+            # An empty store has no vectors to tell the dimension; the first upsert sets it.
+            vectors = np.zeros((0, np.shape(vectors)[-1] if np.ndim(vectors) == 2 else 0), dtype=np.float32)
+        liked, dnf, shelves = _flags(metadatas)
+        profile = cls(ids, vectors, liked, dnf, shelves, np.zeros((0, vectors.shape[1])), np.zeros(len(ids)), 0,
+                      store_version=store_version)
+        profile._count(np.arange(len(ids)), +1)
+        profile.train(n_prototypes)
+        return profile
+
+    @classmethod
+    def from_store(cls, vectorstore, store_version=None):
+        stored = vectorstore.get(include=["embeddings", "metadatas"])
+        return cls.from_rows(stored["ids"], stored["embeddings"], stored["metadatas"], store_version)
+
+    # --- Derived state ------------------------------------------------------
+
+    def _index(self, radii=None):
+        """Rows grouped by prototype, each prototype's radius (passed in when loaded from disk),
+        and the DNF books' radius."""
+        order = np.argsort(self.labels, kind="stable")
+        if np.any(order != np.arange(len(order))):
+            # Each prototype's books are kept as one contiguous block of rows.
+            self.ids = [self.ids[i] for i in order]
+            self.vectors, self.labels = self.vectors[order], self.labels[order]
+            self.liked, self.dnf, self.shelves = self.liked[order], self.dnf[order], self.shelves[order]
+            radii = None
+        self.row_of = {book_id: i for i, book_id in enumerate(self.ids)}
+        self.offsets = np.searchsorted(self.labels, np.arange(len(self.prototypes) + 1))
+        self.dnf_centroid = self.centroid("dnf")
+        self.dnf_radius = 0.0
+        if self.dnf_centroid is not None and self.dnf.any():
+            self.dnf_radius = float(_angle(self.vectors[self.dnf] @ self.dnf_centroid).max())
+        if radii is not None and len(radii) == len(self.prototypes):
+            self.radii = np.asarray(radii, dtype=np.float64)
+            return
+        self.radii = np.zeros(len(self.prototypes))
+        for p, (lo, hi) in enumerate(zip(self.offsets[:-1], self.offsets[1:])):
+            if hi > lo:
+                # Radius = the widest angle between a prototype and one of its books.
+                self.radii[p] = _angle(self.vectors[lo:hi] @ self.prototypes[p]).max()
+
+    def _count(self, rows, sign):
+        """Add (+1) or remove (-1) the rows' contribution to the liked, DNF and shelf sums."""
+        rows = np.asarray(list(rows), dtype=np.int64)
+        if not len(rows):
+            return
+        groups = {"all": rows, "liked": rows[self.liked[rows]], "dnf": rows[self.dnf[rows]]}
+        for shelf in np.unique(self.shelves[rows]):
+            groups[f"shelf:{shelf}"] = rows[self.shelves[rows] == shelf]
+        for name, members in groups.items():
+            if not len(members):
+                continue
+            self.sums.setdefault(name, np.zeros(self.dim))
+            self.sums[name] += sign * self.vectors[members].sum(axis=0, dtype=np.float64)
+            self.counts[name] = self.counts.get(name, 0) + sign * len(members)
+
+    def centroid(self, name):
+        """Unit centroid of "liked", "dnf", "all" or "shelf:<name>"; None if no book is in it."""
+        if self.counts.get(name, 0) <= 0:
+            return None
+        return normalize_rows(self.sums[name]).astype(np.float32)
+
+    def shelf_centroids(self):
+        return {name[len("shelf:"):]: self.centroid(name) for name in self.counts
+                if name.startswith("shelf:") and self.counts[name] > 0}
+
+    # --- Keeping it in sync with the store ------------------------------------
+
+    def train(self, n_prototypes=None):
+        """(Re)run k-means over every book; about sqrt(n) prototypes by default."""
+        n = len(self.ids)
+        if n == 0:
+            self.prototypes, self.labels = np.zeros((0, self.dim), dtype=np.float32), np.zeros(0, dtype=np.int32)
+        else:
+            n_prototypes = n_prototypes or min(MAX_PROTOTYPES, max(1, int(round(np.sqrt(n)))))
+            self.prototypes = kmeans(self.vectors, n_prototypes)
+            self.labels = assign(self.vectors, self.prototypes)
+        self.n_trained = n
+        self._index()
+
+    def delete(self, ids):
+        rows = [self.row_of[book_id] for book_id in ids if book_id in self.row_of]
+        if not rows:
+            return
+        self._count(rows, -1)
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[rows] = False
+        self.ids = [book_id for book_id, k in zip(self.ids, keep) if k]
+        self.vectors, self.labels = self.vectors[keep], self.labels[keep]
+        self.liked, self.dnf, self.shelves = self.liked[keep], self.dnf[keep], self.shelves[keep]
+        self._index()
+
+    def upsert(self, ids, vectors, metadatas):
+        """Add new books, or replace the vectors and flags of known ones; they join their nearest prototype."""
+        if not len(ids):
+            return
+        self.delete(ids)
+        vectors = normalize_rows(vectors)
+        liked, dnf, shelves = _flags(metadatas)
+        if not len(self.ids):
+            self.dim = vectors.shape[1]
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.liked, self.dnf = np.concatenate([self.liked, liked]), np.concatenate([self.dnf, dnf])
+        self.shelves = np.concatenate([self.shelves, shelves])
+        self._count(range(start, len(self.ids)), +1)
+        if not len(self.prototypes):
+            self.train()
+            return
+        self.labels = np.concatenate([self.labels, assign(vectors, self.prototypes)])
+        self._index()
+
+    def update_metadata(self, ids, metadatas):
+        """A new rating or shelf moves a book between centroids; its vector and prototype stay."""
+        rows = [self.row_of[book_id] for book_id in ids if book_id in self.row_of]
+        metadatas = [m for book_id, m in zip(ids, metadatas) if book_id in self.row_of]
+        if not rows:
+            return
+        self._count(rows, -1)
+        self.liked[rows], self.dnf[rows], self.shelves[rows] = _flags(metadatas)
+        self._count(rows, +1)
+        self._index()
+
+    def retrain_if_drifted(self):
+        n = len(self.ids)
+        if not len(self.prototypes) or n > self.n_trained * RETRAIN_FACTOR or n * RETRAIN_FACTOR < self.n_trained:
+            self.train()
+            return True
+        return False
+
+    def save(self, persist_dir, store_version):
+        self.store_version = store_version
+        names = sorted(self.sums)
+        path = os.path.join(persist_dir, PROFILE_FILE)
+        vectors_file = VECTORS_FILE.format(store_version)
+        vectors_path = os.path.join(persist_dir, vectors_file)
+        # Vectors first, then the profile pointing at them: readers never see a half-written pair.
+        np.ascontiguousarray(self.vectors, dtype=np.float32).tofile(vectors_path + ".tmp")
+        os.replace(vectors_path + ".tmp", vectors_path)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path, ids=np.array(self.ids, dtype=str), vectors_file=vectors_file, dim=self.dim,
+            liked=self.liked, dnf=self.dnf, shelves=self.shelves.astype(str), prototypes=self.prototypes,
+            labels=self.labels, radii=self.radii, n_trained=self.n_trained, stat_names=np.array(names, dtype=str),
+            stat_sums=np.array([self.sums[name] for name in names]).reshape(len(names), self.dim),
+            stat_counts=np.array([self.counts[name] for name in names], dtype=np.int64),
+            store_version=store_version,
+        )
+        os.replace(tmp_path, path)
+        for old_path in glob.glob(os.path.join(persist_dir, VECTORS_FILE.format("*"))):
+            if old_path != vectors_path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass  # still mapped by a reader on Windows; removed by a later save
+
+    @classmethod
+    def load(cls, persist_dir):
+        path = os.path.join(persist_dir, PROFILE_FILE)
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if "vectors_file" not in data.files:
+            return None  # saved before the vectors moved to their own file; rebuilt from the store
+        n, dim = len(data["ids"]), int(data["dim"])
+        if n:
+            try:
+                vectors = np.memmap(os.path.join(persist_dir, str(data["vectors_file"])), dtype=np.float32,
+                                    mode="r", shape=(n, dim))
+            except FileNotFoundError:
+                return None  # a newer profile was saved between reading this one and its vectors
+        else:
+            vectors = np.zeros((0, dim), dtype=np.float32)
+        return cls(
+            data["ids"].tolist(), vectors, data["liked"], data["dnf"], data["shelves"].astype(object),
+            data["prototypes"], data["labels"], int(data["n_trained"]), data["stat_names"].tolist(),
+            data["stat_sums"], data["stat_counts"], str(data["store_version"]), data["radii"],
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- Query side -------------------------------------------------------
+
+    def _scan(self, prototypes, query):
+        """(rows, similarities) of every book of `prototypes`; each one is a contiguous slice of rows."""
+        if not len(prototypes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        bounds = [(self.offsets[p], self.offsets[p + 1]) for p in prototypes]
+        return (np.concatenate([np.arange(lo, hi) for lo, hi in bounds]),
+                np.concatenate([self.vectors[lo:hi] @ query for lo, hi in bounds]))
+
+    def search(self, query_vector, n_results, n_probe=None):
+        """(ids, distances, rows_scanned) for one query, nearest first, or None.
+
+        Distances are squared L2 between unit vectors, like search_by_vectors. The
+        nearest prototypes are scanned until the pool is full; after that only
+        prototypes whose radius still allows a closer book than the worst one in
+        the pool are scanned, so the result is exact. None means pruning would
+        still scan more than half the library: the vector store answers that
+        query better. `n_probe` caps how many prototypes are scanned in total,
+        trading exactness for speed, and always gets an answer.
+        """
+        query = normalize_rows(query_vector)
+        n_results = min(n_results, len(self.ids))
+        if n_results == 0:
+            return [], np.zeros(0), 0
+        sizes = np.diff(self.offsets)
+        proto_cos = self.prototypes @ query
+        visit = np.argsort(-proto_cos, kind="stable")
+        if n_probe:
+            visit = visit[:n_probe]
+        first = int(np.searchsorted(np.cumsum(sizes[visit]), n_results)) + 1
+        if not n_probe and sizes[visit[:first]].sum() > len(self.ids) // 2:
+            return None
+        rows, sims = self._scan(visit[:first], query)
+
+        rest = visit[first:]
+        if len(rest) and len(sims) >= n_results:
+            worst = np.partition(sims, len(sims) - n_results)[len(sims) - n_results]
+            # A little slack so float32 rounding never skips a prototype that could still contribute.
+            rest = rest[_bound(proto_cos[rest], self.radii[rest]) >= worst - 1e-5]
+            if not n_probe and len(rows) + sizes[rest].sum() > len(self.ids) // 2:
+                return None
+            more_rows, more_sims = self._scan(rest, query)
+            rows, sims = np.concatenate([rows, more_rows]), np.concatenate([sims, more_sims])
+
+        n_results = min(n_results, len(rows))
+        top = np.argpartition(-sims, n_results - 1)[:n_results] if n_results < len(sims) else np.arange(len(sims))
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [self.ids[r] for r in rows[top]], 2.0 - 2.0 * sims[top], len(rows)
+
+    def dnf_pin_possible(self, query_vector, window_distance):
+        """False if no DNF book can be as close as `window_distance`, decided from the DNF centroid alone."""
+        if self.dnf_centroid is None:
+            return False
+        best_cos = _bound(float(self.dnf_centroid @ normalize_rows(query_vector)), self.dnf_radius)
+        # The same slack as search(), so float32 rounding never hides a DNF book at the window's edge.
+        return 2.0 - 2.0 * best_cos <= window_distance + 2e-5
@@ -0,0 +1,204 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+_current = contextvars.ContextVar("current_trace", default=None)
+_exporters = []
+_exporters_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English prose with Llama-style tokenizers.
+    return max(1, round(len(text) / 4)) if text else 0
+
+
+class Trace:
+    """Timing spans of one request. Spans are (name, start_ms, duration_ms, attributes)."""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.duration_ms = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.perf_counter()
+        try:
+            yield attributes  # callers may add attributes while the span is open
+        finally:
+            self.add_span(name, start, time.perf_counter(), **attributes)
+
+    def add_span(self, name, start, end, **attributes):
+        with self.lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": (start - self.start) * 1000,
+                "duration_ms": (end - start) * 1000,
+                **attributes,
+            })
+
+    def finish(self, **attributes):
+        """Stop the clock and hand the trace to the exporters (only the first call counts)."""
+        with self.lock:
+            if self.duration_ms is not None:
+                return
+            self.duration_ms = (time.perf_counter() - self.start) * 1000
+            self.attributes.update(attributes)
+        for exporter in list(_exporters):
+            try:
+                exporter.export(self)
+            except Exception as e:
+                print(f"Warning: trace exporter {type(exporter).__name__} failed: {e}")
+
+    def stage_ms(self):
+        """Total milliseconds per span name."""
+        totals = {}
+        for s in self.spans:
+            totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+        return totals
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+@contextmanager
+def activate(trace):
+    """Make `trace` the one that span() records into, for the duration of the block."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as part of the active trace; does nothing when no trace is active."""
+    trace = _current.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(name, **attributes) as attrs:
+        yield attrs
+
+
+def llm_span_callback(trace, name="llm_generate"):
+    """A LangChain callback handler that records the LLM call as a span of `trace`:
+    time to first token and prompt/output token counts.
+
+    Counts come from Ollama's prompt_eval_count/eval_count when the model reports
+    them, and are estimated from the text otherwise.
+    """
+    return _llm_span_callback_class()(trace, name)
+
+
+@lru_cache(maxsize=None)
+def _llm_span_callback_class():
+    # Defined on first use so importing this module does not import LangChain.
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMSpanCallback(BaseCallbackHandler):
+        def __init__(self, trace, name):
+            self.trace = trace
+            self.name = name
+            self.start = None
+            self.first_token = None
+            self.prompt = ""
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.start = time.perf_counter()
+            self.prompt = "".join(prompts)
+
+        def on_llm_new_token(self, token, **kwargs):
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+
+        def on_llm_end(self, response, **kwargs):
+            end = time.perf_counter()
+            generation = response.generations[0][0] if response.generations and response.generations[0] else None
+            text = generation.text if generation is not None else ""
+            info = (generation.generation_info or {}) if generation is not None else {}
+            prompt_tokens, output_tokens = info.get("prompt_eval_count"), info.get("eval_count")
+            self.trace.add_span(
+                self.name, self.start or end, end,
+                prompt_tokens=prompt_tokens if prompt_tokens is not None else estimate_tokens(self.prompt),
+                output_tokens=output_tokens if output_tokens is not None else estimate_tokens(text),
+                tokens_estimated=prompt_tokens is None or output_tokens is None,
+                first_token_ms=(self.first_token - self.start) * 1000 if self.first_token and self.start else None,
+            )
+
+    return LLMSpanCallback
+
+
+# --- Exporters --------------------------------------------------------------
+
+class LogExporter:
+    """One summary line per request, e.g. `[trace] recommendation 812 ms | embed_query 9.1 | ...`."""
+
+    def export(self, trace):
+        stages = " | ".join(f"{name} {ms:.1f}" for name, ms in trace.stage_ms().items())
+        print(f"[trace] {trace.name} {trace.duration_ms:.0f} ms | {stages}")
+
+
+class JsonlExporter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, trace):
+        line = json.dumps(trace.to_dict(), default=str)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class RingBufferExporter:
+    """Keeps the last `size` traces in memory (for the app's diagnostics panel)."""
+
+    def __init__(self, size=50):
+        self.traces = deque(maxlen=size)
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+    def recent(self, n=None):
+        traces = list(self.traces)
+        return traces[-n:] if n else traces
+
+
+def add_exporter(exporter):
+    with _exporters_lock:
+        if exporter not in _exporters:
+            _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter):
+    with _exporters_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+
+
+def configure_tracing(cfg):
+    """Set up the exporters named in the config's `trace_exporters` ("log", "jsonl")."""
+    names = cfg.get("trace_exporters") or []
+    if "log" in names and not any(isinstance(e, LogExporter) for e in _exporters):
+        add_exporter(LogExporter())
+    if "jsonl" in names and not any(isinstance(e, JsonlExporter) for e in _exporters):
+        add_exporter(JsonlExporter(cfg.get("trace_jsonl_path", "traces.jsonl")))
@@ -0,0 +1,189 @@
+import json
+import os
+
+import numpy as np
+
+INDEX_DIRNAME = "numpy_index"
+# Python's overhead for one book's id, metadata dict and document string beyond the text itself (measured
+# with tracemalloc on a 1500-book library).
+PY_OBJECT_BYTES = 640
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore:
+    """Exact cosine search over a memory-mapped float32 matrix.
+
+    Meant for personal libraries (thousands to tens of thousands of books), where
+    a brute-force matrix multiply beats the client/SQLite overhead of Chroma. On
+    disk it is `embeddings.f32` (unit-normalized rows) plus `table.json` holding
+    the parallel ids, metadatas and documents.
+
+    Distances are squared L2 between unit vectors (2 - 2·cos), which is what
+    Chroma's default space reports, so rerank weights mean the same on both backends.
+    """
+
+    def __init__(self, path, ids, metadatas, documents, matrix, embeddings=None):
+        self.path = path
+        self.ids = list(ids)
+        self.metadatas = list(metadatas)
+        self.documents = list(documents)
+        self.matrix = matrix
+        self.embeddings = embeddings
+        self.row_of = {book_id: i for i, book_id in enumerate(self.ids)}
+        self.loaded_mtime = None
+
+    @staticmethod
+    def _read(path):
+        table_path = os.path.join(path, "table.json")
+        mtime = os.stat(table_path).st_mtime_ns
+        with open(table_path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        count, dim = len(table["ids"]), table["dim"]
+        if count:
+            matrix = np.memmap(os.path.join(path, "embeddings.f32"), dtype=np.float32, mode="r",
+                               shape=(count, dim))
+        else:
+            matrix = np.zeros((0, dim), dtype=np.float32)
+        return table, matrix, mtime
+
+    @classmethod
+    def load(cls, persist_dir, embeddings=None):
+        path = os.path.join(persist_dir, INDEX_DIRNAME)
+        table, matrix, mtime = cls._read(path)
+        store = cls(path, table["ids"], table["metadatas"], table["documents"], matrix, embeddings)
+        store.loaded_mtime = mtime
+        return store
+
+    def reload_if_changed(self):
+        """Pick up a re-ingest made by another process; returns True if anything was reloaded."""
+        if os.stat(os.path.join(self.path, "table.json")).st_mtime_ns == self.loaded_mtime:
+            return False
+        table, matrix, mtime = self._read(self.path)
+        self.__init__(self.path, table["ids"], table["metadatas"], table["documents"], matrix, self.embeddings)
+        self.loaded_mtime = mtime
+        return True
+
+    @classmethod
+    def empty(cls, persist_dir, embeddings=None):
+        return cls(os.path.join(persist_dir, INDEX_DIRNAME), [], [], [],
+                   np.zeros((0, 0), dtype=np.float32), embeddings)
+
+    @classmethod
+    def exists(cls, persist_dir):
+        return os.path.exists(os.path.join(persist_dir, INDEX_DIRNAME, "table.json"))
+
+    # --- Query side -------------------------------------------------------
+
+    def search(self, query_vectors, n_results):
+        """Return (ids, distances) for each query, nearest first."""
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        n_results = min(n_results, len(self.ids))
+        if n_results == 0:
+            return [[] for _ in queries], np.zeros((len(queries), 0))
+        sims = queries @ np.asarray(self.matrix).T
+        if n_results < sims.shape[1]:
+            top = np.argpartition(-sims, n_results - 1, axis=1)[:, :n_results]
+        else:
+            top = np.tile(np.arange(sims.shape[1]), (len(queries), 1))
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        distances = 2.0 - 2.0 * np.take_along_axis(top_sims, order, axis=1)
+        return [[self.ids[i] for i in row] for row in top], distances
+
+    def get(self, ids=None, include=("metadatas", "documents")):
+        rows = range(len(self.ids)) if ids is None else [self.row_of[i] for i in ids if i in self.row_of]
+        result = {"ids": [self.ids[r] for r in rows]}
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[r] for r in rows]
+        if "documents" in include:
+            result["documents"] = [self.documents[r] for r in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self.matrix)[list(rows)]
+        return result
+
+    # --- Ingest side ------------------------------------------------------
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        vectors = normalize_rows(embeddings)
+        matrix = np.array(self.matrix) if self.matrix.size else np.zeros((0, vectors.shape[1]), np.float32)
+        new_rows = []
+        for book_id, vector, meta, doc in zip(ids, vectors, metadatas, documents):
+            row = self.row_of.get(book_id)
+            if row is None:
+                self.row_of[book_id] = len(self.ids)
+                self.ids.append(book_id)
+                self.metadatas.append(meta)
+                self.documents.append(doc)
+                new_rows.append(vector)
+            elif row < len(matrix):
+                matrix[row] = vector
+                self.metadatas[row], self.documents[row] = meta, doc
+            else:  # same id twice within this call
+                new_rows[row - len(matrix)] = vector
+                self.metadatas[row], self.documents[row] = meta, doc
+        if new_rows:
+            matrix = np.vstack([matrix, np.asarray(new_rows, dtype=np.float32)])
+        self.matrix = matrix
+
+    def update_metadata(self, ids, metadatas):
+        for book_id, meta in zip(ids, metadatas):
+            self.metadatas[self.row_of[book_id]] = meta
+
+    def delete(self, ids):
+        drop = {self.row_of[i] for i in ids if i in self.row_of}
+        if not drop:
+            return
+        keep = [r for r in range(len(self.ids)) if r not in drop]
+        self.matrix = np.asarray(self.matrix)[keep]
+        self.ids = [self.ids[r] for r in keep]
+        self.metadatas = [self.metadatas[r] for r in keep]
+        self.documents = [self.documents[r] for r in keep]
+        self.row_of = {book_id: i for i, book_id in enumerate(self.ids)}
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        matrix = np.ascontiguousarray(self.matrix, dtype=np.float32)
+        # Write both files under temporary names first so readers never see a half-written index.
+        matrix_tmp = os.path.join(self.path, "embeddings.f32.tmp")
+        table_tmp = os.path.join(self.path, "table.json.tmp")
+        matrix.tofile(matrix_tmp)
+        with open(table_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                "ids": self.ids,
+                "metadatas": self.metadatas,
+                "documents": self.documents,
+            }, f)
+        os.replace(matrix_tmp, os.path.join(self.path, "embeddings.f32"))
+        os.replace(table_tmp, os.path.join(self.path, "table.json"))
+
+    def nbytes(self):
+        """Rough memory the store takes once queried: the whole matrix is read by every search, plus the table."""
+        text = sum(len(doc) for doc in self.documents) + sum(len(str(meta)) for meta in self.metadatas)
+        return int(self.matrix.nbytes) + text + PY_OBJECT_BYTES * len(self.ids)
+
+    def close(self):
+        """Let go of the memory map; the store is empty afterwards."""
+        self.__init__(self.path, [], [], [], np.zeros((0, 0), dtype=np.float32), self.embeddings)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def search_by_vectors(vectorstore, query_vectors, n_results):
+    """(ids, distances) per query vector on either backend; Chroma accepts batched queries too."""
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.search(query_vectors, n_results)
+    result = vectorstore._collection.query(
+        query_embeddings=np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)),
+        n_results=n_results,
+        include=["distances"],
+    )
+    return result["ids"], np.asarray(result["distances"])